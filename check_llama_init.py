@@ -95,23 +95,26 @@ def perform_optimization(quiet: bool = False, force: bool = False) -> bool:
             # Load configuration
             config = load_config()
             
-            # Update hardware profile
-            optimizer._update_hardware_profile()
-            
-            # Optimize launch parameters
-            optimizer.optimize_compilation_flags()
-            optimizer.optimize_runtime_parameters()
-            
-            # If model available, run benchmarking
-            if os.path.exists(config.model_path):
-                if not quiet:
-                    logger.info(f"Running benchmark on model: {config.model_path}")
+            # Write the profile once for the whole pass
+            with optimizer.batched_save():
+                # Update hardware profile
+                optimizer._update_hardware_profile()
                 
-                try:
-                    optimizer.run_benchmark(config.model_path, iterations=1)
-                except Exception as e:
+                # Optimize launch parameters
+                optimizer.optimize_compilation_flags()
+                model_available = os.path.exists(config.model_path)
+                optimizer.optimize_runtime_parameters(config.model_path if model_available else None)
+                
+                # If model available, run benchmarking
+                if model_available:
                     if not quiet:
-                        logger.warning(f"Failed to run benchmarking: {e}")
+                        logger.info(f"Running benchmark on model: {config.model_path}")
+                    
+                    try:
+                        optimizer.run_benchmark(config.model_path, iterations=1)
+                    except Exception as e:
+                        if not quiet:
+                            logger.warning(f"Failed to run benchmarking: {e}")
             
             # If server not compiled yet, try to build it
             bin_dir = os.path.join("bin")
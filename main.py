@@ -64,6 +64,9 @@ def main():
         try:
             from src.core.hardware_optimizer import HardwareOptimizer
             optimizer = HardwareOptimizer()
+            # The constructor only reads the saved profile; refresh() creates it
+            # on first run and re-detects hardware if it is outdated
+            optimizer.refresh()
             optimized_params = optimizer.get_optimal_launch_parameters()
             
             # Update parameters from optimized profile if not explicitly specified in config
@@ -66,11 +66,26 @@ def main():
         help="Number of benchmark iterations", 
         default=3
     )
+    parser.add_argument(
+        "--vary-prompts", 
+        action="store_true", 
+        help="Use unique prompts with the prompt cache disabled (measures cold TTFT)"
+    )
     parser.add_argument(
         "--force", 
         action="store_true", 
         help="Force optimization even if profile is current"
     )
+    parser.add_argument(
+        "--pgo", 
+        action="store_true", 
+        help="Compile with profile-guided optimization (requires a model)"
+    )
+    parser.add_argument(
+        "--fast-math", 
+        action="store_true", 
+        help="Allow -Ofast when compiling (breaks strict IEEE NaN handling)"
+    )
     parser.add_argument(
         "--skip-compilation", 
         action="store_true", 
@@ -81,6 +96,7 @@ def main():
     
     # Initialize optimizer
     optimizer = HardwareOptimizer()
+    optimizer.config.allow_fast_math = args.fast_math
     
     if args.force:
         # Force create new profile when running with --force
@@ -104,8 +120,14 @@ def main():
             logger.info("Compilation stage skipped (--skip-compilation)")
         else:
             logger.info("Starting optimized server compilation")
+            optimizer.refresh()
             start_time = time.time()
-            success = optimizer.compile_optimized_server(args.llama_cpp)
+            if args.pgo and model_path:
+                success = optimizer.compile_pgo_server(model_path, args.llama_cpp, args.iterations)
+            else:
+                if args.pgo:
+                    logger.warning("PGO requires a model, compiling without profile")
+                success = optimizer.compile_optimized_server(args.llama_cpp)
             
             if success:
                 logger.info(f"Server compiled successfully in {time.time() - start_time:.1f} sec")
@@ -116,6 +138,7 @@ def main():
     if args.benchmark and model_path:
         # Run benchmark
         logger.info(f"Running benchmark on model: {model_path}")
+        optimizer.refresh()
         start_time = time.time()
         
         if args.skip_compilation:
@@ -131,12 +154,13 @@ def main():
             result = optimizer.run_benchmark(
                 model_path=model_path,
                 prompt=args.prompt,
-                iterations=args.iterations
+                iterations=args.iterations,
+                vary_prompts=args.vary_prompts
             )
         
         logger.info(f"Benchmark completed in {time.time() - start_time:.1f} sec")
         logger.info(f"Results: {result.tokens_per_second:.2f} tokens/sec, "
-                  f"latency: {result.latency_ms:.2f} ms")
+                  f"latency: {result.latency_ms:.2f} ms, TTFT: {result.ttft_ms:.2f} ms")
     else:
         # Simply update hardware profile and parameters
         if model_path:
@@ -151,9 +175,10 @@ def main():
         else:
             # Optimization without benchmarking
             logger.info("Starting optimization without benchmarking (model path not specified)")
-            optimizer._update_hardware_profile()
-            compilation_flags = optimizer.optimize_compilation_flags()
-            runtime_params = optimizer.optimize_runtime_parameters()
+            with optimizer.batched_save():
+                optimizer._update_hardware_profile()
+                compilation_flags = optimizer.optimize_compilation_flags()
+                runtime_params = optimizer.optimize_runtime_parameters()
             
             logger.info("Optimization complete. Estimated optimal parameters:")
             logger.info(f"- Threads: {runtime_params.n_threads}")
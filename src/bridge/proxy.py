@@ -19,8 +19,27 @@ import logging
 import requests
 import time
 import asyncio
+import functools
+import random
+import threading
 import aiohttp
-import backoff
+from urllib3.util.retry import Retry
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+try:
+    import msgspec
+    HAS_MSGSPEC = True
+except ImportError:
+    HAS_MSGSPEC = False
+try:
+    import httpx
+    import h2  # noqa: F401 - нужен httpx для HTTP/2
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
 from typing import Dict, List, Any, Optional, Union, Callable, Generator, AsyncGenerator
 from urllib.parse import urljoin
 
@@ -32,6 +51,237 @@ logging.basicConfig(
 
 logger = logging.getLogger("ExternalLLMProxy")
 
+# orjson разбирает bytes напрямую, без промежуточного decode('utf-8');
+# orjson.JSONDecodeError - подкласс json.JSONDecodeError
+_json_loads = orjson.loads if HAS_ORJSON else json.loads
+
+
+def _json_dumps(obj: Any) -> bytes:
+    """
+    Сериализует тело запроса в JSON-байты (orjson, без него - json).
+    
+    Тело передается как data= с заголовком Content-Type сессии; с orjson
+    массивы numpy сериализуются напрямую, без .tolist().
+    """
+    if HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj).encode("utf-8")
+
+if HAS_MSGSPEC:
+    class _SchemaStruct(msgspec.Struct):
+        """
+        Базовый класс схемы потокового ответа OpenAI API.
+        
+        Повторяет read-only часть интерфейса dict (get, in, []), поэтому
+        адаптер читает разобранные фрагменты так же, как результат json.loads.
+        Отсутствующие и null-поля считаются отсутствующими.
+        """
+        
+        def get(self, key: str, default: Any = None) -> Any:
+            value = getattr(self, key, None)
+            return default if value is None else value
+        
+        def __contains__(self, key: str) -> bool:
+            return getattr(self, key, None) is not None
+        
+        def __getitem__(self, key: str) -> Any:
+            value = getattr(self, key, None)
+            if value is None:
+                raise KeyError(key)
+            return value
+    
+    class _StreamDelta(_SchemaStruct):
+        content: Optional[str] = None
+    
+    class _StreamChoice(_SchemaStruct):
+        text: Optional[str] = None
+        delta: Optional[_StreamDelta] = None
+        finish_reason: Optional[str] = None
+    
+    class _StreamChunk(_SchemaStruct):
+        # null приходит во фрагментах usage и keep-alive; get() отдает его как отсутствующее поле
+        choices: Optional[List[_StreamChoice]] = None
+        error: Any = None
+    
+    # Декодер под фиксированную схему фрагмента: id, created, logprobs и прочие
+    # поля пропускаются при разборе, без построения промежуточных словарей
+    _decode_stream_chunk = msgspec.json.Decoder(_StreamChunk).decode
+    _STREAM_DECODE_ERRORS = (json.JSONDecodeError, msgspec.DecodeError)
+else:
+    _decode_stream_chunk = _json_loads
+    _STREAM_DECODE_ERRORS = (json.JSONDecodeError,)
+
+# HTTP-статусы временной перегрузки/недоступности (повторяются для идемпотентных запросов)
+_RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+# Статусы, с которыми сервер отклоняет запрос, не начав его выполнять: только
+# после них повторяется POST, иначе генерация выполнится (и оплатится) дважды
+_UNPROCESSED_STATUSES = frozenset((429, 503))
+_IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS"))
+
+
+class _SafeRetry(Retry):
+    """Retry urllib3, повторяющий неидемпотентные запросы только по 429/503."""
+    
+    def is_retry(self, method: str, status_code: int, has_retry_after: bool = False) -> bool:
+        if method.upper() not in _IDEMPOTENT_METHODS and status_code not in _UNPROCESSED_STATUSES:
+            return False
+        return super().is_retry(method, status_code, has_retry_after)
+
+# Размыкатель: после _BREAKER_FAILURES неудач подряд за _BREAKER_WINDOW секунд
+# запросы к конечной точке отклоняются без сети в течение _BREAKER_COOLDOWN секунд
+_BREAKER_FAILURES = 5
+_BREAKER_WINDOW = 30.0
+_BREAKER_COOLDOWN = 10.0
+_CIRCUIT_OPEN_ERROR = {"error": "circuit_open"}
+
+
+class _CircuitBreaker:
+    """
+    Размыкатель цепи для одной конечной точки API.
+    
+    Пока цепь разомкнута, запросы сразу получают ошибку circuit_open вместо
+    ожидания таймаутов недоступного сервера. После паузы цепь полуоткрыта:
+    пропускается один пробный запрос, остальные отклоняются до его результата.
+    Успех замыкает цепь, неудача снова размыкает ее. Если результат пробы не
+    отмечен (запрос отменен или упал с непредвиденной ошибкой), через
+    _BREAKER_COOLDOWN пропускается следующая проба.
+    """
+    
+    __slots__ = ("_failures", "_opened_at", "_probing", "_lock")
+    
+    def __init__(self):
+        self._failures: List[float] = []
+        self._opened_at: Optional[float] = None
+        # Время допуска пробного запроса полуоткрытой цепи (None - пробы нет)
+        self._probing: Optional[float] = None
+        self._lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        """Возвращает True, если запрос можно отправить."""
+        if self._opened_at is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            opened_at = self._opened_at
+            if opened_at is None:
+                return True
+            if now - opened_at < _BREAKER_COOLDOWN:
+                return False
+            if self._probing is not None and now - self._probing < _BREAKER_COOLDOWN:
+                return False
+            self._probing = now
+            return True
+    
+    def record_success(self) -> None:
+        """Отмечает успешный запрос: цепь замыкается."""
+        if self._failures or self._opened_at is not None:
+            with self._lock:
+                self._failures.clear()
+                self._opened_at = None
+                self._probing = None
+    
+    def record_failure(self) -> None:
+        """Отмечает неудачный запрос (после всех повторов)."""
+        now = time.monotonic()
+        with self._lock:
+            if self._opened_at is not None:
+                # Пробный запрос после паузы не прошел
+                self._opened_at = now
+                self._probing = None
+                return
+            self._failures = [t for t in self._failures if now - t < _BREAKER_WINDOW]
+            self._failures.append(now)
+            if len(self._failures) >= _BREAKER_FAILURES:
+                self._opened_at = now
+                self._failures.clear()
+                logger.warning(f"Цепь разомкнута на {_BREAKER_COOLDOWN:.0f}с после "
+                               f"{_BREAKER_FAILURES} неудачных запросов подряд")
+    
+    def record_result(self, result: Dict) -> None:
+        """Отмечает результат по ответу прокси: временные ошибки сервера - неудача."""
+        if result.get("status_code") in _RETRY_STATUSES:
+            self.record_failure()
+        else:
+            self.record_success()
+
+
+class _SSEParser:
+    """
+    Потоковый разборщик Server-Sent Events на уровне байтов.
+    
+    Байты из сети копятся в bytearray, кадры выделяются по разделителю
+    пустой строки (b"\\n\\n") через bytearray.find, без разбиения на строки и
+    decode('utf-8'). Наружу отдается полезная нагрузка data-строк как есть,
+    готовая для orjson/msgspec; служебный кадр [DONE] пропускается.
+    """
+    
+    __slots__ = ("_buffer",)
+    
+    def __init__(self):
+        self._buffer = bytearray()
+    
+    def feed(self, chunk: bytes) -> List[bytearray]:
+        """
+        Добавляет очередной фрагмент ответа.
+        
+        Args:
+            chunk: Байты, полученные из сети
+            
+        Returns:
+            List[bytearray]: Полезная нагрузка кадров, завершенных этим фрагментом
+        """
+        buffer = self._buffer
+        buffer += chunk
+        if b"\r" in buffer:
+            # CRLF-разделители; \r может прийти в конце предыдущего фрагмента
+            buffer[:] = buffer.replace(b"\r\n", b"\n")
+        
+        payloads = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n\n", start)
+            if end < 0:
+                break
+            payload = self._frame_payload(buffer, start, end)
+            if payload is not None:
+                payloads.append(payload)
+            start = end + 2
+        if start:
+            del buffer[:start]
+        return payloads
+    
+    def flush(self) -> List[bytearray]:
+        """
+        Завершает разбор: возвращает последний кадр, если поток закрылся без
+        пустой строки после него.
+        """
+        buffer = self._buffer
+        end = len(buffer)
+        while end and buffer[end - 1] == 0x0A:
+            end -= 1
+        payload = self._frame_payload(buffer, 0, end) if end else None
+        buffer.clear()
+        return [payload] if payload is not None else []
+    
+    @staticmethod
+    def _frame_payload(buffer: bytearray, start: int, end: int) -> Optional[bytearray]:
+        """Возвращает данные кадра buffer[start:end] или None для кадров без данных."""
+        if buffer.startswith(b"data: ", start, end) and buffer.find(b"\n", start, end) < 0:
+            # Типичный кадр из одной строки "data: {...}"
+            payload = buffer[start + 6:end]
+        else:
+            # Общий случай SSE: комментарии, event/id-поля, многострочные data
+            data_lines = []
+            for line in buffer[start:end].split(b"\n"):
+                if line.startswith(b"data:"):
+                    value = line[5:]
+                    data_lines.append(value[1:] if value.startswith(b" ") else value)
+            if not data_lines:
+                return None
+            payload = bytearray(b"\n".join(data_lines))
+        return None if payload == b"[DONE]" else payload
+
 
 class ExternalLLMProxy:
     """
@@ -47,7 +297,11 @@ class ExternalLLMProxy:
                 timeout: int = 60,
                 connection_retries: int = 3,
                 connection_retry_delay: float = 0.5,
-                verify_ssl: bool = True):
+                verify_ssl: bool = True,
+                pool_size: int = 16,
+                keepalive_timeout: float = 75,
+                connect_timeout: Optional[float] = None,
+                read_timeout: Optional[float] = None):
         """
         Инициализирует прокси для внешнего API.
         
@@ -58,13 +312,27 @@ class ExternalLLMProxy:
             connection_retries: Количество повторных попыток при сбоях сети
             connection_retry_delay: Задержка между повторными попытками в секундах
             verify_ssl: Проверять ли SSL-сертификаты (отключать только для тестирования)
+            pool_size: Число keep-alive соединений к API, переиспользуемых между запросами
+            keepalive_timeout: Время жизни простаивающего соединения aiohttp в секундах
+            connect_timeout: Таймаут установки соединения (по умолчанию timeout);
+                зависшее подключение обрывается быстро, не расходуя время чтения
+            read_timeout: Таймаут ожидания очередных байтов ответа (по умолчанию timeout)
         """
         self.api_url = api_url.rstrip('/')
         self.api_key = api_key
         self.timeout = timeout
+        self.connect_timeout = connect_timeout if connect_timeout is not None else timeout
+        self.read_timeout = read_timeout if read_timeout is not None else timeout
+        # requests принимает (connect, read); aiohttp - общий лимит и лимиты этапов
+        self._request_timeout = (self.connect_timeout, self.read_timeout)
+        self._aiohttp_timeout = aiohttp.ClientTimeout(
+            total=timeout, sock_connect=self.connect_timeout, sock_read=self.read_timeout
+        )
         self.connection_retries = connection_retries
         self.connection_retry_delay = connection_retry_delay
         self.verify_ssl = verify_ssl
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
         
         self.headers = {
             "Content-Type": "application/json"
@@ -73,19 +341,42 @@ class ExternalLLMProxy:
         if api_key:
             self.headers["Authorization"] = f"Bearer {api_key}"
             
-        # Создание сессии для эффективного переuse соединений
+        # Создание сессии для эффективного переuse соединений: TCP/TLS
+        # рукопожатие выполняется один раз на соединение пула, а не на запрос
         self.session = requests.Session()
         self.session.headers.update(self.headers)
         self.session.verify = verify_ssl
+        # urllib3 - единственный уровень повторов синхронного прокси. Он повторяет
+        # неудавшиеся подключения (рукопожатие не прошло, запрос не отправлен),
+        # а ответы со статусом - с учетом Retry-After: GET по 429/5xx, POST только
+        # по 429/503. Обрыв и таймаут чтения не повторяются, чтобы не
+        # генерировать ответ дважды.
+        # pool_connections - число хостов в кэше пулов, pool_maxsize - соединений на хост
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size * 2,
+            max_retries=_SafeRetry(
+                total=3, connect=2, read=0, other=0, status=connection_retries,
+                backoff_factor=0.25,
+                status_forcelist=_RETRY_STATUSES,
+                allowed_methods=frozenset(("GET", "POST")),
+                respect_retry_after_header=True,
+                raise_on_status=False
+            )
+        )
+        # Размыкатели по конечным точкам (для потоковых запросов)
+        self._breakers: Dict[str, _CircuitBreaker] = {}
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+        # Сессия aiohttp для async_* методов создается при первом вызове
+        self._async_session: Optional[aiohttp.ClientSession] = None
         
         logger.info(f"Инициализация прокси для внешнего API: {self.api_url}")
     
-    @backoff.on_exception(backoff.expo, 
-                        (requests.exceptions.ConnectionError, requests.exceptions.Timeout),
-                        max_tries=3)
     def _make_request(self, endpoint: str, method: str = "POST", data: Dict = None) -> Dict:
         """
-        Выполняет запрос к внешнему API с автоматическим повтором при сбоях.
+        Выполняет запрос к внешнему API (повторы при сбоях - в адаптере сессии, см. _SafeRetry).
         
         Args:
             endpoint: Конечная точка API, например "/completions"
@@ -106,15 +397,15 @@ class ExternalLLMProxy:
             start_time = time.time()
             
             if method.upper() == "GET":
-                response = self.session.get(url, timeout=self.timeout)
+                response = self.session.get(url, timeout=self._request_timeout)
             else:  # Default to POST
-                response = self.session.post(url, json=data, timeout=self.timeout)
+                response = self.session.post(url, data=_json_dumps(data), timeout=self._request_timeout)
             
             elapsed = time.time() - start_time
             logger.debug(f"Запрос к {url} выполнен за {elapsed:.2f}с")
             
             if response.status_code == 200:
-                return response.json()
+                return _json_loads(response.content)
             else:
                 error_msg = f"Ошибка API ({response.status_code}): {response.text}"
                 logger.error(error_msg)
@@ -210,39 +501,32 @@ class ExternalLLMProxy:
             Фрагменты текста по мере их генерации
         """
         url = f"{self.api_url}/completions"
+        breaker = self._breaker("/completions")
+        if not breaker.allow():
+            yield dict(_CIRCUIT_OPEN_ERROR)
+            return
         
         try:
-            with self.session.post(url, json=data, stream=True, timeout=self.timeout) as response:
+            with self.session.post(url, data=_json_dumps(data), stream=True, timeout=self._request_timeout) as response:
                 if response.status_code != 200:
                     error_msg = f"Ошибка API ({response.status_code}): {response.text}"
                     logger.error(error_msg)
-                    yield {"error": error_msg}
+                    error = {"error": error_msg, "status_code": response.status_code}
+                    breaker.record_result(error)
+                    yield error
                     return
-                    
-                for line in response.iter_lines():
-                    if line:
-                        line = line.decode('utf-8')
-                        
-                        # Пропускаем пустые строки и строки keep-alive
-                        if not line or line == "data: [DONE]":
-                            continue
-                            
-                        # Разбираем формат SSE (Server-Sent Events)
-                        if line.startswith('data: '):
-                            try:
-                                json_str = line[6:]  # Убираем 'data: '
-                                data = json.loads(json_str)
-                                yield data
-                            except json.JSONDecodeError as e:
-                                logger.error(f"Ошибка разбора JSON в потоковом ответе: {e}")
-                                yield {"error": "JSON decode error", "raw": line}
+                
+                breaker.record_success()
+                yield from self._iter_sse_chunks(response, "потоковом ответе")
                 
         except requests.exceptions.ConnectionError as e:
             logger.error(f"Ошибка соединения при потоковой генерации: {e}")
+            breaker.record_failure()
             yield {"error": f"Connection error: {e}"}
             
         except requests.exceptions.Timeout as e:
             logger.error(f"Таймаут при потоковой генерации: {e}")
+            breaker.record_failure()
             yield {"error": f"Timeout error: {e}"}
             
         except Exception as e:
@@ -282,21 +566,34 @@ class ExternalLLMProxy:
         url = f"{self.api_url}/completions"
         headers = self.headers.copy()
         
-        async with aiohttp.ClientSession() as session:
-            if stream:
-                return self._async_stream_completion(session, url, data, headers)
-            
-            try:
-                async with session.post(url, json=data, headers=headers, timeout=self.timeout) as response:
-                    if response.status == 200:
-                        return await response.json()
-                    else:
-                        error_text = await response.text()
-                        logger.error(f"Ошибка API ({response.status}): {error_text}")
-                        return {"error": f"API Error ({response.status}): {error_text}"}
-            except Exception as e:
-                logger.error(f"Ошибка асинхронной генерации: {e}")
-                return {"error": str(e)}
+        # Сессия общая для всех вызовов (и не закрывается до возврата
+        # потокового генератора)
+        session = self._get_async_session()
+        if stream:
+            return self._async_stream_completion(session, url, data, headers)
+        
+        try:
+            async with session.post(url, data=_json_dumps(data), headers=headers, timeout=self._aiohttp_timeout) as response:
+                if response.status == 200:
+                    return await response.json(loads=_json_loads)
+                else:
+                    error_text = await response.text()
+                    logger.error(f"Ошибка API ({response.status}): {error_text}")
+                    return {"error": f"API Error ({response.status}): {error_text}"}
+        except Exception as e:
+            logger.error(f"Ошибка асинхронной генерации: {e}")
+            return {"error": str(e)}
+    
+    def _get_async_session(self) -> aiohttp.ClientSession:
+        """Возвращает пул keep-alive соединений aiohttp, создавая его при первом обращении."""
+        if self._async_session is None or self._async_session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout,
+                ssl=None if self.verify_ssl else False
+            )
+            self._async_session = aiohttp.ClientSession(connector=connector)
+        return self._async_session
     
     async def _async_stream_completion(self, session, url, data, headers) -> AsyncGenerator:
         """
@@ -312,28 +609,19 @@ class ExternalLLMProxy:
             Фрагменты текста по мере их генерации
         """
         try:
-            async with session.post(url, json=data, headers=headers, timeout=self.timeout) as response:
+            async with session.post(url, data=_json_dumps(data), headers=headers, timeout=self._aiohttp_timeout) as response:
                 if response.status != 200:
                     error_text = await response.text()
                     logger.error(f"Ошибка API при потоковой генерации ({response.status}): {error_text}")
                     yield {"error": f"API Error ({response.status}): {error_text}"}
                     return
                 
-                async for line in response.content:
-                    line = line.decode('utf-8')
-                    
-                    # Пропускаем пустые строки и разделители
-                    if not line.strip() or line == 'data: [DONE]':
-                        continue
-                        
-                    if line.startswith('data: '):
-                        try:
-                            json_str = line[6:]
-                            data = json.loads(json_str)
-                            yield data
-                        except json.JSONDecodeError as e:
-                            logger.error(f"Ошибка разбора JSON в асинхронном потоковом ответе: {e}")
-                            yield {"error": "JSON decode error", "raw": line}
+                parser = _SSEParser()
+                async for data in response.content.iter_any():
+                    for payload in parser.feed(data):
+                        yield self._decode_sse_payload(payload, "асинхронном потоковом ответе")
+                for payload in parser.flush():
+                    yield self._decode_sse_payload(payload, "асинхронном потоковом ответе")
                             
         except asyncio.TimeoutError:
             logger.error(f"Асинхронный таймаут при потоковой генерации")
@@ -387,6 +675,50 @@ class ExternalLLMProxy:
             logger.error(f"Ошибка при генерации ответа в чате: {str(e)}")
             return {"error": str(e)}
     
+    def _breaker(self, endpoint: str) -> _CircuitBreaker:
+        """Возвращает размыкатель конечной точки, создавая его при первом обращении."""
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers.setdefault(endpoint, _CircuitBreaker())
+        return breaker
+    
+    def _iter_sse_chunks(self, response: requests.Response, context: str) -> Generator:
+        """
+        Разбирает SSE-поток requests на фрагменты ответа.
+        
+        Args:
+            response: Потоковый ответ requests
+            context: Описание потока для сообщений об ошибках
+            
+        Yields:
+            Разобранные фрагменты ответа
+        """
+        parser = _SSEParser()
+        # chunk_size=None - отдавать байты по мере поступления из сокета
+        for data in response.iter_content(chunk_size=None):
+            for payload in parser.feed(data):
+                yield self._decode_sse_payload(payload, context)
+        for payload in parser.flush():
+            yield self._decode_sse_payload(payload, context)
+    
+    @staticmethod
+    def _decode_sse_payload(payload: bytearray, context: str) -> Dict:
+        """
+        Декодирует данные одного SSE-кадра.
+        
+        Args:
+            payload: Байты JSON из data-строки кадра
+            context: Описание потока для сообщений об ошибках
+            
+        Returns:
+            Разобранный фрагмент или словарь с ошибкой разбора
+        """
+        try:
+            return _decode_stream_chunk(payload)
+        except _STREAM_DECODE_ERRORS as e:
+            logger.error(f"Ошибка разбора JSON в {context}: {e}")
+            return {"error": "JSON decode error", "raw": payload.decode('utf-8', errors='replace')}
+    
     def _stream_chat_completion(self, data: Dict) -> Generator:
         """
         Создает генератор для потоковой генерации чата.
@@ -398,37 +730,32 @@ class ExternalLLMProxy:
             Фрагменты ответа по мере их генерации
         """
         url = f"{self.api_url}/chat/completions"
+        breaker = self._breaker("/chat/completions")
+        if not breaker.allow():
+            yield dict(_CIRCUIT_OPEN_ERROR)
+            return
         
         try:
-            with self.session.post(url, json=data, stream=True, timeout=self.timeout) as response:
+            with self.session.post(url, data=_json_dumps(data), stream=True, timeout=self._request_timeout) as response:
                 if response.status_code != 200:
                     error_msg = f"Ошибка API ({response.status_code}): {response.text}"
                     logger.error(error_msg)
-                    yield {"error": error_msg}
+                    error = {"error": error_msg, "status_code": response.status_code}
+                    breaker.record_result(error)
+                    yield error
                     return
-                    
-                for line in response.iter_lines():
-                    if line:
-                        line = line.decode('utf-8')
-                        
-                        if not line or line == "data: [DONE]":
-                            continue
-                            
-                        if line.startswith('data: '):
-                            try:
-                                json_str = line[6:]
-                                data = json.loads(json_str)
-                                yield data
-                            except json.JSONDecodeError as e:
-                                logger.error(f"Ошибка разбора JSON в потоковом ответе чата: {e}")
-                                yield {"error": "JSON decode error", "raw": line}
+                
+                breaker.record_success()
+                yield from self._iter_sse_chunks(response, "потоковом ответе чата")
                 
         except requests.exceptions.ConnectionError as e:
             logger.error(f"Ошибка соединения при потоковой генерации чата: {e}")
+            breaker.record_failure()
             yield {"error": f"Connection error: {e}"}
             
         except requests.exceptions.Timeout as e:
             logger.error(f"Таймаут при потоковой генерации чата: {e}")
+            breaker.record_failure()
             yield {"error": f"Timeout error: {e}"}
             
         except Exception as e:
@@ -479,6 +806,422 @@ class ExternalLLMProxy:
             logger.debug("Сессия API закрыта")
         except Exception as e:
             logger.warning(f"Ошибка при закрытии сессии API: {e}")
+    
+    async def aclose(self):
+        """
+        Закрывает сессию aiohttp (вызывать из того же event loop, что и async_* методы).
+        """
+        if self._async_session is not None and not self._async_session.closed:
+            await self._async_session.close()
+        self._async_session = None
+        self.close()
+
+
+class _ConnectFailed(ConnectionError):
+    """Соединение с API не установлено: запрос заведомо не отправлен."""
+
+
+# Исключения клиентов, при которых запрос не ушел на сервер
+_AIOHTTP_CONNECT_ERRORS = tuple(
+    error for error in (aiohttp.ClientConnectorError, getattr(aiohttp, "ConnectionTimeoutError", None))
+    if error is not None
+)
+
+
+def _async_retry(jitter: float = 0.1):
+    """
+    Повторяет асинхронный запрос прокси с экспоненциальной задержкой.
+    
+    Повторяются только запросы, которые заведомо не дошли до выполнения:
+    соединение не установлено (_ConnectFailed) или сервер отклонил запрос
+    ответом 429/503. Таймаут чтения и обрыв соединения не повторяются - POST
+    генерации мог уже выполниться. Задержка - connection_retry_delay * 2**attempt
+    плюс случайная добавка до jitter секунд, чтобы клиенты не повторяли
+    запросы синхронно; заголовок Retry-After имеет приоритет.
+    Число повторов берется из connection_retries экземпляра; других уровней
+    повторов у асинхронного прокси нет.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            attempt = 0
+            while True:
+                retry_after = None
+                try:
+                    result = await func(self, *args, **kwargs)
+                    if result.get("status_code") not in _UNPROCESSED_STATUSES or attempt >= self.connection_retries:
+                        return result
+                    retry_after = result.get("retry_after")
+                except _ConnectFailed:
+                    if attempt >= self.connection_retries:
+                        raise
+                
+                if retry_after is not None:
+                    delay = min(retry_after, self.timeout)
+                else:
+                    delay = self.connection_retry_delay * 2 ** attempt + random.random() * jitter
+                attempt += 1
+                logger.warning(f"Повтор запроса {attempt}/{self.connection_retries} через {delay:.2f}с")
+                await asyncio.sleep(delay)
+        return wrapper
+    return decorator
+
+
+class AsyncExternalLLMProxy:
+    """
+    Асинхронный прокси для внешних API language models на aiohttp.
+    
+    Все запросы идут через одну сессию с пулом keep-alive соединений, поэтому
+    параллельные вызовы (asyncio.gather) не открывают новое TCP/TLS соединение
+    на каждый запрос. Сессия привязана к event loop, в котором создана: все
+    корутины одного экземпляра должны выполняться в одном loop.
+    
+    С http2=True (нужны httpx и h2) запросы идут через httpx.AsyncClient по
+    HTTP/2: параллельные запросы мультиплексируются в одном соединении.
+    """
+    
+    # Пулы соединений, общие для экземпляров с shared_pool=True (по одному на loop)
+    _shared_connectors: Dict[asyncio.AbstractEventLoop, aiohttp.TCPConnector] = {}
+    
+    def __init__(self,
+                api_url: str,
+                api_key: str = None,
+                timeout: int = 60,
+                verify_ssl: bool = True,
+                connection_limit: int = 32,
+                keepalive_timeout: float = 60,
+                shared_pool: bool = False,
+                connection_retries: int = 3,
+                connection_retry_delay: float = 0.2,
+                http2: bool = False,
+                connect_timeout: Optional[float] = None,
+                read_timeout: Optional[float] = None,
+                write_timeout: Optional[float] = None):
+        """
+        Инициализирует асинхронный прокси для внешнего API.
+        
+        Args:
+            api_url: URL API, например "http://192.168.2.74:3131/v1"
+            api_key: Ключ API для авторизации (если требуется)
+            timeout: Таймаут для запросов в секундах
+            verify_ssl: Проверять ли SSL-сертификаты (отключать только для тестирования)
+            connection_limit: Максимальное число одновременных соединений в пуле
+            keepalive_timeout: Время жизни простаивающего соединения в секундах
+            shared_pool: Использовать пул соединений, общий для всех экземпляров
+                в этом event loop (заголовки и таймауты остаются у каждого свои)
+            connection_retries: Количество повторов при сбоях сети и ответах 429/5xx
+            connection_retry_delay: Базовая задержка экспоненциального повтора в секундах
+            http2: Использовать HTTP/2 через httpx (без httpx/h2 - aiohttp и HTTP/1.1)
+            connect_timeout: Таймаут установки соединения (по умолчанию timeout)
+            read_timeout: Таймаут ожидания очередных байтов ответа (по умолчанию timeout)
+            write_timeout: Таймаут отправки тела запроса (по умолчанию timeout; только HTTP/2)
+        """
+        self.api_url = api_url.rstrip('/')
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout if connect_timeout is not None else timeout
+        self.read_timeout = read_timeout if read_timeout is not None else timeout
+        self.write_timeout = write_timeout if write_timeout is not None else timeout
+        self.verify_ssl = verify_ssl
+        self.connection_limit = connection_limit
+        self.keepalive_timeout = keepalive_timeout
+        self.shared_pool = shared_pool
+        self.connection_retries = connection_retries
+        self.connection_retry_delay = connection_retry_delay
+        # Проверка сертификата задается на запрос, т.к. пул может быть общим
+        self._ssl = None if verify_ssl else False
+        
+        self.headers = {
+            "Content-Type": "application/json"
+        }
+        
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+        
+        if http2 and not HAS_HTTP2:
+            logger.warning("HTTP/2 недоступен (нужны пакеты httpx и h2), используется aiohttp")
+        self.http2 = http2 and HAS_HTTP2
+        
+        # Сессия создается лениво внутри работающего event loop
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._http2_client = None
+        # Размыкатели по конечным точкам
+        self._breakers: Dict[str, _CircuitBreaker] = {}
+    
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Возвращает общую сессию aiohttp, создавая ее при первом обращении."""
+        if self._session is None or self._session.closed:
+            connector = None
+            if self.shared_pool:
+                loop = asyncio.get_running_loop()
+                connector = self._shared_connectors.get(loop)
+            if connector is None or connector.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=self.connection_limit,
+                    keepalive_timeout=self.keepalive_timeout
+                )
+                if self.shared_pool:
+                    self._shared_connectors[loop] = connector
+            self._session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=connector,
+                connector_owner=not self.shared_pool,
+                timeout=aiohttp.ClientTimeout(
+                    total=self.timeout,
+                    sock_connect=self.connect_timeout,
+                    sock_read=self.read_timeout
+                )
+            )
+        return self._session
+    
+    def _get_http2_client(self) -> "httpx.AsyncClient":
+        """Возвращает клиент httpx с HTTP/2, создавая его при первом обращении."""
+        if self._http2_client is None or self._http2_client.is_closed:
+            self._http2_client = httpx.AsyncClient(
+                http2=True,
+                headers=self.headers,
+                verify=self.verify_ssl,
+                timeout=httpx.Timeout(
+                    self.timeout,
+                    connect=self.connect_timeout,
+                    read=self.read_timeout,
+                    write=self.write_timeout
+                ),
+                limits=httpx.Limits(
+                    max_connections=self.connection_limit,
+                    max_keepalive_connections=self.connection_limit,
+                    keepalive_expiry=self.keepalive_timeout
+                )
+            )
+        return self._http2_client
+    
+    async def _make_http2_request(self, url: str, method: str, data: Dict = None) -> Dict:
+        """
+        Выполняет запрос через httpx по HTTP/2; результат и исключения как у _make_request.
+        """
+        client = self._get_http2_client()
+        
+        try:
+            start_time = time.time()
+            response = await client.request(method.upper(), url,
+                                            content=_json_dumps(data) if data is not None else None)
+            elapsed = time.time() - start_time
+            logger.debug(f"Асинхронный запрос к {url} ({response.http_version}) выполнен за {elapsed:.2f}с")
+            
+            if response.status_code == 200:
+                return _json_loads(response.content)
+            error_msg = f"Ошибка API ({response.status_code}): {response.text}"
+            logger.error(error_msg)
+            error = {"error": error_msg, "status_code": response.status_code}
+            retry_after = response.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                error["retry_after"] = int(retry_after)
+            return error
+            
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+            logger.error(f"Не удалось установить соединение с API: {str(e)}")
+            raise _ConnectFailed(f"Не удалось подключиться к API по адресу {url}: {str(e)}")
+        
+        except httpx.TimeoutException:
+            logger.error(f"Таймаут асинхронного запроса к API: {url}")
+            raise TimeoutError(f"Превышено время ожидания ответа от API: {url}")
+        
+        except httpx.TransportError as e:
+            logger.error(f"Ошибка соединения с API: {str(e)}")
+            raise ConnectionError(f"Не удалось подключиться к API по адресу {url}: {str(e)}")
+    
+    @_async_retry()
+    async def _guarded_request(self, endpoint: str, method: str = "POST", data: Dict = None) -> Dict:
+        """
+        Выполняет запрос через размыкатель конечной точки (с повторами, см. _async_retry).
+        
+        Каждая попытка отмечается в размыкателе; пока цепь разомкнута,
+        возвращается ошибка circuit_open без обращения к сети, и повторы прекращаются.
+        """
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers.setdefault(endpoint, _CircuitBreaker())
+        if not breaker.allow():
+            return dict(_CIRCUIT_OPEN_ERROR)
+        
+        try:
+            result = await self._make_request(endpoint, method=method, data=data)
+        except (ConnectionError, TimeoutError):
+            breaker.record_failure()
+            raise
+        breaker.record_result(result)
+        return result
+    
+    async def _make_request(self, endpoint: str, method: str = "POST", data: Dict = None) -> Dict:
+        """
+        Выполняет асинхронный запрос к внешнему API.
+        
+        Args:
+            endpoint: Конечная точка API, например "/completions"
+            method: HTTP метод (GET, POST и т.д.)
+            data: Данные для отправки в теле запроса
+            
+        Returns:
+            Ответ от API в формате словаря
+            
+        Raises:
+            _ConnectFailed: Если соединение не установлено (запрос не отправлен)
+            ConnectionError: При обрыве соединения после отправки запроса
+            TimeoutError: При превышении таймаута ожидания ответа
+        """
+        url = f"{self.api_url}{endpoint}"
+        if self.http2:
+            return await self._make_http2_request(url, method, data)
+        session = self._get_session()
+        
+        try:
+            start_time = time.time()
+            
+            body = _json_dumps(data) if data is not None else None
+            async with session.request(method.upper(), url, data=body, ssl=self._ssl) as response:
+                elapsed = time.time() - start_time
+                logger.debug(f"Асинхронный запрос к {url} выполнен за {elapsed:.2f}с")
+                
+                if response.status == 200:
+                    return await response.json(loads=_json_loads)
+                error_text = await response.text()
+                error_msg = f"Ошибка API ({response.status}): {error_text}"
+                logger.error(error_msg)
+                error = {"error": error_msg, "status_code": response.status}
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.isdigit():
+                    error["retry_after"] = int(retry_after)
+                return error
+                
+        except _AIOHTTP_CONNECT_ERRORS as e:
+            logger.error(f"Не удалось установить соединение с API: {str(e)}")
+            raise _ConnectFailed(f"Не удалось подключиться к API по адресу {url}: {str(e)}")
+        
+        except aiohttp.ClientConnectionError as e:
+            logger.error(f"Ошибка соединения с API: {str(e)}")
+            raise ConnectionError(f"Не удалось подключиться к API по адресу {url}: {str(e)}")
+        
+        except asyncio.TimeoutError as e:
+            logger.error(f"Таймаут асинхронного запроса к API: {url}")
+            raise TimeoutError(f"Превышено время ожидания ответа от API: {url}")
+    
+    async def generate_completion(self,
+                                 prompt: str,
+                                 model: str = "gpt-3.5-turbo-instruct",
+                                 max_tokens: int = 256,
+                                 temperature: float = 0.7,
+                                 top_p: float = 0.95,
+                                 top_k: int = 40,
+                                 repeat_penalty: float = 1.1,
+                                 stop: List[str] = None) -> Dict:
+        """
+        Асинхронно генерирует текстовое завершение (без потоковой передачи).
+        
+        Args:
+            prompt: Текстовый промпт для генерации
+            model: ID модели для use
+            max_tokens: Максимальное количество токенов для генерации
+            temperature: Температура сэмплирования (0.0-1.0)
+            top_p: Параметр nucleus sampling (0.0-1.0)
+            top_k: Параметр top-k sampling
+            repeat_penalty: Штраф за повторение
+            stop: Список стоп-последовательностей
+            
+        Returns:
+            Результат генерации в формате словаря
+        """
+        data = {
+            "model": model,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "repeat_penalty": repeat_penalty,
+            "stream": False
+        }
+        
+        if stop:
+            data["stop"] = stop
+        
+        try:
+            return await self._guarded_request("/completions", data=data)
+        except Exception as e:
+            logger.error(f"Ошибка при асинхронной генерации завершения: {str(e)}")
+            return {"error": str(e)}
+    
+    async def generate_chat_completion(self,
+                                      messages: List[Dict[str, str]],
+                                      model: str = "gpt-3.5-turbo",
+                                      temperature: float = 0.7,
+                                      max_tokens: int = 256,
+                                      top_p: float = 0.95,
+                                      stop: List[str] = None) -> Dict:
+        """
+        Асинхронно генерирует ответ чата (без потоковой передачи).
+        
+        Args:
+            messages: Список сообщений в формате [{role: "user", content: "текст"}, ...]
+            model: ID модели для use
+            temperature: Температура сэмплирования (0.0-1.0)
+            max_tokens: Максимальное количество токенов для генерации
+            top_p: Параметр nucleus sampling (0.0-1.0)
+            stop: Список стоп-последовательностей
+            
+        Returns:
+            Результат генерации в формате словаря
+        """
+        data = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p,
+            "stream": False
+        }
+        
+        if stop:
+            data["stop"] = stop
+        
+        try:
+            return await self._guarded_request("/chat/completions", data=data)
+        except Exception as e:
+            logger.error(f"Ошибка при асинхронной генерации ответа в чате: {str(e)}")
+            return {"error": str(e)}
+    
+    async def generate_embeddings(self, texts: List[str], model: str = "text-embedding-ada-002") -> Dict:
+        """
+        Асинхронно генерирует эмбеддинги для списка текстов.
+        
+        Args:
+            texts: Список текстов для эмбеддинга
+            model: ID модели для генерации эмбеддингов
+            
+        Returns:
+            Словарь с векторами эмбеддингов
+        """
+        data = {
+            "model": model,
+            "input": texts
+        }
+        
+        try:
+            return await self._guarded_request("/embeddings", data=data)
+        except Exception as e:
+            logger.error(f"Ошибка при асинхронной генерации эмбеддингов: {str(e)}")
+            return {"error": str(e)}
+    
+    async def close(self):
+        """
+        Закрывает сессию и пул соединений.
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+            logger.debug("Асинхронная сессия API закрыта")
+        self._session = None
+        if self._http2_client is not None and not self._http2_client.is_closed:
+            await self._http2_client.aclose()
+            logger.debug("HTTP/2 клиент API закрыт")
+        self._http2_client = None
 
 
 # Пример use
@@ -23,11 +23,15 @@ class HardwareProfile:
     cpu_speed: float = 0.0  # GHz
     gpu_model: str = "Unknown"
     gpu_vram: int = 0  # MB
+    gpu_vram_per_device: List[int] = field(default_factory=list)  # MB, one entry per discrete GPU
     total_ram: int = 0  # MB
     has_amd_gpu: bool = False
     has_nvidia_gpu: bool = False
     has_rocm: bool = False
     has_cuda: bool = False
+    numa_nodes: int = 1
+    cores_per_node: List[int] = field(default_factory=list)  # logical CPUs per NUMA node
+    fingerprint: str = ""  # cheap CPU/PCI/RAM signature for change detection
 
 @dataclass
 class LlamaConfig:
@@ -44,6 +48,7 @@ class LlamaConfig:
     host: str = "127.0.0.1"
     hardware_profile: HardwareProfile = field(default_factory=HardwareProfile)
     tensor_split: List[float] = field(default_factory=list)
+    allow_fast_math: bool = False  # -Ofast breaks strict IEEE NaN/Inf handling
     
     def detect_hardware(self) -> None:
         """Detect and populate hardware information."""
@@ -157,9 +162,10 @@ class LlamaConfig:
                     optimizer.run_optimization(self.model_path)
                 else:
                     # Still update hardware profile without running benchmark
-                    optimizer._update_hardware_profile()
-                    optimizer.optimize_compilation_flags()
-                    optimizer.optimize_runtime_parameters()
+                    with optimizer.batched_save():
+                        optimizer._update_hardware_profile()
+                        optimizer.optimize_compilation_flags()
+                        optimizer.optimize_runtime_parameters()
             
             # Apply optimized parameters to config
             params = optimizer.get_optimal_launch_parameters()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+GC-Forged Pylot - Embedding Cache
+=================================
+
+Content-addressed local cache of embedding vectors, so repeated texts
+(RAG re-indexing, re-runs) skip the embeddings API.
+
+Author: GC-Forged Pylot Team
+Date: 2025
+License: MIT
+"""
+
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from typing import List, Optional
+
+import numpy as np
+
+try:
+    import blake3
+    HAS_BLAKE3 = True
+except ImportError:
+    HAS_BLAKE3 = False
+
+logger = logging.getLogger(__name__)
+
+# Ограничение SQLite на число параметров запроса (SQLITE_MAX_VARIABLE_NUMBER)
+_SQL_BATCH = 500
+
+
+class EmbeddingCache:
+    """
+    Кэш эмбеддингов с адресацией по содержимому.
+    
+    Ключ - хэш текста вместе с названием модели эмбеддингов, значение -
+    вектор float32 или float16, хранимый как BLOB в SQLite. База общая для процессов
+    и переживает перезапуск; ":memory:" - кэш только в памяти процесса.
+    """
+    
+    def __init__(self, path: str, ttl_seconds: Optional[float] = None, dtype: np.dtype = np.float32):
+        """
+        Открывает (или создает) кэш эмбеддингов.
+        
+        Args:
+            path: Путь к файлу базы SQLite или ":memory:"
+            ttl_seconds: Время жизни записи в секундах (None - без ограничения)
+            dtype: Тип элементов сохраняемых и возвращаемых векторов (float32 или float16)
+        """
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.dtype = np.dtype(dtype)
+        self._lock = threading.Lock()
+        
+        if path != ":memory:":
+            directory = os.path.dirname(os.path.abspath(path))
+            os.makedirs(directory, exist_ok=True)
+        
+        # Соединение используется из потока вызывающего и фонового event loop
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT NOT NULL, model TEXT NOT NULL, dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL, created_at REAL NOT NULL,"
+            " PRIMARY KEY (key, model))"
+        )
+        self._conn.commit()
+        logger.info(f"Кэш эмбеддингов открыт: {path}")
+    
+    @staticmethod
+    def key(text: str) -> str:
+        """
+        Возвращает адрес текста в кэше.
+        
+        Args:
+            text: Текст для эмбеддинга
+        
+        Returns:
+            str: Хэш содержимого (blake3, без него - blake2b из hashlib)
+        """
+        data = text.encode("utf-8")
+        if HAS_BLAKE3:
+            return blake3.blake3(data).hexdigest()
+        return hashlib.blake2b(data, digest_size=32).hexdigest()
+    
+    def get_many(self, keys: List[str], model: str) -> List[Optional[np.ndarray]]:
+        """
+        Находит векторы для списка ключей.
+        
+        Args:
+            keys: Ключи текстов (см. key)
+            model: Модель эмбеддингов
+        
+        Returns:
+            List[Optional[np.ndarray]]: Вектор dtype или None для каждого ключа
+        """
+        found = {}
+        min_created = time.time() - self.ttl_seconds if self.ttl_seconds is not None else 0.0
+        unique_keys = list(dict.fromkeys(keys))
+        
+        with self._lock:
+            for start in range(0, len(unique_keys), _SQL_BATCH):
+                chunk = unique_keys[start:start + _SQL_BATCH]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, dim, vector FROM embeddings WHERE model = ? AND created_at >= ?"
+                    f" AND key IN ({placeholders})",
+                    (model, min_created, *chunk)
+                ).fetchall()
+                for key, dim, vector in rows:
+                    # Тип записи определяется по размеру: база могла заполняться
+                    # при другом dtype
+                    stored = np.float16 if len(vector) == dim * 2 else np.float32
+                    found[key] = np.frombuffer(vector, dtype=stored).astype(self.dtype, copy=False)
+        
+        return [found.get(key) for key in keys]
+    
+    def put_many(self, keys: List[str], model: str, vectors: np.ndarray) -> None:
+        """
+        Сохраняет векторы в кэш.
+        
+        Args:
+            keys: Ключи текстов (см. key)
+            model: Модель эмбеддингов
+            vectors: Матрица формы (len(keys), dim)
+        """
+        if not keys:
+            return
+        vectors = np.ascontiguousarray(vectors, dtype=self.dtype)
+        now = time.time()
+        rows = [
+            (key, model, vectors.shape[1], vectors[i].tobytes(), now)
+            for i, key in enumerate(keys)
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, dim, vector, created_at)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows
+            )
+            self._conn.commit()
+    
+    def clear(self) -> None:
+        """Удаляет все записи кэша."""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+    
+    def close(self) -> None:
+        """Закрывает базу кэша."""
+        with self._lock:
+            self._conn.close()
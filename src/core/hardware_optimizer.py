@@ -3,28 +3,104 @@ Hardware Optimizer for GC-Forged-Pylot.
 Analyzes hardware and optimizes llama.cpp parameters.
 """
 import os
+import csv
 import json
+import hashlib
 import logging
 import platform
 import subprocess
+import glob
+import gzip
 import time
 import re
 import shutil
+import struct
 import tempfile
+import atexit
+import threading
 from pathlib import Path
 from typing import Dict, Any, Optional, List, Union, Tuple
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field, fields, asdict
+from functools import lru_cache
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import psutil
 try:
     import numpy as np
     HAS_NUMPY = True
 except ImportError:
     HAS_NUMPY = False
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+try:
+    import cpuinfo as py_cpuinfo  # py-cpuinfo reads CPUID directly
+    HAS_PY_CPUINFO = True
+except ImportError:
+    HAS_PY_CPUINFO = False
 
 from .config import HardwareProfile, LlamaConfig
 
 logger = logging.getLogger(__name__)
 
+# Precompiled patterns for hardware detection output parsing
+_RE_GPU_NAME = re.compile(r'Name\s*:\s*(.*)')
+_RE_ADAPTER_RAM = re.compile(r'AdapterRAM\s*:\s*(\d+)')
+_RE_LSPCI_AMD_VGA = re.compile(r"VGA.*?:\s*(AMD|ATI|Radeon).*?(\[.*?\])?")
+_RE_MACOS_CHIPSET = re.compile(r'Chipset Model: (.*?)$', re.MULTILINE)
+_RE_MACOS_VRAM = re.compile(r'VRAM \(.*?\): (\d+)\s*([GM]B)', re.MULTILINE | re.IGNORECASE)
+
+# CPU model name heuristics for fallback detection (matched against lowercased names)
+_RE_AMD_HIGHEND = re.compile(r'ryzen|epyc|threadripper')
+_RE_INTEL_MODERN_I = re.compile(r'i9|i7-(?:[89]|1[0-2])')
+_RE_INTEL_AVX512 = re.compile(r'xeon|i9-1[01]|i[57]-11')
+_RE_INTEL_GENERATION = re.compile(r'\b(\d{1,2})th\b')
+
+# Capture-mode subprocess options; on Windows don't spawn a console window (conhost)
+if os.name == 'nt':
+    _SUBPROCESS_KWARGS = {'capture_output': True, 'text': True, 'creationflags': subprocess.CREATE_NO_WINDOW}
+else:
+    _SUBPROCESS_KWARGS = {'capture_output': True, 'text': True}
+
+# Win32_VideoController.AdapterRAM is a UINT32: adapters with >= 4 GB report
+# a capped (0xFFF00000) or wrapped-around value
+_ADAPTER_RAM_UINT32_CAP_MB = 0xFFF00000 // (1024 * 1024)
+# Setup class GUID of display adapters ("Display"), the Windows analogue of PCI class 0x03
+_DISPLAY_CLASS_GUID = "{4d36e968-e325-11ce-bfc1-08002be10318}"
+_DISPLAY_ADAPTER_CLASS_KEY = rf"SYSTEM\CurrentControlSet\Control\Class\{_DISPLAY_CLASS_GUID}"
+
+# PCI vendor IDs of discrete GPU vendors (NVIDIA, AMD/ATI)
+_DISCRETE_GPU_VENDOR_IDS = frozenset(("10de", "1002"))
+
+# Win32 CREATE_SUSPENDED: affinity is set before the first thread runs
+_CREATE_SUSPENDED = 0x00000004
+
+# Байт на элемент KV-кэша для типов llama.cpp (--cache-type-k/v); у q8_0/q4_0
+# учтён fp16-масштаб на блок из 32 значений
+_KV_CACHE_TYPE_BYTES = {"f32": 4.0, "f16": 2.0, "q8_0": 34 / 32, "q4_0": 18 / 32}
+
+# Сетка (ctx, batch) для подбора по бюджету памяти
+_CONTEXT_SIZE_LATTICE = (512, 1024, 2048, 4096, 8192, 16384, 32768)
+_BATCH_SIZE_LATTICE = (64, 128, 256, 512, 1024, 2048)
+
+# Доля RAM, которую можно отдать под веса, KV-кэш и рабочие буферы
+_MEMORY_BUDGET_FRACTION = 0.6
+
+# Доля VRAM под веса и резерв на контекст CUDA/ROCm на каждом GPU
+_GPU_VRAM_BUDGET_FRACTION = 0.85
+_GPU_CONTEXT_RESERVE_MB = 512
+
+# Сколько последних результатов бенчмарка хранится в JSON-профиле
+_MAX_BENCHMARK_RESULTS = 50
+
+# Размеры скалярных типов значений GGUF (gguf_type -> struct format)
+_GGUF_SCALAR_FORMATS = {0: '<B', 1: '<b', 2: '<H', 3: '<h', 4: '<I', 5: '<i',
+                        6: '<f', 7: '<?', 10: '<Q', 11: '<q', 12: '<d'}
+_GGUF_TYPE_STRING = 8
+_GGUF_TYPE_ARRAY = 9
+
 @dataclass
 class CompilationFlags:
     """Compilation flags for llama.cpp."""
@@ -42,6 +118,11 @@ class CompilationFlags:
     use_avx512: bool = False
     use_f16c: bool = False
     use_fma: bool = False
+    use_avx_vnni: bool = False
+    use_avx512_vnni: bool = False
+    use_avx512_bf16: bool = False
+    use_amx_int8: bool = False
+    use_amx_bf16: bool = False
 
 @dataclass
 class RuntimeParameters:
@@ -56,13 +137,22 @@ class RuntimeParameters:
     n_ctx: int = 2048
     rope_freq_base: int = 10000
     rope_freq_scale: float = 1.0
+    numa_strategy: str = "none"  # llama.cpp --numa: none/distribute/isolate/numactl
+    cpu_affinity: List[int] = field(default_factory=list)  # логические CPU для сервера (пусто - без привязки)
+    kv_cache_type: str = "f16"  # тип элементов KV-кэша (ключ _KV_CACHE_TYPE_BYTES)
+    n_parallel: int = 4  # слоты llama-server для continuous batching
 
 @dataclass
 class BenchmarkResult:
     """Benchmark results."""
     tokens_per_second: float = 0.0
     latency_ms: float = 0.0
+    latency_p50_ms: float = 0.0
+    latency_p90_ms: float = 0.0
+    latency_p99_ms: float = 0.0
+    ttft_ms: float = 0.0
     memory_used_mb: int = 0
+    peak_rss_mb: int = 0  # пиковый RSS процессов llama-server за время бенчмарка
     temperature_max: float = 0.0
     prompt: str = ""
     config: Dict[str, Any] = field(default_factory=dict)
@@ -76,6 +166,116 @@ class OptimizationProfile:
     benchmark_results: List[BenchmarkResult] = field(default_factory=list)
     created_at: str = ""
     updated_at: str = ""
+    updated_at_epoch: float = 0.0
+
+def _parse_cpulist(cpulist: str) -> List[int]:
+    """Разбирает список CPU формата sysfs ("0-15,32-47") в номера CPU."""
+    cpus = []
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            cpus.extend(range(int(first), int(last) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def _cpulist_size(cpulist: str) -> int:
+    """Считает CPU в списке формата sysfs ("0-15,32-47")."""
+    return len(_parse_cpulist(cpulist))
+
+def _percentile(values: List[float], pct: float) -> float:
+    """Перцентиль с линейной интерполяцией (корректен и для 1-2 значений)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+def _read_gguf_metadata(model_path: str, wanted: Tuple[str, ...]) -> Dict[str, Any]:
+    """
+    Читает скалярные ключи из заголовка GGUF, не загружая тензоры.
+    
+    Args:
+        model_path: Путь к файлу .gguf
+        wanted: Суффиксы ключей (без префикса архитектуры), например
+            "block_count" или "attention.head_count_kv"
+    
+    Returns:
+        Dict[str, Any]: Найденные значения по суффиксу плюс "architecture"
+    """
+    result: Dict[str, Any] = {}
+    
+    with open(model_path, 'rb') as f:
+        def read(fmt: str):
+            size = struct.calcsize(fmt)
+            data = f.read(size)
+            if len(data) != size:
+                raise ValueError("unexpected end of GGUF header")
+            return struct.unpack(fmt, data)[0]
+        
+        if f.read(4) != b'GGUF':
+            raise ValueError(f"not a GGUF file: {model_path}")
+        version = read('<I')
+        # GGUF v1 хранил счётчики и длины строк в uint32
+        len_fmt = '<I' if version == 1 else '<Q'
+        read(len_fmt)  # tensor_count
+        kv_count = read(len_fmt)
+        
+        def read_string() -> str:
+            return f.read(read(len_fmt)).decode('utf-8', errors='replace')
+        
+        def skip_value(value_type: int) -> None:
+            if value_type == _GGUF_TYPE_STRING:
+                f.seek(read(len_fmt), os.SEEK_CUR)
+            elif value_type == _GGUF_TYPE_ARRAY:
+                item_type = read('<I')
+                count = read(len_fmt)
+                if item_type in _GGUF_SCALAR_FORMATS:
+                    f.seek(count * struct.calcsize(_GGUF_SCALAR_FORMATS[item_type]), os.SEEK_CUR)
+                else:
+                    for _ in range(count):
+                        skip_value(item_type)
+            else:
+                f.seek(struct.calcsize(_GGUF_SCALAR_FORMATS[value_type]), os.SEEK_CUR)
+        
+        prefix = None
+        for _ in range(kv_count):
+            key = read_string()
+            value_type = read('<I')
+            
+            if key == 'general.architecture' and value_type == _GGUF_TYPE_STRING:
+                result['architecture'] = read_string()
+                prefix = result['architecture'] + '.'
+                continue
+            
+            suffix = key[len(prefix):] if prefix and key.startswith(prefix) else None
+            if suffix in wanted and value_type in _GGUF_SCALAR_FORMATS:
+                result[suffix] = read(_GGUF_SCALAR_FORMATS[value_type])
+                # Дальше идут массивы словаря токенизатора - их не читаем
+                if all(k in result for k in wanted):
+                    break
+            else:
+                skip_value(value_type)
+    
+    return result
+
+@lru_cache(maxsize=None)
+def _field_names(cls: type) -> Tuple[str, ...]:
+    """Имена полей dataclass (вычисляются один раз на класс)."""
+    return tuple(f.name for f in fields(cls))
+
+def _fast_asdict(obj: Any) -> Dict[str, Any]:
+    """
+    Shallow dataclass-to-dict conversion for JSON serialization.
+    
+    Unlike dataclasses.asdict() it doesn't recurse or deepcopy, so nested
+    lists/dicts are shared with the source object.
+    """
+    return {name: getattr(obj, name) for name in _field_names(type(obj))}
 
 class HardwareOptimizer:
     """
@@ -88,35 +288,84 @@ class HardwareOptimizer:
             "config", "hardware_profile.json"
         )
         self.optimization_profile = OptimizationProfile()
-        self._load_or_create_profile()
+        self._last_saved_hash: Optional[bytes] = None
+        # Оборудование, обнаруженное в _is_profile_outdated, для повторного
+        # использования в _update_hardware_profile без второго сканирования
+        self._pending_hw: Optional[HardwareProfile] = None
+        self._server_path_cache: Optional[str] = None
+        # Прогретый llama-server, переиспользуемый между вызовами run_benchmark
+        self._server_procs: List[subprocess.Popen] = []
+        self._server_logs: List[Any] = []
+        self._server_params: Optional[Tuple[Tuple[Tuple[str, ...], ...], Tuple[int, ...]]] = None
+        self._atexit_registered = False
+        self._peak_rss = 0
+        # Отложенная запись профиля внутри batched_save()
+        self._save_depth = 0
+        self._dirty = False
+        # Дописывать все результаты бенчмарков в архив benchmarks.jsonl.gz
+        self.archive_benchmarks = False
+        # Конструктор только читает JSON; обнаружение оборудования - в refresh()
+        self._profile_loaded = self._load_profile_from_disk()
+    
+    @property
+    def runtime_parameters(self) -> RuntimeParameters:
+        """Параметры запуска из текущего (возможно, кэшированного) профиля."""
+        return self.optimization_profile.runtime_parameters
+    
+    def refresh(self) -> bool:
+        """
+        Обнаруживает оборудование и обновляет профиль, если он отсутствует или устарел.
         
-    def _load_or_create_profile(self) -> None:
-        """Загружает существующий профиль или создает новый."""
-        if os.path.exists(self.profile_path):
-            try:
-                with open(self.profile_path, 'r', encoding='utf-8') as f:
-                    profile_data = json.load(f)
-                
-                # Восстанавливаем объекты из JSON
-                self.optimization_profile = OptimizationProfile(
-                    hardware=HardwareProfile(**profile_data.get("hardware", {})),
-                    compilation_flags=CompilationFlags(**profile_data.get("compilation_flags", {})),
-                    runtime_parameters=RuntimeParameters(**profile_data.get("runtime_parameters", {})),
-                    benchmark_results=[BenchmarkResult(**r) for r in profile_data.get("benchmark_results", [])],
-                    created_at=profile_data.get("created_at", ""),
-                    updated_at=profile_data.get("updated_at", "")
-                )
-                logger.info(f"Загружен профиль оптимизации из {self.profile_path}")
-                
-                # Проверка актуальности профиля
-                if self._is_profile_outdated():
-                    logger.info("Профиль устарел, требуется переоптимизация")
-                    self._update_hardware_profile()
-            except Exception as e:
-                logger.error(f"Ошибка загрузки профиля: {e}")
-                self._create_new_profile()
-        else:
+        Returns:
+            bool: True если профиль был создан или обновлен
+        """
+        return self._refresh_if_stale()
+        
+    def _load_profile_from_disk(self) -> bool:
+        """
+        Загружает существующий профиль без обнаружения оборудования.
+        
+        Returns:
+            bool: True если профиль успешно загружен
+        """
+        if not os.path.exists(self.profile_path):
+            return False
+        
+        try:
+            with open(self.profile_path, 'rb') as f:
+                raw_data = f.read()
+            profile_data = json.loads(raw_data.decode('utf-8'))
+            self._last_saved_hash = hashlib.blake2b(raw_data, digest_size=8).digest()
+            
+            # Восстанавливаем объекты из JSON
+            self.optimization_profile = OptimizationProfile(
+                hardware=HardwareProfile(**profile_data.get("hardware", {})),
+                compilation_flags=CompilationFlags(**profile_data.get("compilation_flags", {})),
+                runtime_parameters=RuntimeParameters(**profile_data.get("runtime_parameters", {})),
+                benchmark_results=[BenchmarkResult(**r) for r in profile_data.get("benchmark_results", [])],
+                created_at=profile_data.get("created_at", ""),
+                updated_at=profile_data.get("updated_at", ""),
+                updated_at_epoch=profile_data.get("updated_at_epoch", 0.0)
+            )
+            logger.info(f"Загружен профиль оптимизации из {self.profile_path}")
+            return True
+        except Exception as e:
+            logger.error(f"Ошибка загрузки профиля: {e}")
+            return False
+    
+    def _refresh_if_stale(self) -> bool:
+        """Создает новый профиль или обновляет устаревший."""
+        if not self._profile_loaded:
             self._create_new_profile()
+            return True
+        
+        # Проверка актуальности профиля
+        if self._is_profile_outdated():
+            logger.info("Профиль устарел, требуется переоптимизация")
+            self._update_hardware_profile()
+            return True
+        
+        return False
     
     def _create_new_profile(self) -> None:
         """Создает новый профиль оптимизации."""
@@ -127,6 +376,7 @@ class HardwareOptimizer:
             created_at=time.strftime("%Y-%m-%d %H:%M:%S"),
             updated_at=time.strftime("%Y-%m-%d %H:%M:%S")
         )
+        self._profile_loaded = True
         self._update_hardware_profile()
     
     def _is_profile_outdated(self) -> bool:
@@ -136,11 +386,15 @@ class HardwareOptimizer:
         # 2. Изменилась модель CPU/GPU
         # 3. Профилю больше месяца
         
-        current_hw = HardwareProfile()
-        self.config.detect_hardware()  # Use существующую функцию для обновления current_hw
-        current_hw = self.config.hardware_profile
-        
+        # Совпадение отпечатка означает, что оборудование не менялось, и полное
+        # обнаружение не нужно
         profile_hw = self.optimization_profile.hardware
+        if profile_hw.fingerprint and profile_hw.fingerprint == self._compute_fingerprint():
+            return time.time() - self.optimization_profile.updated_at_epoch > 30 * 86400
+        
+        self.config.detect_hardware()
+        current_hw = self.config.hardware_profile
+        self._pending_hw = current_hw
         
         # Check базовые характеристики
         if (abs(current_hw.total_ram - profile_hw.total_ram) > 1024 or  # Разница более 1 ГБ
@@ -150,28 +404,31 @@ class HardwareOptimizer:
             current_hw.has_rocm != profile_hw.has_rocm):
             return True
         
-        # Check дату обновления
-        try:
-            last_updated = time.strptime(self.optimization_profile.updated_at, "%Y-%m-%d %H:%M:%S")
-            days_since_update = (time.time() - time.mktime(last_updated)) / (60 * 60 * 24)
-            if days_since_update > 30:  # Больше месяца
-                return True
-        except:
+        # Check дату обновления (профили без updated_at_epoch считаются устаревшими)
+        if time.time() - self.optimization_profile.updated_at_epoch > 30 * 86400:  # Больше месяца
             return True
             
         return False
     
     def _update_hardware_profile(self) -> None:
         """Обновляет профиль оборудования с расширенным анализом."""
-        # Сначала используем существующую функцию обнаружения оборудования
-        self.config.detect_hardware()
-        self.optimization_profile.hardware = self.config.hardware_profile
+        # Сначала используем существующую функцию обнаружения оборудования,
+        # если оно не было только что обнаружено в _is_profile_outdated
+        if self._pending_hw is not None:
+            hardware, self._pending_hw = self._pending_hw, None
+        else:
+            self.config.detect_hardware()
+            hardware = self.config.hardware_profile
+        self.optimization_profile.hardware = hardware
         
         # Дополним её расширенным анализом
         self._detect_cpu_features()
         self._detect_gpu_capabilities()
+        self._detect_numa_topology()
+        self.optimization_profile.hardware.fingerprint = self._compute_fingerprint()
         
         self.optimization_profile.updated_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        self.optimization_profile.updated_at_epoch = time.time()
         self._save_profile()
     
     def _detect_cpu_features(self) -> None:
@@ -190,68 +447,98 @@ class HardwareOptimizer:
                    f"AVX={self.optimization_profile.compilation_flags.use_avx}, " +
                    f"AVX2={self.optimization_profile.compilation_flags.use_avx2}, " +
                    f"AVX512={self.optimization_profile.compilation_flags.use_avx512}, " +
-                   f"FMA={self.optimization_profile.compilation_flags.use_fma}")
+                   f"FMA={self.optimization_profile.compilation_flags.use_fma}, " +
+                   f"VNNI={self.optimization_profile.compilation_flags.use_avx_vnni or self.optimization_profile.compilation_flags.use_avx512_vnni}, " +
+                   f"AMX={self.optimization_profile.compilation_flags.use_amx_int8}")
+    
+    def _apply_cpu_flag_set(self, flag_set: frozenset) -> None:
+        """Переносит набор CPU-флагов (токены как в /proc/cpuinfo) в флаги компиляции."""
+        flags = self.optimization_profile.compilation_flags
+        flags.use_avx = 'avx' in flag_set
+        flags.use_avx2 = 'avx2' in flag_set
+        flags.use_avx512 = 'avx512f' in flag_set
+        flags.use_f16c = 'f16c' in flag_set
+        flags.use_fma = 'fma' in flag_set
+        # int8 dot products (VNNI) and AMX tiles; py-cpuinfo spells some without "_"
+        flags.use_avx_vnni = 'avx_vnni' in flag_set
+        flags.use_avx512_vnni = 'avx512_vnni' in flag_set or 'avx512vnni' in flag_set
+        flags.use_avx512_bf16 = 'avx512_bf16' in flag_set or 'avx512bf16' in flag_set
+        flags.use_amx_int8 = 'amx_tile' in flag_set and 'amx_int8' in flag_set
+        flags.use_amx_bf16 = 'amx_tile' in flag_set and 'amx_bf16' in flag_set
     
     def _detect_cpu_features_windows(self) -> None:
         """Обнаруживает расширения процессора на Windows."""
         try:
-            # Попытка использовать PowerShell для получения информации о CPU
-            cmd = ["powershell", "-Command", 
-                  "[System.String]::Join(', ', (Get-WmiObject -Class Win32_Processor).Caption," +
-                  "(Get-WmiObject -Class Win32_ProcessorFeature).Name)"]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            features = result.stdout.lower()
+            if HAS_PY_CPUINFO:
+                flag_set = frozenset(py_cpuinfo.get_cpu_info().get('flags', []))
+            else:
+                flag_set = self._windows_processor_feature_set()
             
-            self.optimization_profile.compilation_flags.use_avx = 'avx' in features
-            self.optimization_profile.compilation_flags.use_avx2 = 'avx2' in features
-            self.optimization_profile.compilation_flags.use_avx512 = any(x in features for x in ['avx512', 'avx-512'])
-            self.optimization_profile.compilation_flags.use_f16c = 'f16c' in features
-            self.optimization_profile.compilation_flags.use_fma = 'fma' in features
+            self._apply_cpu_flag_set(flag_set)
         except Exception as e:
             logger.warning(f"Failed to detect CPU features on Windows: {e}")
             # Fallback to CPU model name matching
             cpu_model = self.optimization_profile.hardware.cpu_model.lower()
             
             # Примерное определение по названию процессора
-            if any(x in cpu_model for x in ['ryzen', 'epyc', 'threadripper']):
+            if _RE_AMD_HIGHEND.search(cpu_model) is not None:
                 self.optimization_profile.compilation_flags.use_avx = True
                 self.optimization_profile.compilation_flags.use_avx2 = True
                 if '3' in cpu_model or '5' in cpu_model or '7' in cpu_model or '9' in cpu_model:
                     self.optimization_profile.compilation_flags.use_fma = True
                 
-            if any(x in cpu_model for x in ['i9', 'i7-8', 'i7-9', 'i7-10', 'i7-11', 'i7-12']):
+            if _RE_INTEL_MODERN_I.search(cpu_model) is not None:
                 self.optimization_profile.compilation_flags.use_avx = True
                 self.optimization_profile.compilation_flags.use_avx2 = True
                 self.optimization_profile.compilation_flags.use_fma = True
                 
             # Проверка на поддержку AVX-512 (обычно в Intel Ice Lake, Tiger Lake, Rocket Lake и новее)
-            if any(x in cpu_model for x in ['xeon', 'i9-10', 'i9-11', 'i7-11', 'i5-11']):
+            if _RE_INTEL_AVX512.search(cpu_model) is not None:
                 self.optimization_profile.compilation_flags.use_avx512 = True
     
+    def _windows_processor_feature_set(self) -> frozenset:
+        """Получает CPU-флаги через IsProcessorFeaturePresent (без py-cpuinfo)."""
+        import ctypes
+        is_present = ctypes.windll.kernel32.IsProcessorFeaturePresent
+        
+        # PF_* constants from winnt.h
+        feature_ids = {
+            'avx': 39,      # PF_AVX_INSTRUCTIONS_AVAILABLE
+            'avx2': 40,     # PF_AVX2_INSTRUCTIONS_AVAILABLE
+            'avx512f': 41,  # PF_AVX512F_INSTRUCTIONS_AVAILABLE
+        }
+        flag_set = {name for name, feature_id in feature_ids.items() if is_present(feature_id)}
+        
+        # Windows doesn't report FMA3/F16C; every shipping AVX2 CPU has both
+        if 'avx2' in flag_set:
+            flag_set.update(('fma', 'f16c'))
+        
+        return frozenset(flag_set)
+    
     def _detect_cpu_features_linux(self) -> None:
         """Обнаруживает расширения процессора на Linux."""
         try:
+            # Only the flags line of the first CPU is needed; the per-core
+            # blocks are identical, so stop reading after the first match
+            flags = ""
             with open('/proc/cpuinfo', 'r') as f:
-                cpuinfo = f.read()
+                for line in f:
+                    if line.startswith('flags'):
+                        flags = line.split(':', 1)[1].strip().lower()
+                        break
             
-            flags_match = re.search(r'flags\s*:\s*(.*)', cpuinfo)
-            if flags_match:
-                flags = flags_match.group(1).lower()
-                
-                self.optimization_profile.compilation_flags.use_avx = 'avx' in flags
-                self.optimization_profile.compilation_flags.use_avx2 = 'avx2' in flags
-                self.optimization_profile.compilation_flags.use_avx512 = any(x in flags for x in ['avx512f', 'avx512vl'])
-                self.optimization_profile.compilation_flags.use_f16c = 'f16c' in flags
-                self.optimization_profile.compilation_flags.use_fma = 'fma' in flags
+            if flags:
+                self._apply_cpu_flag_set(frozenset(flags.split()))
         except Exception as e:
             logger.warning(f"Failed to detect CPU features on Linux: {e}")
     
     def _detect_cpu_features_macos(self) -> None:
         """Обнаруживает расширения процессора на macOS."""
         try:
-            result = subprocess.run(['sysctl', '-a'], capture_output=True, text=True)
+            result = subprocess.run(['sysctl', '-a'], **_SUBPROCESS_KWARGS)
             sysctl_output = result.stdout.lower()
+            # Exact "key: value" lines, so e.g. avx512f never matches a longer key
+            sysctl_lines = frozenset(line.strip() for line in sysctl_output.splitlines())
             
             # Проверка на Apple Silicon
             if 'machdep.cpu.brand_string: apple' in sysctl_output:
@@ -260,17 +547,210 @@ class HardwareOptimizer:
                 return
             
             # Проверка на Intel Mac
-            self.optimization_profile.compilation_flags.use_avx = 'hw.optional.avx1_0: 1' in sysctl_output
-            self.optimization_profile.compilation_flags.use_avx2 = 'hw.optional.avx2_0: 1' in sysctl_output
-            self.optimization_profile.compilation_flags.use_avx512 = 'hw.optional.avx512f: 1' in sysctl_output
-            self.optimization_profile.compilation_flags.use_fma = 'hw.optional.fma: 1' in sysctl_output
+            self.optimization_profile.compilation_flags.use_avx = 'hw.optional.avx1_0: 1' in sysctl_lines
+            self.optimization_profile.compilation_flags.use_avx2 = 'hw.optional.avx2_0: 1' in sysctl_lines
+            self.optimization_profile.compilation_flags.use_avx512 = 'hw.optional.avx512f: 1' in sysctl_lines
+            self.optimization_profile.compilation_flags.use_fma = 'hw.optional.fma: 1' in sysctl_lines
+            self.optimization_profile.compilation_flags.use_avx512_vnni = 'hw.optional.avx512vnni: 1' in sysctl_lines
         except Exception as e:
             logger.warning(f"Failed to detect CPU features on macOS: {e}")
     
+    def _pci_display_device_ids(self) -> Optional[frozenset]:
+        """
+        Быстро получает PCI ID видеоадаптеров без WMI и подпроцессов.
+        
+        Returns:
+            Множество ID вида "10de:2484" или None, если определить не удалось
+        """
+        try:
+            if platform.system() == "Linux":
+                class_paths = glob.glob('/sys/bus/pci/devices/*/class')
+                if not class_paths:
+                    return None
+                device_ids = set()
+                for class_path in class_paths:
+                    with open(class_path, 'r') as f:
+                        if f.read(4) != '0x03':  # PCI class 0x03xxxx: display controller
+                            continue
+                    device_dir = os.path.dirname(class_path)
+                    with open(os.path.join(device_dir, 'vendor'), 'r') as f:
+                        vendor = f.read(6)[2:].lower()
+                    with open(os.path.join(device_dir, 'device'), 'r') as f:
+                        device = f.read(6)[2:].lower()
+                    device_ids.add(f"{vendor}:{device}")
+                return frozenset(device_ids)
+            elif platform.system() == "Windows":
+                import winreg
+                device_ids = set()
+                with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, r"SYSTEM\CurrentControlSet\Enum\PCI") as pci_key:
+                    index = 0
+                    while True:
+                        try:
+                            pnp_id = winreg.EnumKey(pci_key, index)  # VEN_10DE&DEV_2484&...
+                        except OSError:
+                            break
+                        index += 1
+                        if not pnp_id.upper().startswith("VEN_"):
+                            continue
+                        # Enum\PCI lists every PCI function (chipset, USB, audio) and keeps
+                        # removed hardware; keep present display-class devices only
+                        with winreg.OpenKey(pci_key, pnp_id) as device_key:
+                            if self._has_present_display_instance(winreg, device_key):
+                                device_ids.add(f"{pnp_id[4:8].lower()}:{pnp_id[13:17].lower()}")
+                return frozenset(device_ids)
+        except Exception as e:
+            logger.debug(f"Quick GPU probe failed: {e}")
+        return None
+    
+    @staticmethod
+    def _has_present_display_instance(winreg, device_key) -> bool:
+        """
+        Проверяет, есть ли у устройства в Enum/PCI подключенный экземпляр класса Display.
+        
+        Args:
+            winreg: Модуль winreg
+            device_key: Открытый ключ устройства Enum/PCI/VEN_xxxx&DEV_xxxx&...
+            
+        Returns:
+            bool: True для видеоадаптера, присутствующего в системе
+        """
+        index = 0
+        while True:
+            try:
+                instance = winreg.EnumKey(device_key, index)
+            except OSError:
+                return False
+            index += 1
+            try:
+                with winreg.OpenKey(device_key, instance) as instance_key:
+                    class_guid, _ = winreg.QueryValueEx(instance_key, "ClassGUID")
+                    if str(class_guid).lower() != _DISPLAY_CLASS_GUID:
+                        continue
+                    # Volatile-подключ Control есть только у присутствующих устройств
+                    winreg.OpenKey(instance_key, "Control").Close()
+                    return True
+            except OSError:
+                continue
+    
+    def _quick_gpu_vendors(self) -> Optional[frozenset]:
+        """
+        Быстро определяет PCI vendor ID видеоадаптеров без WMI и подпроцессов.
+        
+        Returns:
+            Множество vendor ID (например, "10de") или None, если определить не удалось
+        """
+        device_ids = self._pci_display_device_ids()
+        if device_ids is None:
+            return None
+        return frozenset(device_id.split(':', 1)[0] for device_id in device_ids)
+    
+    def _cpu_signature(self) -> str:
+        """Возвращает дешевую сигнатуру CPU (vendor/family/model/stepping)."""
+        if platform.system() == "Linux":
+            try:
+                signature = []
+                with open('/proc/cpuinfo', 'r') as f:
+                    for line in f:
+                        if not line.strip():
+                            break  # end of the first CPU block
+                        key = line.split(':', 1)[0].strip()
+                        if key in ('vendor_id', 'cpu family', 'model', 'stepping', 'model name', 'CPU part'):
+                            signature.append(line.strip())
+                if signature:
+                    return ";".join(signature)
+            except OSError:
+                pass
+        # On Windows platform.processor() is PROCESSOR_IDENTIFIER:
+        # "Intel64 Family 6 Model 158 Stepping 10, GenuineIntel"
+        return f"{platform.machine()};{platform.processor()}"
+    
+    def _compute_fingerprint(self) -> str:
+        """
+        Вычисляет отпечаток оборудования для быстрой проверки изменений.
+        
+        Covers the CPU signature, installed RAM (GB), GPU PCI IDs and the
+        CUDA/ROCm tools detect_hardware() looks for, without running any
+        detection subprocess.
+        """
+        parts = [
+            self._cpu_signature(),
+            str(psutil.virtual_memory().total // (1024 ** 3)),
+            f"nvcc={bool(shutil.which('nvcc'))};rocminfo={bool(shutil.which('rocminfo'))}",
+        ]
+        parts.extend(sorted(self._pci_display_device_ids() or ()))
+        return hashlib.blake2b("|".join(parts).encode('utf-8'), digest_size=8).hexdigest()
+    
+    def _detect_numa_topology(self) -> None:
+        """Определяет NUMA-топологию: число узлов и логических CPU на каждом узле."""
+        cores_per_node = []
+        try:
+            if platform.system() == "Linux":
+                node_dirs = glob.glob('/sys/devices/system/node/node[0-9]*')
+                for node_dir in sorted(node_dirs, key=lambda path: int(path.rsplit('node', 1)[1])):
+                    with open(os.path.join(node_dir, 'cpulist'), 'r') as f:
+                        node_cpus = _cpulist_size(f.read())
+                    if node_cpus:  # memory-only nodes can't run threads
+                        cores_per_node.append(node_cpus)
+            elif platform.system() == "Windows":
+                import ctypes
+                kernel32 = ctypes.windll.kernel32
+                highest_node = ctypes.c_ulong(0)
+                if kernel32.GetNumaHighestNodeNumber(ctypes.byref(highest_node)):
+                    for node in range(highest_node.value + 1):
+                        mask = ctypes.c_ulonglong(0)
+                        if kernel32.GetNumaNodeProcessorMask(ctypes.c_ubyte(node), ctypes.byref(mask)):
+                            node_cpus = bin(mask.value).count('1')
+                            if node_cpus:
+                                cores_per_node.append(node_cpus)
+        except Exception as e:
+            logger.warning(f"Failed to detect NUMA topology: {e}")
+        
+        hardware = self.optimization_profile.hardware
+        hardware.numa_nodes = max(1, len(cores_per_node))
+        hardware.cores_per_node = cores_per_node
+        if hardware.numa_nodes > 1:
+            logger.info(f"NUMA topology detected: {hardware.numa_nodes} nodes, CPUs per node: {cores_per_node}")
+    
+    def _physical_core_cpus(self) -> List[int]:
+        """
+        Возвращает по одному логическому CPU на каждое физическое ядро.
+        
+        Returns:
+            List[int]: Номера логических CPU (первый SMT-сосед каждого ядра),
+            доступные текущему процессу
+        """
+        if platform.system() == "Linux":
+            try:
+                allowed = os.sched_getaffinity(0)
+                first_siblings = set()
+                for path in glob.glob('/sys/devices/system/cpu/cpu[0-9]*/topology/thread_siblings_list'):
+                    with open(path, 'r') as f:
+                        siblings = [cpu for cpu in _parse_cpulist(f.read()) if cpu in allowed]
+                    if siblings:
+                        first_siblings.add(siblings[0])
+                if first_siblings:
+                    return sorted(first_siblings)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Failed to read CPU topology: {e}")
+        
+        # Windows и Linux без sysfs нумеруют SMT-соседей подряд (0/1, 2/3, ...)
+        hardware = self.optimization_profile.hardware
+        if hardware.cpu_threads >= 2 * hardware.cpu_cores:
+            return list(range(0, 2 * hardware.cpu_cores, 2))
+        return list(range(hardware.cpu_cores))
+    
     def _detect_gpu_capabilities(self) -> None:
         """Определяет расширенные возможности GPU."""
         gpu_profile = self.optimization_profile.hardware
         
+        # Дорогая детализация (WMI, PowerShell, nvidia-smi) нужна только
+        # при наличии дискретного адаптера NVIDIA/AMD
+        gpu_vendors = self._quick_gpu_vendors()
+        if gpu_vendors is not None and not (gpu_vendors & _DISCRETE_GPU_VENDOR_IDS):
+            logger.info("No NVIDIA/AMD display adapter found, skipping detailed GPU detection")
+            self._fallback_gpu_detection()
+            return
+        
         # Улучшенное определение GPU на Windows
         if platform.system() == "Windows":
             try:
@@ -297,65 +777,131 @@ class HardwareOptimizer:
                 logger.warning(f"Failed to detect GPU capabilities on macOS: {e}")
                 self._fallback_gpu_detection()
     
-    def _detect_gpu_windows_wmi(self) -> None:
-        """Определяет GPU через WMI на Windows."""
+    def _query_video_controllers(self) -> List[Tuple[str, int]]:
+        """
+        Запрашивает Win32_VideoController (Name, AdapterRAM).
+        
+        Uses the wmic CLI, which needs no Python dependencies; the `wmi`
+        package (pywin32 + COM initialization) is only a fallback for
+        systems where wmic has been removed.
+        
+        Returns:
+            Список пар (имя адаптера, AdapterRAM в байтах)
+        """
+        try:
+            cmd = ["wmic", "path", "Win32_VideoController", "get", "Name,AdapterRAM", "/format:csv"]
+            result = subprocess.run(cmd, **_SUBPROCESS_KWARGS)
+            if result.returncode == 0:
+                lines = [line.strip() for line in result.stdout.splitlines() if line.strip()]
+                adapters = []
+                # Header row: "Node,AdapterRAM,Name"
+                for row in csv.DictReader(lines):
+                    name = (row.get("Name") or "").strip()
+                    if not name:
+                        continue
+                    adapter_ram = row.get("AdapterRAM") or "0"
+                    adapters.append((name, int(adapter_ram) if adapter_ram.isdigit() else 0))
+                return adapters
+        except FileNotFoundError:
+            logger.debug("wmic not available, falling back to the wmi package")
+        
         try:
             import wmi
-            c = wmi.WMI()
-            for gpu in c.Win32_VideoController():
-                if "AMD" in gpu.Name or "Radeon" in gpu.Name:
-                    self.optimization_profile.hardware.has_amd_gpu = True
-                    self.optimization_profile.hardware.gpu_model = gpu.Name
-                    # Rough VRAM estimation
-                    try:
-                        if hasattr(gpu, 'AdapterRAM'):
-                            vram = int(gpu.AdapterRAM) // (1024 * 1024)
-                            if vram > 0:
-                                self.optimization_profile.hardware.gpu_vram = vram
-                    except:
-                        pass
-                    logger.info(f"Detected AMD GPU: {self.optimization_profile.hardware.gpu_model}")
-                elif "NVIDIA" in gpu.Name:
-                    self.optimization_profile.hardware.has_nvidia_gpu = True
-                    self.optimization_profile.hardware.gpu_model = gpu.Name
-                    # Rough VRAM estimation
-                    try:
-                        if hasattr(gpu, 'AdapterRAM'):
-                            vram = int(gpu.AdapterRAM) // (1024 * 1024)
-                            if vram > 0:
-                                self.optimization_profile.hardware.gpu_vram = vram
-                    except:
-                        pass
-                    logger.info(f"Detected NVIDIA GPU: {self.optimization_profile.hardware.gpu_model}")
-                elif "Intel" in gpu.Name:
-                    self.optimization_profile.hardware.gpu_model = gpu.Name
-                    # Rough VRAM estimation for Intel GPUs
-                    try:
-                        if hasattr(gpu, 'AdapterRAM'):
-                            vram = int(gpu.AdapterRAM) // (1024 * 1024)
-                            if vram > 0:
-                                self.optimization_profile.hardware.gpu_vram = vram
-                    except:
-                        pass
-                    logger.info(f"Detected Intel GPU: {self.optimization_profile.hardware.gpu_model}")
         except ImportError:
-            logger.warning("WMI library not available. Cannot detect GPU details via WMI.")
+            logger.warning("Neither wmic nor the WMI library is available. Cannot detect GPU details via WMI.")
             raise
+        return [(gpu.Name, int(getattr(gpu, 'AdapterRAM', 0) or 0)) for gpu in wmi.WMI().Win32_VideoController()]
+    
+    def _correct_adapter_vram(self, gpu_name: str, vram: int) -> int:
+        """
+        Исправляет объем VRAM, усеченный 32-битным AdapterRAM.
+        
+        Args:
+            gpu_name: Имя адаптера из Win32_VideoController
+            vram: Объем VRAM по AdapterRAM, MB
+            
+        Returns:
+            int: Объем VRAM в MB (64-битное значение, если его удалось получить)
+        """
+        if 1024 <= vram < _ADAPTER_RAM_UINT32_CAP_MB:
+            return vram
+        
+        if "NVIDIA" in gpu_name:
+            try:
+                cmd = ["nvidia-smi", "--query-gpu=memory.total", "--format=csv,noheader,nounits"]
+                result = subprocess.run(cmd, **_SUBPROCESS_KWARGS)
+                if result.returncode == 0 and result.stdout.strip():
+                    return int(result.stdout.strip().splitlines()[0])
+            except (OSError, ValueError):
+                pass
+        
+        # The display adapter class key stores the 64-bit size as
+        # HardwareInformation.qwMemorySize (REG_QWORD or REG_BINARY)
+        try:
+            import winreg
+            with winreg.OpenKey(winreg.HKEY_LOCAL_MACHINE, _DISPLAY_ADAPTER_CLASS_KEY) as class_key:
+                index = 0
+                while True:
+                    try:
+                        adapter_id = winreg.EnumKey(class_key, index)
+                    except OSError:
+                        break
+                    index += 1
+                    try:
+                        with winreg.OpenKey(class_key, adapter_id) as adapter_key:
+                            if winreg.QueryValueEx(adapter_key, "DriverDesc")[0] != gpu_name:
+                                continue
+                            memory_size = winreg.QueryValueEx(adapter_key, "HardwareInformation.qwMemorySize")[0]
+                    except OSError:
+                        continue
+                    if isinstance(memory_size, bytes):
+                        memory_size = struct.unpack('<Q', memory_size[:8])[0]
+                    if memory_size:
+                        return int(memory_size) // (1024 * 1024)
+        except (ImportError, OSError, struct.error):
+            pass
+        
+        return vram
+    
+    def _detect_gpu_windows_wmi(self) -> None:
+        """Определяет GPU через WMI на Windows."""
+        vram_per_device = []
+        for gpu_name, adapter_ram in self._query_video_controllers():
+            # Rough VRAM estimation
+            vram = adapter_ram // (1024 * 1024)
+            if "AMD" in gpu_name or "Radeon" in gpu_name:
+                self.optimization_profile.hardware.has_amd_gpu = True
+                vendor = "AMD"
+            elif "NVIDIA" in gpu_name:
+                self.optimization_profile.hardware.has_nvidia_gpu = True
+                vendor = "NVIDIA"
+            elif "Intel" in gpu_name:
+                vendor = "Intel"
+            else:
+                continue
+            if vendor != "Intel":
+                vram = self._correct_adapter_vram(gpu_name, vram)
+                if vram > 0:
+                    vram_per_device.append(vram)
+            
+            self.optimization_profile.hardware.gpu_model = gpu_name
+            if vram > 0:
+                self.optimization_profile.hardware.gpu_vram = vram
+            logger.info(f"Detected {vendor} GPU: {self.optimization_profile.hardware.gpu_model}")
+        self.optimization_profile.hardware.gpu_vram_per_device = vram_per_device
     
     def _detect_gpu_windows_cmd(self) -> None:
         """Определяет GPU через командную строку на Windows."""
         try:
             # PowerShell approach for GPU detection
             cmd = ["powershell", "-Command", "Get-WmiObject Win32_VideoController | Select-Object Name, AdapterRAM"]
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            result = subprocess.run(cmd, **_SUBPROCESS_KWARGS)
             
             if result.returncode == 0:
                 output = result.stdout
                 # Parse the output
-                import re
-                
                 # Look for GPU name
-                name_match = re.search(r'Name\s*:\s*(.*)', output)
+                name_match = _RE_GPU_NAME.search(output)
                 if name_match:
                     gpu_name = name_match.group(1).strip()
                     self.optimization_profile.hardware.gpu_model = gpu_name
@@ -366,10 +912,12 @@ class HardwareOptimizer:
                         self.optimization_profile.hardware.has_nvidia_gpu = True
                 
                 # Look for VRAM
-                vram_match = re.search(r'AdapterRAM\s*:\s*(\d+)', output)
+                vram_match = _RE_ADAPTER_RAM.search(output)
                 if vram_match:
-                    vram = int(vram_match.group(1))
-                    self.optimization_profile.hardware.gpu_vram = vram // (1024 * 1024)
+                    vram = int(vram_match.group(1)) // (1024 * 1024)
+                    if name_match:
+                        vram = self._correct_adapter_vram(name_match.group(1).strip(), vram)
+                    self.optimization_profile.hardware.gpu_vram = vram
                 
                 logger.info(f"Detected GPU via PowerShell: {self.optimization_profile.hardware.gpu_model} with {self.optimization_profile.hardware.gpu_vram} MB VRAM")
                 
@@ -385,7 +933,7 @@ class HardwareOptimizer:
         try:
             # Check for the nvcc compiler (part of CUDA toolkit)
             nvcc_cmd = ["where", "nvcc"]
-            nvcc_result = subprocess.run(nvcc_cmd, capture_output=True, text=True)
+            nvcc_result = subprocess.run(nvcc_cmd, **_SUBPROCESS_KWARGS)
             
             if nvcc_result.returncode == 0 and nvcc_result.stdout.strip():
                 self.optimization_profile.hardware.has_cuda = True
@@ -417,29 +965,36 @@ class HardwareOptimizer:
         try:
             # Check for NVIDIA GPUs using nvidia-smi
             nvidia_cmd = ["nvidia-smi", "--query-gpu=name,memory.total", "--format=csv,noheader"]
-            nvidia_result = subprocess.run(nvidia_cmd, capture_output=True, text=True)
+            nvidia_result = subprocess.run(nvidia_cmd, **_SUBPROCESS_KWARGS)
             
             if nvidia_result.returncode == 0:
                 self.optimization_profile.hardware.has_nvidia_gpu = True
                 lines = nvidia_result.stdout.strip().split('\n')
-                if lines and lines[0]:
-                    parts = lines[0].split(',')
-                    if len(parts) >= 2:
+                # One line per device; the first one describes the primary GPU
+                vram_per_device = []
+                for index, line in enumerate(lines):
+                    parts = line.split(',')
+                    if len(parts) < 2:
+                        continue
+                    if index == 0:
                         self.optimization_profile.hardware.gpu_model = parts[0].strip()
-                        # Parse memory (typically in MiB)
-                        memory_str = parts[1].strip()
-                        if "MiB" in memory_str:
-                            try:
-                                vram = float(memory_str.replace("MiB", "").strip())
-                                self.optimization_profile.hardware.gpu_vram = int(vram * 1.049)  # Convert to MB
-                            except:
-                                pass
+                    # Parse memory (typically in MiB)
+                    memory_str = parts[1].strip()
+                    if "MiB" in memory_str:
+                        try:
+                            vram = int(float(memory_str.replace("MiB", "").strip()) * 1.049)  # Convert to MB
+                        except ValueError:
+                            continue
+                        if index == 0:
+                            self.optimization_profile.hardware.gpu_vram = vram
+                        vram_per_device.append(vram)
+                self.optimization_profile.hardware.gpu_vram_per_device = vram_per_device
                 
                 self.optimization_profile.hardware.has_cuda = True
             else:
                 # Check for AMD GPUs
                 amd_cmd = ["lspci", "-v"]
-                amd_result = subprocess.run(amd_cmd, capture_output=True, text=True)
+                amd_result = subprocess.run(amd_cmd, **_SUBPROCESS_KWARGS)
                 
                 if amd_result.returncode == 0:
                     output = amd_result.stdout
@@ -447,14 +1002,13 @@ class HardwareOptimizer:
                         self.optimization_profile.hardware.has_amd_gpu = True
                         
                         # Try to extract the model name
-                        import re
-                        match = re.search(r"VGA.*?:\s*(AMD|ATI|Radeon).*?(\[.*?\])?", output)
+                        match = _RE_LSPCI_AMD_VGA.search(output)
                         if match:
                             self.optimization_profile.hardware.gpu_model = match.group(0).split(":", 1)[1].strip()
                         
                         # Check for ROCm
                         rocm_cmd = ["rocminfo"]
-                        rocm_result = subprocess.run(rocm_cmd, capture_output=True, text=True)
+                        rocm_result = subprocess.run(rocm_cmd, **_SUBPROCESS_KWARGS)
                         if rocm_result.returncode == 0:
                             self.optimization_profile.hardware.has_rocm = True
         except Exception as e:
@@ -465,24 +1019,20 @@ class HardwareOptimizer:
         """Определяет GPU на macOS."""
         try:
             cmd = ["system_profiler", "SPDisplaysDataType"]
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            result = subprocess.run(cmd, **_SUBPROCESS_KWARGS)
             
             if result.returncode == 0:
                 output = result.stdout
                 
-                # Check for Metal support
-                metal_cmd = ["system_profiler", "SPDisplaysDataType", "|", "grep", "Metal"]
-                metal_result = subprocess.run(metal_cmd, capture_output=True, shell=True, text=True)
-                
-                if "Supported" in metal_result.stdout:
+                # Check for Metal support ("Metal: Supported", "Metal Support: Metal 3", ...)
+                metal_lines = [line for line in output.splitlines() if "Metal" in line]
+                if metal_lines and not any("Not Supported" in line for line in metal_lines):
                     self.optimization_profile.compilation_flags.use_metal = True
                     logger.info("Metal support detected")
                 
                 # Try to extract GPU info
-                import re
-                
                 # Extract GPU model
-                model_match = re.search(r"Chipset Model: (.*?)$", output, re.MULTILINE)
+                model_match = _RE_MACOS_CHIPSET.search(output)
                 if model_match:
                     self.optimization_profile.hardware.gpu_model = model_match.group(1).strip()
                 
@@ -493,7 +1043,7 @@ class HardwareOptimizer:
                     self.optimization_profile.hardware.has_nvidia_gpu = True
                 
                 # Extract VRAM info
-                vram_match = re.search(r"VRAM \(.*?\): (\d+)\s*([GM]B)", output, re.MULTILINE | re.IGNORECASE)
+                vram_match = _RE_MACOS_VRAM.search(output)
                 if vram_match:
                     vram_amount = int(vram_match.group(1))
                     vram_unit = vram_match.group(2).upper()
@@ -512,18 +1062,19 @@ class HardwareOptimizer:
         
         # Intel integrated graphics fallback detection
         if "intel" in cpu_model:
-            gen = 0
-            if "13th" in cpu_model or "12th" in cpu_model:
+            gen_match = _RE_INTEL_GENERATION.search(cpu_model)
+            cpu_gen = int(gen_match.group(1)) if gen_match else 0
+            if cpu_gen >= 12:
                 # Intel Iris Xe Graphics (Gen 12)
                 gpu_model = "Intel Iris Xe Graphics"
                 vram = 2048  # Usually shares with system RAM
                 gen = 12
-            elif "11th" in cpu_model or "10th" in cpu_model:
+            elif cpu_gen >= 10:
                 # Intel UHD Graphics (Gen 11)
                 gpu_model = "Intel UHD Graphics"
                 vram = 1536
                 gen = 11
-            elif "9th" in cpu_model or "8th" in cpu_model or "7th" in cpu_model:
+            elif cpu_gen >= 7:
                 # Intel UHD Graphics 630/620
                 gpu_model = "Intel UHD Graphics 630"
                 vram = 1024
@@ -558,46 +1109,142 @@ class HardwareOptimizer:
             self.optimization_profile.hardware.gpu_model = "Unknown GPU"
             self.optimization_profile.hardware.gpu_vram = 0  # Conservative estimate
     
+    @contextmanager
+    def batched_save(self):
+        """
+        Откладывает запись профиля до выхода из блока.
+        
+        Mutators called inside the block only mark the profile dirty; it is
+        written once on exit. Blocks can be nested.
+        """
+        self._save_depth += 1
+        try:
+            yield self
+        finally:
+            self._save_depth -= 1
+            if self._save_depth == 0 and self._dirty:
+                self._save_profile()
+    
+    def _record_benchmark_result(self, result: BenchmarkResult) -> None:
+        """
+        Добавляет результат бенчмарка в профиль, оставляя последние _MAX_BENCHMARK_RESULTS.
+        
+        With archive_benchmarks set, the result is also appended as one line
+        to benchmarks.jsonl.gz next to the profile, so the full history is
+        kept without rewriting it on every save.
+        """
+        results = self.optimization_profile.benchmark_results
+        results.append(result)
+        del results[:-_MAX_BENCHMARK_RESULTS]
+        
+        if self.archive_benchmarks:
+            archive_path = os.path.join(os.path.dirname(self.profile_path), "benchmarks.jsonl.gz")
+            record = dict(_fast_asdict(result), recorded_at=time.strftime("%Y-%m-%d %H:%M:%S"))
+            try:
+                with gzip.open(archive_path, 'ab') as f:
+                    f.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n")
+            except OSError as e:
+                logger.error(f"Ошибка записи архива бенчмарков: {e}")
+    
     def _save_profile(self) -> None:
         """Сохраняет профиль оптимизации в файл."""
+        if self._save_depth > 0:
+            self._dirty = True
+            return
+        self._dirty = False
+        
         try:
             # Убедимся, что директория существует
             os.makedirs(os.path.dirname(self.profile_path), exist_ok=True)
             
             # Конвертируем dataclass в JSON-совместимый словарь
             profile_dict = {
-                "hardware": asdict(self.optimization_profile.hardware),
-                "compilation_flags": asdict(self.optimization_profile.compilation_flags),
-                "runtime_parameters": asdict(self.optimization_profile.runtime_parameters),
-                "benchmark_results": [asdict(result) for result in self.optimization_profile.benchmark_results],
+                "hardware": _fast_asdict(self.optimization_profile.hardware),
+                "compilation_flags": _fast_asdict(self.optimization_profile.compilation_flags),
+                "runtime_parameters": _fast_asdict(self.optimization_profile.runtime_parameters),
+                "benchmark_results": [_fast_asdict(result) for result in self.optimization_profile.benchmark_results],
                 "created_at": self.optimization_profile.created_at,
-                "updated_at": self.optimization_profile.updated_at
+                "updated_at": self.optimization_profile.updated_at,
+                "updated_at_epoch": self.optimization_profile.updated_at_epoch
             }
             
-            with open(self.profile_path, 'w', encoding='utf-8') as f:
-                json.dump(profile_dict, f, ensure_ascii=False, indent=2)
+            data = json.dumps(profile_dict, ensure_ascii=False, indent=2).encode('utf-8')
+            data_hash = hashlib.blake2b(data, digest_size=8).digest()
+            if data_hash == self._last_saved_hash:
+                logger.debug("Профиль не изменился, запись пропущена")
+                return
+            
+            # Пишем во временный файл и атомарно заменяем, чтобы сбой
+            # посреди записи не оставил поврежденный JSON
+            tmp_path = self.profile_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self.profile_path)
+            self._last_saved_hash = data_hash
                 
             logger.info(f"Профиль оптимизации сохранен в {self.profile_path}")
         except Exception as e:
             logger.error(f"Ошибка сохранения профиля: {e}")
 
-    def optimize_compilation_flags(self) -> CompilationFlags:
-        """Оптимизирует флаги компиляции llama.cpp под текущее оборудование."""
+    def optimize_compilation_flags(self, pgo_phase: Optional[str] = None,
+                                   pgo_profile_dir: Optional[str] = None) -> CompilationFlags:
+        """
+        Оптимизирует флаги компиляции llama.cpp под текущее оборудование.
+        
+        Args:
+            pgo_phase: Фаза PGO: "generate" (инструментированная сборка), "use" или None
+            pgo_profile_dir: Каталог для профилей PGO (*.gcda)
+        """
         flags = self.optimization_profile.compilation_flags
         hardware = self.optimization_profile.hardware
         
         # Базовые флаги CMake
         flags.cmake_flags = ["-DCMAKE_BUILD_TYPE=Release"]
         
-        # Флаги depending on процессора
-        if flags.use_avx512:
-            flags.cpu_arch_flags.extend(["-march=skylake-avx512", "-mavx512f", "-mavx512dq", "-mavx512bw", "-mavx512vl"])
-        elif flags.use_avx2:
-            flags.cpu_arch_flags.extend(["-march=haswell", "-mavx2", "-mfma"])
-        elif flags.use_avx:
-            flags.cpu_arch_flags.extend(["-march=sandybridge", "-mavx"])
+        # Whole-program optimization: cross-TU inlining of the ggml quant kernels
+        flags.cmake_flags.append("-DCMAKE_INTERPROCEDURAL_OPTIMIZATION=ON")
+        
+        # Флаги depending on процессора. Сервер собирается на той же машине,
+        # где работает, поэтому берем все ISA-расширения хоста (AVX-512 VNNI
+        # и т.п.), а не фиксированный -march
+        if platform.machine().lower() in ("arm64", "aarch64"):
+            # -mcpu=native включает NEON, dotprod и i8mm, если ядро их поддерживает
+            flags.cpu_arch_flags = ["-mcpu=native"]
         else:
-            flags.cpu_arch_flags.append("-march=native")
+            flags.cpu_arch_flags = ["-march=native", "-mtune=native"]
+        
+        # Int8/BF16 ISA extensions used by the ggml quantized GEMM kernels
+        if flags.use_avx_vnni:
+            flags.cpu_arch_flags.append("-mavxvnni")
+            flags.cmake_flags.append("-DGGML_AVX_VNNI=ON")
+        if flags.use_avx512_vnni:
+            flags.cpu_arch_flags.append("-mavx512vnni")
+            flags.cmake_flags.append("-DGGML_AVX512_VNNI=ON")
+        if flags.use_avx512_bf16:
+            flags.cpu_arch_flags.append("-mavx512bf16")
+            flags.cmake_flags.append("-DGGML_AVX512_BF16=ON")
+        if flags.use_amx_int8 or flags.use_amx_bf16:
+            flags.cpu_arch_flags.append("-mamx-tile")
+            flags.cmake_flags.append("-DGGML_AMX_TILE=ON")
+        if flags.use_amx_int8:
+            flags.cpu_arch_flags.append("-mamx-int8")
+            flags.cmake_flags.append("-DGGML_AMX_INT8=ON")
+        if flags.use_amx_bf16:
+            flags.cpu_arch_flags.append("-mamx-bf16")
+            flags.cmake_flags.append("-DGGML_AMX_BF16=ON")
+        
+        if platform.system() != "Windows":
+            # -Ofast enables FMA contraction/reassociation in dot-product loops,
+            # but breaks strict IEEE NaN handling, so it is opt-in
+            release_flags = ["-Ofast" if self.config.allow_fast_math else "-O3", "-flto=auto", "-fno-plt",
+                             "-funroll-loops"] + flags.cpu_arch_flags
+            if pgo_phase == "generate" and pgo_profile_dir:
+                release_flags.append(f"-fprofile-generate={pgo_profile_dir}")
+            elif pgo_phase == "use" and pgo_profile_dir:
+                release_flags.extend([f"-fprofile-use={pgo_profile_dir}", "-fprofile-correction"])
+            release_flags_str = " ".join(release_flags)
+            flags.cmake_flags.append(f"-DCMAKE_C_FLAGS_RELEASE={release_flags_str}")
+            flags.cmake_flags.append(f"-DCMAKE_CXX_FLAGS_RELEASE={release_flags_str}")
         
         # CPU-специфичные оптимизации
         if "intel" in hardware.cpu_model.lower():
@@ -637,8 +1284,18 @@ class HardwareOptimizer:
         
         return flags
 
-    def optimize_runtime_parameters(self) -> RuntimeParameters:
-        """Оптимизирует параметры запуска для модели."""
+    def optimize_runtime_parameters(self, model_path: Optional[str] = None) -> RuntimeParameters:
+        """
+        Оптимизирует параметры запуска для модели.
+        
+        Args:
+            model_path: Путь к модели GGUF. Если указан, размер контекста и батча
+                подбирается по фактическому объему KV-кэша этой модели, иначе
+                по эмпирическим порогам RAM.
+        
+        Returns:
+            RuntimeParameters: Оптимизированные параметры
+        """
         params = self.optimization_profile.runtime_parameters
         hardware = self.optimization_profile.hardware
         
@@ -646,26 +1303,39 @@ class HardwareOptimizer:
         optimal_threads = min(hardware.cpu_cores, max(1, hardware.cpu_cores - 1))
         params.n_threads = optimal_threads
         
+        # Несколько GPU: слои делятся пропорционально VRAM устройств (--tensor-split),
+        # а объем для офлоада считается по суммарной VRAM
+        vram_per_device = hardware.gpu_vram_per_device
+        total_vram = sum(vram_per_device) if len(vram_per_device) > 1 else hardware.gpu_vram
+        
         # Определение числа слоев для офлоада на GPU
         if hardware.has_nvidia_gpu and hardware.has_cuda:
             # Офлоад зависит от объема VRAM
-            if hardware.gpu_vram >= 8000:  # 8+ ГБ VRAM
+            if total_vram >= 8000:  # 8+ ГБ VRAM
                 params.n_gpu_layers = 32  # Большинство слоев
-            elif hardware.gpu_vram >= 4000:  # 4-8 ГБ VRAM
+            elif total_vram >= 4000:  # 4-8 ГБ VRAM
                 params.n_gpu_layers = 20  # Около половины слоев
             else:  # < 4 ГБ VRAM
                 params.n_gpu_layers = 8  # Несколько слоев
         elif hardware.has_amd_gpu and hardware.has_rocm:
             # AMD GPUs обычно немного менее эффективны в этих задачах
-            if hardware.gpu_vram >= 8000:
+            if total_vram >= 8000:
                 params.n_gpu_layers = 28
-            elif hardware.gpu_vram >= 4000:
+            elif total_vram >= 4000:
                 params.n_gpu_layers = 16
             else:
                 params.n_gpu_layers = 4
         else:
             params.n_gpu_layers = 0
         
+        if params.n_gpu_layers > 0 and len(vram_per_device) > 1:
+            params.tensor_split = [round(vram / total_vram, 4) for vram in vram_per_device]
+        else:
+            params.tensor_split = []
+        
+        if params.n_gpu_layers > 0 and model_path:
+            self._fit_gpu_layers(params, model_path, total_vram, max(1, len(vram_per_device)))
+        
         # Оптимальный размер батча зависит от доступной memory
         # Базовое эмпирическое правило: ~1MB на токен в батче для 7B модели
         if hardware.total_ram > 32000:  # >32 ГБ RAM
@@ -688,11 +1358,35 @@ class HardwareOptimizer:
         else:
             params.context_size = 1024
         
+        # Квантованный (q8_0) KV-кэш вдвое меньше fp16 при незаметной потере
+        # качества - на машинах с малым объемом RAM это позволяет удвоить контекст
+        params.kv_cache_type = "q8_0" if hardware.total_ram < 16000 else "f16"
+        
+        if model_path:
+            self._size_context_for_model(params, model_path)
+        
         params.n_ctx = params.context_size
         
-        # Оптимизация распределения тензоров между несколькими GPU
-        # В этой простой версии мы не реализуем множественное распределение,
-        # но можно добавить эту функциональность позже
+        # Инференс упирается в пропускную способность памяти: на многосокетных
+        # системах обращения к памяти другого узла (UPI/QPI) съедают 30-50%.
+        # С numactl сервер целиком живет на одном узле, иначе llama.cpp
+        # распределяет веса по локальной памяти всех узлов
+        if hardware.numa_nodes <= 1:
+            params.numa_strategy = "none"
+        elif shutil.which("numactl"):
+            params.numa_strategy = "numactl"
+            # Потоков не больше, чем физических ядер узла
+            node_cores = hardware.cores_per_node[0] * hardware.cpu_cores // max(1, hardware.cpu_threads)
+            params.n_threads = max(1, min(params.n_threads, node_cores))
+        else:
+            params.numa_strategy = "distribute"
+        
+        # Один поток на физическое ядро: SMT-соседи делят L1/L2 и порты исполнения.
+        # При --numa llama.cpp сам распределяет потоки по узлам
+        if params.numa_strategy == "none":
+            params.cpu_affinity = self._physical_core_cpus()[:params.n_threads]
+        else:
+            params.cpu_affinity = []
         
         # Сохраняем параметры
         self.optimization_profile.runtime_parameters = params
@@ -700,7 +1394,114 @@ class HardwareOptimizer:
         
         return params
     
-    def run_benchmark(self, model_path: str, prompt: str = None, iterations: int = 3) -> BenchmarkResult:
+    def _fit_gpu_layers(self, params: RuntimeParameters, model_path: str,
+                        total_vram: int, n_devices: int) -> bool:
+        """
+        Подбирает n_gpu_layers по размеру весов модели и суммарной VRAM.
+        
+        If the weights fit into the aggregate VRAM, every layer (plus the
+        output layer) is offloaded; otherwise the share of layers that fits.
+        
+        Args:
+            params: Параметры запуска (изменяются на месте)
+            model_path: Путь к модели GGUF
+            total_vram: Суммарная VRAM всех GPU, MB
+            n_devices: Число GPU (на каждом резервируется место под контекст CUDA/ROCm)
+        
+        Returns:
+            bool: True если число слоев подобрано по метаданным модели
+        """
+        try:
+            n_layers = _read_gguf_metadata(model_path, ('block_count',)).get('block_count')
+            weights_mb = os.path.getsize(model_path) / (1024 * 1024)
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            logger.warning(f"Не удалось прочитать метаданные GGUF ({model_path}): {e}")
+            return False
+        if not n_layers or weights_mb <= 0:
+            return False
+        
+        # Остаток VRAM уходит под KV-кэш офлоаженных слоев и рабочие буферы
+        usable_vram = total_vram * _GPU_VRAM_BUDGET_FRACTION - _GPU_CONTEXT_RESERVE_MB * n_devices
+        if usable_vram >= weights_mb:
+            params.n_gpu_layers = n_layers + 1  # llama.cpp считает выходной слой отдельно
+        else:
+            params.n_gpu_layers = max(0, int(n_layers * usable_vram / weights_mb))
+        logger.info(f"GPU offload: {params.n_gpu_layers}/{n_layers + 1} слоев, "
+                    f"{total_vram} МБ VRAM на {n_devices} GPU, split={params.tensor_split}")
+        return True
+    
+    def _size_context_for_model(self, params: RuntimeParameters, model_path: str) -> bool:
+        """
+        Подбирает наибольшие (context_size, batch_size), помещающиеся в память.
+        
+        KV cache takes 2 * n_layers * n_head_kv * head_dim * bytes per token of
+        context and for long contexts dwarfs the weights; the batch mostly
+        costs compute buffer (KQ scores and activations, f32).
+        
+        Args:
+            params: Параметры запуска (изменяются на месте)
+            model_path: Путь к модели GGUF
+        
+        Returns:
+            bool: True если размеры подобраны по метаданным модели
+        """
+        try:
+            meta = _read_gguf_metadata(model_path, (
+                'block_count', 'embedding_length', 'context_length',
+                'attention.head_count', 'attention.head_count_kv',
+                'attention.key_length', 'attention.value_length',
+            ))
+            weights_mb = os.path.getsize(model_path) / (1024 * 1024)
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            logger.warning(f"Не удалось прочитать метаданные GGUF ({model_path}): {e}")
+            return False
+        
+        n_layers = meta.get('block_count')
+        n_embd = meta.get('embedding_length')
+        n_head = meta.get('attention.head_count')
+        if not (n_layers and n_embd and n_head):
+            logger.warning(f"В метаданных {model_path} нет размеров модели, используем пороги RAM")
+            return False
+        n_head_kv = meta.get('attention.head_count_kv') or n_head
+        key_dim = meta.get('attention.key_length') or n_embd // n_head
+        value_dim = meta.get('attention.value_length') or key_dim
+        kv_bytes_per_elem = _KV_CACHE_TYPE_BYTES.get(params.kv_cache_type, 2.0)
+        
+        # Байт KV-кэша на один токен контекста (K и V по всем слоям)
+        kv_bytes_per_token = n_layers * n_head_kv * (key_dim + value_dim) * kv_bytes_per_elem
+        
+        # Веса офлоаженных на GPU слоев не занимают RAM
+        cpu_layer_share = 1.0 - min(params.n_gpu_layers, n_layers) / n_layers
+        budget = (self.optimization_profile.hardware.total_ram * _MEMORY_BUDGET_FRACTION
+                  - weights_mb * cpu_layer_share) * 1024 * 1024
+        
+        max_ctx = meta.get('context_length') or _CONTEXT_SIZE_LATTICE[-1]
+        best = None
+        for ctx in _CONTEXT_SIZE_LATTICE:
+            if ctx > max_ctx:
+                break
+            kv_bytes = ctx * kv_bytes_per_token
+            # Ищем наибольший батч для этого контекста (память монотонна по батчу)
+            for batch in reversed(_BATCH_SIZE_LATTICE):
+                batch = min(batch, ctx)
+                compute_bytes = batch * (n_head * ctx + 4 * n_embd) * 4
+                if kv_bytes + compute_bytes <= budget:
+                    if best is None or ctx * batch >= best[0] * best[1]:
+                        best = (ctx, batch)
+                    break
+        
+        if best is None:
+            best = (_CONTEXT_SIZE_LATTICE[0], _BATCH_SIZE_LATTICE[0])
+            logger.warning(f"Модель {model_path} не помещается в бюджет памяти; "
+                           f"используем минимальные ctx={best[0]}, batch={best[1]}")
+        
+        params.context_size, params.batch_size = best
+        logger.info(f"KV-кэш ({params.kv_cache_type}): {kv_bytes_per_token * best[0] / (1024 * 1024):.0f} МБ "
+                    f"при ctx={best[0]}, batch={best[1]}")
+        return True
+    
+    def run_benchmark(self, model_path: str, prompt: str = None, iterations: int = 3,
+                      vary_prompts: bool = False, numa_per_node: bool = False) -> BenchmarkResult:
         """
         Запускает бенчмарк с текущими параметрами.
         
@@ -708,6 +1509,10 @@ class HardwareOptimizer:
             model_path: Путь к модели для тестирования
             prompt: Текст для генерации (если None, будет использован стандартный)
             iterations: Количество итераций для усреднения результатов
+            vary_prompts: Делать каждый запрос уникальным и отключить кэш промпта,
+                чтобы измерить "холодный" TTFT вместо переиспользования префикса
+            numa_per_node: При numa_strategy="numactl" запустить по серверу на
+                каждый NUMA-узел (режим пропускной способности)
         
         Returns:
             BenchmarkResult: Результаты бенчмарка
@@ -733,6 +1538,20 @@ class HardwareOptimizer:
             "--n-gpu-layers", str(params.n_gpu_layers),
             "--embedding"
         ]
+        if params.tensor_split:
+            server_cmd.extend(["--tensor-split", ",".join(f"{share:g}" for share in params.tensor_split)])
+        if params.numa_strategy != "none":
+            server_cmd.extend(["--numa", params.numa_strategy])
+        if params.kv_cache_type != "f16":
+            server_cmd.extend(["--cache-type-k", params.kv_cache_type,
+                               "--cache-type-v", params.kv_cache_type])
+            # llama.cpp квантует V-кэш только вместе с flash attention
+            server_cmd.append("--flash-attn")
+        # Continuous batching: сервер чередует prefill и decode параллельных запросов
+        server_cmd.extend(["--parallel", str(params.n_parallel), "--cont-batching"])
+        if not vary_prompts:
+            # Переиспользование KV общего префикса (в т.ч. со сдвигом) между запросами
+            server_cmd.extend(["--cache-reuse", "256"])
         
         # Запуск бенчмарка
         result = BenchmarkResult(prompt=prompt)
@@ -741,97 +1560,335 @@ class HardwareOptimizer:
             "context_size": params.context_size,
             "batch_size": params.batch_size,
             "n_gpu_layers": params.n_gpu_layers,
+            "tensor_split": params.tensor_split,
+            "kv_cache_type": params.kv_cache_type,
+            "n_parallel": params.n_parallel,
+            "vary_prompts": vary_prompts,
         }
         
+        # На многосокетных системах сервер привязывается к узлу через numactl,
+        # чтобы веса и KV-кэш лежали в локальной памяти; в режиме numa_per_node
+        # на каждом узле работает свой сервер, запросы распределяются по кругу
+        launches = [(server_cmd, "http://localhost:8080")]
+        if params.numa_strategy == "numactl":
+            hardware = self.optimization_profile.hardware
+            nodes = range(hardware.numa_nodes) if numa_per_node else range(1)
+            launches = [(["numactl", f"--cpunodebind={node}", f"--membind={node}"] + server_cmd +
+                         ["--port", str(8080 + node)], f"http://localhost:{8080 + node}")
+                        for node in nodes]
+            result.config["numa_servers"] = len(launches)
+        
         try:
-            # Run сервер в фоновом режиме
-            logger.info(f"Starting benchmark with command: {' '.join(server_cmd)}")
-            server_process = subprocess.Popen(
-                server_cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-            
-            # Ждем немного, чтобы сервер запустился
-            time.sleep(5)
+            # Серверы с теми же параметрами уже загружены - переиспользуем их
+            if not self._ensure_servers(launches, params.cpu_affinity):
+                logger.error("llama-server did not become ready, aborting benchmark")
+                return result
             
-            # Готовим запрос для бенчмарка
             import requests
+            
+            # Готовим запрос для бенчмарка: каждая итерация занимает все слоты серверов
+            urls = [f"{base_url}/completion" for _, base_url in launches]
+            workers = max(1, params.n_parallel) * len(urls)
             json_data = {
                 "prompt": prompt,
                 "temperature": 0.7,
-                "max_tokens": 100
+                "max_tokens": 100,
+                "stream": True,  # для измерения времени до первого токена
+                # Слот сервера хранит KV промпта: повторный префикс не проходит prefill
+                "cache_prompt": not vary_prompts
             }
+            # Тела запросов сериализуются заранее, вне измеряемого участка
+            dumps = orjson.dumps if HAS_ORJSON else (lambda obj: json.dumps(obj).encode('utf-8'))
+            if vary_prompts:
+                # Уникальное начало промпта исключает совпадение префикса
+                payloads = [dumps(dict(json_data, prompt=f"[{n}] {prompt}")) for n in range(iterations * workers)]
+            else:
+                payloads = [dumps(json_data)] * (iterations * workers)
             
             tokens_per_second_list = []
             latency_list = []
+            ttft_list = []
             
-            # Execute несколько итераций
-            for i in range(iterations):
-                start_time = time.time()
-                try:
-                    response = requests.post(
-                        "http://localhost:8080/completion",
-                        json=json_data,
-                        timeout=30
-                    )
-                    
-                    if response.status_code == 200:
-                        end_time = time.time()
-                        data = response.json()
-                        
-                        # Вычисляем метрики
-                        tokens_generated = len(data.get("content", "").split())
-                        total_time = end_time - start_time
-                        
-                        tokens_per_second = tokens_generated / total_time
-                        latency = total_time * 1000  # в миллисекундах
-                        
-                        tokens_per_second_list.append(tokens_per_second)
-                        latency_list.append(latency)
-                        
-                        logger.info(f"Benchmark iteration {i+1}/{iterations}: " +
-                                  f"{tokens_per_second:.2f} tokens/sec, {latency:.2f} ms latency")
-                    else:
-                        logger.error(f"Benchmark request failed with status {response.status_code}")
-                except Exception as e:
-                    logger.error(f"Benchmark request failed: {e}")
-                
-                time.sleep(2)  # Пауза между итерациями
+            # Пиковый RSS серверов снимается в фоне, пока идут запросы
+            self._peak_rss = 0
+            stop_sampling = threading.Event()
+            sampler = threading.Thread(target=self._rss_sampler,
+                                       args=([proc.pid for proc in self._server_procs], stop_sampling),
+                                       daemon=True)
+            sampler.start()
             
-            # Завершаем сервер
-            server_process.terminate()
             try:
-                server_process.wait(timeout=5)
-            except:
-                server_process.kill()
+                # Keep-alive соединения переиспользуются между итерациями, чтобы установка
+                # TCP-соединения не попадала в измеренную латентность; по одному на слот
+                with requests.Session() as session, ThreadPoolExecutor(max_workers=workers) as executor:
+                    session.headers.update({"Connection": "keep-alive", "Content-Type": "application/json"})
+                    session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=len(urls),
+                                                                          pool_maxsize=workers))
+                
+                    # Прогревочный запрос вне измерений (выделение KV-кэша, выбор ядер)
+                    for url in urls:
+                        try:
+                            self._timed_completion(session, url, dumps(dict(json_data, max_tokens=1)))
+                        except Exception as e:
+                            logger.warning(f"Benchmark warm-up request failed: {e}")
+                
+                    # Все запросы итераций отправляются сразу: освободившийся слот
+                    # сразу берет следующий запрос, без барьера между итерациями
+                    futures = [executor.submit(self._timed_completion, session, urls[n % len(urls)], payload)
+                               for n, payload in enumerate(payloads)]
+                    timings = []
+                    for future in futures:
+                        try:
+                            timing = future.result()
+                        except Exception as e:
+                            logger.error(f"Benchmark request failed: {e}")
+                            continue
+                        if timing is not None:
+                            timings.append(timing)
+                            latency_list.append(timing["total_time"] * 1000)  # в миллисекундах
+                            ttft_list.append(timing["ttft"] * 1000)
+                
+                    if timings:
+                        # Суммарная пропускная способность серверов, а не среднее по запросам
+                        wall_time = max(t["end"] for t in timings) - min(t["start"] for t in timings)
+                        tokens_per_second_list.append(sum(t["tokens"] for t in timings) / wall_time)
+                        logger.info(f"Benchmark: {len(timings)}/{len(futures)} requests, " +
+                                  f"{tokens_per_second_list[0]:.2f} tokens/sec aggregate, " +
+                                  f"{wall_time * 1000:.2f} ms wall time")
+            finally:
+                stop_sampling.set()
+                sampler.join()
+            result.peak_rss_mb = self._peak_rss // (1024 * 1024)
             
             # Вычисляем средние значения
             if tokens_per_second_list:
                 result.tokens_per_second = sum(tokens_per_second_list) / len(tokens_per_second_list)
             if latency_list:
                 result.latency_ms = sum(latency_list) / len(latency_list)
+                result.latency_p50_ms = _percentile(latency_list, 50)
+                result.latency_p90_ms = _percentile(latency_list, 90)
+                result.latency_p99_ms = _percentile(latency_list, 99)
+            if ttft_list:
+                result.ttft_ms = sum(ttft_list) / len(ttft_list)
             
             # Получаем использованную память
             result.memory_used_mb = self._measure_memory_usage()
             
             # Add результат в профиль
-            self.optimization_profile.benchmark_results.append(result)
+            self._record_benchmark_result(result)
             self._save_profile()
             
             return result
             
         except Exception as e:
             logger.error(f"Benchmark failed: {e}")
-            # В случае ошибки убиваем процесс сервера, если он еще жив
-            try:
-                server_process.terminate()
-            except:
-                pass
+            # Состояние серверов после ошибки неизвестно - следующий вызов запустит новые
+            self.close()
             
             return result
+    
+    def _ensure_servers(self, launches: List[Tuple[List[str], str]],
+                        cpu_affinity: Optional[List[int]] = None) -> bool:
+        """
+        Возвращает готовые процессы llama-server, запущенные командами launches.
+        
+        Загрузка модели и прогрев занимают секунды, поэтому при переборе
+        параметров серверы перезапускаются только когда меняются команды.
+        
+        Args:
+            launches: Пары (команда запуска, базовый URL) для каждого сервера
+            cpu_affinity: Логические CPU, к которым привязать сервер
+            
+        Returns:
+            bool: True если все серверы готовы принимать запросы
+        """
+        server_params = (tuple(tuple(cmd) for cmd, _ in launches), tuple(cpu_affinity or ()))
+        if (self._server_procs and all(proc.poll() is None for proc in self._server_procs)
+                and self._server_params == server_params):
+            logger.info("Reusing running llama-server")
+            return True
+        
+        self.close()
+        if not self._atexit_registered:
+            atexit.register(self.close)
+            self._atexit_registered = True
+        self._server_params = server_params
+        
+        for server_cmd, _ in launches:
+            popen_cmd = list(server_cmd)
+            popen_kwargs: Dict[str, Any] = {}
+            if cpu_affinity:
+                # OpenMP-сборка llama.cpp тоже держит потоки на своих ядрах
+                popen_kwargs["env"] = dict(os.environ, OMP_PROC_BIND="close", OMP_PLACES="cores")
+                cpu_list = ",".join(map(str, cpu_affinity))
+                if os.name == 'nt':
+                    popen_kwargs["creationflags"] = _CREATE_SUSPENDED
+                elif shutil.which("taskset"):
+                    popen_cmd = ["taskset", "-c", cpu_list] + popen_cmd
+                else:
+                    logger.warning("taskset not found, llama-server threads won't be pinned")
+                logger.info(f"Pinning llama-server to CPUs {cpu_list}")
+            
+            # Вывод сервера идет в файл: непрочитанный PIPE заполняется (~64 КБ)
+            # и блокирует llama-server на write() посреди генерации. Имя файла
+            # уникально: параллельные оптимизаторы не пишут в один лог, а чужой
+            # файл или симлинк в общем каталоге не будет перезаписан
+            server_log = tempfile.NamedTemporaryFile(
+                prefix=f"llama-server-{len(self._server_procs)}-", suffix=".log", delete=False)
+            self._server_logs.append(server_log)
+            
+            logger.info(f"Starting benchmark with command: {' '.join(popen_cmd)} (log: {server_log.name})")
+            server_process = subprocess.Popen(
+                popen_cmd,
+                stdout=server_log,
+                stderr=subprocess.STDOUT,
+                **popen_kwargs
+            )
+            self._server_procs.append(server_process)
+            if popen_kwargs.get("creationflags") == _CREATE_SUSPENDED:
+                # SetProcessAffinityMask до старта потоков, затем ResumeThread
+                server_ps = psutil.Process(server_process.pid)
+                try:
+                    server_ps.cpu_affinity(cpu_affinity)
+                except (psutil.Error, ValueError) as e:
+                    logger.warning(f"Failed to set llama-server CPU affinity: {e}")
+                server_ps.resume()
+        
+        # Ждем готовности серверов (загрузка модели) вместо фиксированной паузы;
+        # модели на разных узлах загружаются параллельно
+        for server_process, server_log, (_, base_url) in zip(self._server_procs, self._server_logs, launches):
+            if not self._wait_for_server_ready(server_process, base_url):
+                logger.error(f"See llama-server output in {server_log.name}")
+                self.close()
+                return False
+        return True
+    
+    def close(self) -> None:
+        """Останавливает прогретые процессы llama-server, если они запущены."""
+        server_procs, self._server_procs = self._server_procs, []
+        self._server_params = None
+        for server_process in server_procs:
+            if server_process.poll() is None:
+                server_process.terminate()
+        for server_process in server_procs:
+            try:
+                server_process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                server_process.kill()
+        server_logs, self._server_logs = self._server_logs, []
+        for server_log in server_logs:
+            server_log.close()
 
+    def _timed_completion(self, session, url: str, body: bytes) -> Optional[Dict[str, float]]:
+        """
+        Выполняет один потоковый запрос /completion и измеряет его.
+        
+        Args:
+            session: requests.Session
+            url: URL эндпоинта /completion
+            body: Сериализованное JSON-тело запроса (со "stream": True)
+            
+        Returns:
+            Словарь с tokens, total_time, ttft (в секундах) и отметками start/end
+            (time.perf_counter) или None при ошибке
+        """
+        start_time = time.perf_counter()
+        ttft = None
+        tokens = 0
+        with session.post(url, data=body, stream=True, timeout=30) as response:
+            if response.status_code != 200:
+                logger.error(f"Benchmark request failed with status {response.status_code}")
+                return None
+            
+            # Server-sent events: one "data: {...}" line per generated token
+            for line in response.iter_lines():
+                if not line.startswith(b"data: "):
+                    continue
+                if ttft is None:
+                    ttft = time.perf_counter() - start_time
+                chunk = orjson.loads(line[6:]) if HAS_ORJSON else json.loads(line[6:])
+                if chunk.get("content"):
+                    tokens += 1
+                if chunk.get("stop"):
+                    tokens = chunk.get("tokens_predicted", tokens)
+                    break
+        
+        end_time = time.perf_counter()
+        total_time = end_time - start_time
+        return {"tokens": tokens, "total_time": total_time, "ttft": ttft if ttft is not None else total_time,
+                "start": start_time, "end": end_time}
+    
+    def _wait_for_server_ready(self, server_process: subprocess.Popen, base_url: str,
+                               timeout: float = 120.0) -> bool:
+        """
+        Ждет, пока llama-server не ответит 200 на GET /health.
+        
+        Args:
+            server_process: Процесс сервера
+            base_url: Базовый URL сервера
+            timeout: Максимальное время ожидания в секундах
+            
+        Returns:
+            bool: True если сервер готов, False при таймауте или завершении процесса
+        """
+        import requests
+        deadline = time.monotonic() + timeout
+        delay = 0.05
+        while time.monotonic() < deadline:
+            if server_process.poll() is not None:
+                logger.error(f"llama-server exited with code {server_process.returncode}")
+                return False
+            try:
+                # 503 while the model is still loading
+                if requests.get(f"{base_url}/health", timeout=1).status_code == 200:
+                    return True
+            except requests.RequestException:
+                pass
+            time.sleep(delay)
+            delay = min(delay * 2, 1.0)
+        return False
+    
+    def estimate_mock_throughput(self, batch_sizes=None, n_gpu_layers=None, cpu_threads=None):
+        """
+        Оценивает скорость генерации (токенов/сек) по эвристике имитации бенчмарка.
+        
+        Аргументы могут быть скалярами или массивами: с NumPy вся сетка
+        параметров (например, batch × gpu_layers) считается одним
+        broadcast-проходом.
+        
+        Args:
+            batch_sizes: Размер(ы) батча (по умолчанию из текущих параметров)
+            n_gpu_layers: Число слоев на GPU (по умолчанию из текущих параметров)
+            cpu_threads: Число потоков CPU (по умолчанию из профиля оборудования)
+            
+        Returns:
+            float для скалярных аргументов, иначе np.ndarray формы broadcast
+        """
+        params = self.optimization_profile.runtime_parameters
+        hardware = self.optimization_profile.hardware
+        batch_sizes = params.batch_size if batch_sizes is None else batch_sizes
+        n_gpu_layers = params.n_gpu_layers if n_gpu_layers is None else n_gpu_layers
+        cpu_threads = hardware.cpu_threads if cpu_threads is None else cpu_threads
+        
+        # Это очень приблизительная формула, только для демонстрации
+        base_speed = 15.0  # базовая скорость в токенах/сек
+        # RAM влияние, нормализуем по отношению к 8GB
+        ram_factor = min(hardware.total_ram / 8000, 2.0)
+        # Влияние GPU (если используется), VRAM в соотношении к 4GB
+        gpu_boost = 1.5 + min(hardware.gpu_vram / 4000, 2.0) if hardware.gpu_vram > 0 else 1.0
+        
+        if HAS_NUMPY:
+            cpu_factor = np.minimum(np.asarray(cpu_threads, dtype=np.float64) / 2, 2.0)
+            gpu_factor = np.where(np.asarray(n_gpu_layers) > 0, gpu_boost, 1.0)
+            batch_factor = np.minimum(np.asarray(batch_sizes, dtype=np.float64) / 256, 1.5)
+            tokens_per_second = base_speed * ram_factor * cpu_factor * gpu_factor * batch_factor
+            return tokens_per_second.item() if tokens_per_second.ndim == 0 else tokens_per_second
+        
+        cpu_factor = min(cpu_threads / 2, 2.0)
+        gpu_factor = gpu_boost if n_gpu_layers > 0 else 1.0
+        batch_factor = min(batch_sizes / 256, 1.5)
+        return base_speed * ram_factor * cpu_factor * gpu_factor * batch_factor
+    
     def run_mock_benchmark(self, model_path: str, prompt: str = None, iterations: int = 1) -> BenchmarkResult:
         """
         Запускает имитацию бенчмарка без реального сервера для тестирования.
@@ -857,27 +1914,10 @@ class HardwareOptimizer:
         memory_used = self._measure_memory_usage()
         
         # Искусственно рассчитываем скорость генерации на основе характеристик оборудования
-        # Это очень приблизительная формула, только для демонстрации
-        base_speed = 15.0  # базовая скорость в токенах/сек
-        
-        # CPU влияние (более быстрый CPU = больше токенов/сек)
-        cpu_factor = min(hardware.cpu_threads / 2, 2.0)
-        
-        # RAM влияние
-        ram_factor = min(hardware.total_ram / 8000, 2.0)  # нормализуем по отношению к 8GB
-        
-        # Расчет влияния GPU (если используется)
-        gpu_factor = 1.0
-        if params.n_gpu_layers > 0 and hardware.gpu_vram > 0:
-            gpu_factor = 1.5 + (min(hardware.gpu_vram / 4000, 2.0))  # VRAM в соотношении к 4GB
-        
-        # Размер батча
-        batch_factor = min(params.batch_size / 256, 1.5)
-        
-        # Финальный расчет скорости
-        tokens_per_second = base_speed * cpu_factor * ram_factor * gpu_factor * batch_factor
+        tokens_per_second = self.estimate_mock_throughput()
         
         # Расчет латентности
+        cpu_factor = min(hardware.cpu_threads / 2, 2.0)
         latency_ms = 100 / cpu_factor  # базовая латентность 100ms, уменьшается с ростом CPU
         
         # Add немного случайности для реалистичности
@@ -901,7 +1941,7 @@ class HardwareOptimizer:
         )
         
         # Add результат в профиль
-        self.optimization_profile.benchmark_results.append(result)
+        self._record_benchmark_result(result)
         self._save_profile()
         
         logger.info(f"Имитация бенчмарка: {tokens_per_second:.2f} токенов/сек, латентность: {latency_ms:.2f} мс")
@@ -909,6 +1949,9 @@ class HardwareOptimizer:
     
     def _get_llama_server_path(self) -> str:
         """Возвращает путь к llama-server."""
+        if self._server_path_cache:
+            return self._server_path_cache
+        
         # Ищем в наиболее вероятных местах
         possible_paths = [
             os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 
@@ -921,10 +1964,38 @@ class HardwareOptimizer:
         
         for path in possible_paths:
             if os.path.exists(path) and os.access(path, os.X_OK):
+                self._server_path_cache = path
                 return path
         
         return None
     
+    def _rss_sampler(self, pids: List[int], stop_event: threading.Event, interval: float = 0.1) -> None:
+        """
+        Опрашивает суммарный RSS процессов (10 Гц) и сохраняет максимум в self._peak_rss.
+        
+        Args:
+            pids: PID процессов llama-server
+            stop_event: Событие остановки опроса
+            interval: Период опроса в секундах
+        """
+        processes = []
+        for pid in pids:
+            try:
+                processes.append(psutil.Process(pid))
+            except psutil.Error:
+                pass
+        
+        while True:
+            rss = 0
+            for process in processes:
+                try:
+                    rss += process.memory_info().rss
+                except psutil.Error:
+                    pass
+            self._peak_rss = max(self._peak_rss, rss)
+            if stop_event.wait(interval):
+                break
+    
     def _measure_memory_usage(self) -> int:
         """Измеряет текущее использование memory."""
         try:
@@ -934,12 +2005,16 @@ class HardwareOptimizer:
         except:
             return 0
     
-    def compile_optimized_server(self, llama_cpp_path: Optional[str] = None) -> bool:
+    def compile_optimized_server(self, llama_cpp_path: Optional[str] = None,
+                                 pgo_phase: Optional[str] = None,
+                                 pgo_profile_dir: Optional[str] = None) -> bool:
         """
         Компилирует оптимизированную версию llama.cpp сервера.
         
         Args:
             llama_cpp_path: Путь к исходникам llama.cpp. Если None, попробуем скачать.
+            pgo_phase: Фаза PGO ("generate" или "use"), см. optimize_compilation_flags
+            pgo_profile_dir: Каталог для профилей PGO
             
         Returns:
             bool: True если компиляция прошла успешно, иначе False
@@ -952,7 +2027,7 @@ class HardwareOptimizer:
                 return False
         
         # Оптимизируем флаги компиляции
-        flags = self.optimize_compilation_flags()
+        flags = self.optimize_compilation_flags(pgo_phase=pgo_phase, pgo_profile_dir=pgo_profile_dir)
         
         # Create директорию для сборки
         build_dir = os.path.join(llama_cpp_path, "build")
@@ -991,15 +2066,73 @@ class HardwareOptimizer:
         if platform.system() == "Windows":
             target_path += ".exe"
         
+        # Прогретый сервер использует старый бинарник: останавливаем его до
+        # замены файла (запись поверх запущенного файла дает ETXTBSY)
+        self.close()
         try:
             shutil.copy2(server_bin, target_path)
             os.chmod(target_path, 0o755)  # Make executable
+            self._server_path_cache = target_path
             logger.info(f"Compiled server copied to {target_path}")
             return True
         except Exception as e:
             logger.error(f"Failed to copy compiled server: {e}")
             return False
     
+    def compile_pgo_server(self, model_path: str, llama_cpp_path: Optional[str] = None,
+                           iterations: int = 3) -> bool:
+        """
+        Компилирует сервер с profile-guided optimization.
+        
+        Двухфазная сборка: инструментированный сервер (-fprofile-generate)
+        прогоняется через run_benchmark, затем сервер пересобирается
+        с собранным профилем (-fprofile-use).
+        
+        Args:
+            model_path: Путь к модели для обучающего прогона
+            llama_cpp_path: Путь к исходникам llama.cpp. Если None, попробуем скачать.
+            iterations: Количество итераций обучающего бенчмарка
+            
+        Returns:
+            bool: True если компиляция прошла успешно, иначе False
+        """
+        if platform.system() == "Windows":
+            logger.warning("PGO is only supported with GCC/Clang, building without profile")
+            return self.compile_optimized_server(llama_cpp_path)
+        
+        if not llama_cpp_path:
+            llama_cpp_path = self._download_llama_cpp()
+            if not llama_cpp_path:
+                logger.error("Failed to download llama.cpp sources")
+                return False
+        
+        pgo_profile_dir = os.path.join(llama_cpp_path, "build", "pgo-profile")
+        os.makedirs(pgo_profile_dir, exist_ok=True)
+        
+        # Фаза 1: инструментированная сборка
+        logger.info("PGO phase 1: building instrumented server")
+        if not self.compile_optimized_server(llama_cpp_path, pgo_phase="generate",
+                                             pgo_profile_dir=pgo_profile_dir):
+            return False
+        
+        # Фаза 2: обучающий прогон (сервер пишет *.gcda при завершении)
+        logger.info("PGO phase 2: collecting profile with benchmark workload")
+        training_result = self.run_benchmark(model_path, iterations=iterations)
+        # run_benchmark оставляет сервер прогретым; *.gcda записываются только
+        # при его завершении, поэтому останавливаем его до пересборки
+        self.close()
+        # Instrumented timings are not representative, keep them out of the profile
+        if training_result in self.optimization_profile.benchmark_results:
+            self.optimization_profile.benchmark_results.remove(training_result)
+        if training_result.tokens_per_second <= 0:
+            logger.error("PGO training run produced no results, aborting")
+            return False
+        
+        # Фаза 3: финальная сборка с профилем
+        logger.info("PGO phase 3: building server with collected profile")
+        return self.compile_optimized_server(llama_cpp_path, pgo_phase="use",
+                                             pgo_profile_dir=pgo_profile_dir)
+    
     def _download_llama_cpp(self) -> Optional[str]:
         """
         Скачивает исходники llama.cpp из репозитория.
@@ -1037,6 +2170,9 @@ class HardwareOptimizer:
             "n_ctx": params.n_ctx,
             "rope_freq_base": params.rope_freq_base,
             "rope_freq_scale": params.rope_freq_scale,
+            "numa": params.numa_strategy,
+            "kv_cache_type": params.kv_cache_type,
+            "n_parallel": params.n_parallel,
         }
     
     def run_optimization(self, model_path: str) -> Dict[str, Any]:
@@ -1049,17 +2185,19 @@ class HardwareOptimizer:
         Returns:
             Dict[str, Any]: Результаты оптимизации
         """
-        # 1. Обновляем профиль оборудования
-        self._update_hardware_profile()
-        
-        # 2. Оптимизируем флаги компиляции
-        compilation_flags = self.optimize_compilation_flags()
-        
-        # 3. Оптимизируем параметры запуска
-        runtime_params = self.optimize_runtime_parameters()
-        
-        # 4. Запускаем бенчмарк
-        benchmark_result = self.run_benchmark(model_path)
+        # Профиль записывается один раз в конце, а не после каждого шага
+        with self.batched_save():
+            # 1. Обновляем профиль оборудования
+            self._update_hardware_profile()
+            
+            # 2. Оптимизируем флаги компиляции
+            compilation_flags = self.optimize_compilation_flags()
+            
+            # 3. Оптимизируем параметры запуска
+            runtime_params = self.optimize_runtime_parameters(model_path)
+            
+            # 4. Запускаем бенчмарк
+            benchmark_result = self.run_benchmark(model_path)
         
         # 5. Возвращаем результаты
         return {
@@ -1079,10 +2217,16 @@ def main():
     parser.add_argument("--benchmark", action="store_true", help="Run benchmark")
     parser.add_argument("--optimize", action="store_true", help="Run full optimization")
     parser.add_argument("--llama-cpp", type=str, help="Path to llama.cpp sources")
+    parser.add_argument("--pgo", action="store_true", help="Compile with profile-guided optimization (requires --model)")
+    parser.add_argument("--fast-math", action="store_true", help="Allow -Ofast (non-IEEE floating point)")
+    parser.add_argument("--archive", action="store_true", help="Append every benchmark result to benchmarks.jsonl.gz")
+    parser.add_argument("--vary-prompts", action="store_true", help="Benchmark with unique prompts and no prompt cache (cold TTFT)")
     
     args = parser.parse_args()
     
     optimizer = HardwareOptimizer()
+    optimizer.config.allow_fast_math = args.fast_math
+    optimizer.archive_benchmarks = args.archive
     
     if args.optimize:
         if not args.model:
@@ -1096,7 +2240,14 @@ def main():
             print(f"Benchmark: {results['benchmark_result']['tokens_per_second']:.2f} tokens/sec")
     
     elif args.compile:
-        success = optimizer.compile_optimized_server(args.llama_cpp)
+        optimizer.refresh()
+        if args.pgo:
+            if not args.model:
+                print("Error: Model path is required for PGO compilation")
+                return
+            success = optimizer.compile_pgo_server(args.model, args.llama_cpp)
+        else:
+            success = optimizer.compile_optimized_server(args.llama_cpp)
         if success:
             print("Server compiled successfully")
         else:
@@ -1106,7 +2257,8 @@ def main():
         if not args.model:
             print("Error: Model path is required for benchmarking")
             return
-        result = optimizer.run_benchmark(args.model)
+        optimizer.refresh()
+        result = optimizer.run_benchmark(args.model, vary_prompts=args.vary_prompts)
         print(f"Benchmark result: {result.tokens_per_second:.2f} tokens/sec, {result.latency_ms:.2f} ms latency")
     
     else:
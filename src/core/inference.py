@@ -3,7 +3,8 @@ Inference logic for llama.cpp integration.
 """
 import logging
 import time
-from typing import Dict, Any, List, Optional, Iterator, Union
+from collections import deque
+from typing import Dict, Any, List, Optional, Iterator, Union, Tuple
 
 logger = logging.getLogger(__name__)
 
@@ -21,8 +22,8 @@ class LlamaInference:
             llama_instance: Initialized llama.cpp model instance
         """
         self.llama = llama_instance
-        self.history = []
         self.max_history_size = 10
+        self.history = deque(maxlen=self.max_history_size)
         
     def completion(self, 
                    prompt: str, 
@@ -54,11 +55,10 @@ class LlamaInference:
             if stream:
                 return self._streaming_inference(prompt, max_tokens, temperature, top_p, stop_sequences)
             else:
-                result = self._synchronous_inference(prompt, max_tokens, temperature, top_p, stop_sequences)
+                result, tokens = self._synchronous_inference(prompt, max_tokens, temperature, top_p, stop_sequences)
                 
                 # Log performance metrics
                 elapsed = time.time() - start_time
-                tokens = len(result.split())
                 logger.debug(f"Generated {tokens} tokens in {elapsed:.2f}s ({tokens/elapsed:.2f} tokens/s)")
                 
                 # Store in history
@@ -70,8 +70,8 @@ class LlamaInference:
             logger.error(f"Inference error: {str(e)}")
             return "" if not stream else iter([""])
     
-    def _synchronous_inference(self, prompt, max_tokens, temperature, top_p, stop):
-        """Generate text synchronously."""
+    def _synchronous_inference(self, prompt, max_tokens, temperature, top_p, stop) -> Tuple[str, int]:
+        """Generate text synchronously. Returns the text and its token count."""
         params = self._prepare_inference_params(prompt, max_tokens, temperature, top_p)
         
         # Add stop sequences if provided
@@ -79,7 +79,20 @@ class LlamaInference:
             params["stop"] = stop
             
         result = self.llama.create_completion(**params)
-        return result["choices"][0]["text"]
+        text = result["choices"][0]["text"]
+        
+        # Prefer the backend's own count; whitespace splitting undercounts BPE tokens
+        completion_tokens = result.get("usage", {}).get("completion_tokens")
+        if completion_tokens is None:
+            completion_tokens = self._count_tokens(text)
+        return text, completion_tokens
+    
+    def _count_tokens(self, text: str) -> int:
+        """Count tokens in text with the model tokenizer."""
+        try:
+            return len(self.llama.tokenize(text.encode("utf-8"), add_bos=False))
+        except Exception:
+            return len(text.split())
     
     def _streaming_inference(self, prompt, max_tokens, temperature, top_p, stop):
         """Generate text as a stream."""
@@ -90,16 +103,32 @@ class LlamaInference:
             params["stop"] = stop
         
         # Create accumulator for history
-        complete_text = ""
+        parts = []
+        ttft = None
+        start_time = time.perf_counter()
         
-        # Stream tokens
+        # Stream tokens (llama.cpp yields one chunk per generated token)
         for chunk in self.llama.create_completion(**params):
+            if ttft is None:
+                ttft = time.perf_counter() - start_time
             token = chunk["choices"][0]["text"]
-            complete_text += token
+            parts.append(token)
             yield token
+        
+        elapsed = time.perf_counter() - start_time
+        token_count = len(parts)
+        # Decode rate excludes the prefill time before the first token
+        decode_time = elapsed - (ttft or 0.0)
+        decode_tps = (token_count - 1) / decode_time if token_count > 1 and decode_time > 0 else 0.0
+        logger.debug(f"Streamed {token_count} tokens in {elapsed:.2f}s "
+                     f"(TTFT {(ttft or 0.0) * 1000:.0f} ms, {decode_tps:.2f} tokens/s decode)")
             
         # Store in history after completion
-        self._add_to_history(prompt, complete_text)
+        self._add_to_history(prompt, "".join(parts), {
+            "ttft": ttft,
+            "tokens": token_count,
+            "tokens_per_second": decode_tps
+        })
     
     def _prepare_inference_params(self, prompt, max_tokens, temperature, top_p, stream=False):
         """Prepare parameters for inference call."""
@@ -113,19 +142,18 @@ class LlamaInference:
             "stream": stream
         }
         
-    def _add_to_history(self, prompt, response):
+    def _add_to_history(self, prompt, response, metrics: Optional[Dict[str, Any]] = None):
         """Add interaction to history cache."""
-        self.history.append({
+        entry = {
             "prompt": prompt,
             "response": response,
             "timestamp": time.time()
-        })
-        
-        # Maintain history size
-        if len(self.history) > self.max_history_size:
-            self.history.pop(0)
+        }
+        if metrics:
+            entry.update(metrics)
+        self.history.append(entry)
             
     def clear_history(self):
         """Clear interaction history."""
-        self.history = []
+        self.history.clear()
         logger.debug("Inference history cleared")
\ No newline at end of file
@@ -0,0 +1,691 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+GC-Forged Pylot - Continuous batching for llama.cpp
+===================================================
+
+Background scheduler that decodes several generation requests in one
+llama_decode call per step, so model weights are read once per step for
+all active sequences instead of once per request, and a pool of embedding
+contexts that share the model weights so embedding calls run in parallel.
+
+Author: GC-Forged Pylot Team
+Date: 2025
+License: MIT
+"""
+
+import queue
+import bisect
+import codecs
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Dict, List, Any, Optional, Tuple, Iterator
+
+import numpy as np
+
+try:
+    import llama_cpp
+    LLAMA_CPP_AVAILABLE = True
+except ImportError:
+    LLAMA_CPP_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних токенов учитывает repeat_penalty (как repeat_last_n в llama.cpp)
+_REPEAT_LAST_N = 64
+
+# Границы корзин длины промпта в токенах: в один префилл принимаются
+# промпты одной корзины, чтобы короткие не ждали длинные в том же пакете
+_LENGTH_BUCKETS = (256, 1024, 4096)
+
+# Маркер конца потока частей ответа
+_STREAM_END = object()
+
+
+def _context_params(llama: "llama_cpp.Llama", n_ctx: int, n_batch: int, n_seq_max: int):
+    """
+    Параметры дополнительного контекста llama.cpp для модели llama.
+    
+    Число потоков, тип KV-кэша и flash attention берутся у основного
+    контекста модели.
+    """
+    params = llama_cpp.llama_context_default_params()
+    params.n_ctx = n_ctx
+    params.n_batch = n_batch
+    params.n_seq_max = n_seq_max
+    params.n_threads = llama.context_params.n_threads
+    params.n_threads_batch = llama.context_params.n_threads_batch
+    for name in ("type_k", "type_v", "flash_attn", "flash_attn_type"):
+        if hasattr(llama.context_params, name) and hasattr(params, name):
+            setattr(params, name, getattr(llama.context_params, name))
+    return params
+
+
+def _new_context(llama: "llama_cpp.Llama", params):
+    """Создает контекст llama.cpp, разделяющий веса с моделью llama."""
+    if hasattr(llama_cpp, "llama_init_from_model"):
+        ctx = llama_cpp.llama_init_from_model(llama.model, params)
+    else:
+        ctx = llama_cpp.llama_new_context_with_model(llama.model, params)
+    if not ctx:
+        raise RuntimeError("Не удалось создать дополнительный контекст llama.cpp")
+    return ctx
+
+
+def _memory_clear(ctx) -> None:
+    """Очищает KV-кэш контекста (название функции зависит от версии llama.cpp)."""
+    if hasattr(llama_cpp, "llama_memory_clear"):
+        llama_cpp.llama_memory_clear(llama_cpp.llama_get_memory(ctx), True)
+    elif hasattr(llama_cpp, "llama_kv_self_clear"):
+        llama_cpp.llama_kv_self_clear(ctx)
+    else:
+        llama_cpp.llama_kv_cache_clear(ctx)
+
+
+class _Sequence:
+    """Состояние одного запроса в планировщике."""
+    
+    __slots__ = ("prompt", "params", "future", "stream", "seq_id", "n_past", "tokens",
+                 "text", "sent", "decoder", "rng", "finish_reason", "bucket", "arrival")
+    
+    def __init__(self, prompt: List[int], params: Dict[str, Any], future: Future,
+                 stream: Optional[queue.Queue]):
+        stop = params.get("stop") or []
+        self.prompt = prompt
+        self.params = dict(params, stop=[stop] if isinstance(stop, str) else list(stop))
+        self.future = future
+        self.stream = stream
+        self.seq_id = -1
+        # Сколько токенов промпта уже в KV-кэше
+        self.n_past = 0
+        # Сгенерированные токены
+        self.tokens: List[int] = []
+        self.text = ""
+        # Сколько символов text уже отдано в поток
+        self.sent = 0
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        self.rng = np.random.default_rng(params.get("seed"))
+        self.finish_reason = None
+        self.bucket = bisect.bisect_right(_LENGTH_BUCKETS, len(prompt))
+        # Порядковый номер поступления в планировщик
+        self.arrival = 0
+    
+    @property
+    def prefilled(self) -> bool:
+        return self.n_past >= len(self.prompt)
+    
+    @property
+    def kv_budget(self) -> int:
+        """Позиции KV-кэша, которые последовательность займет в худшем случае."""
+        return len(self.prompt) + self.params["max_tokens"]
+
+
+def _sample(logits: np.ndarray, params: Dict[str, Any], history: List[int],
+            rng: np.random.Generator) -> int:
+    """
+    Выбирает следующий токен по логитам.
+    
+    Args:
+        logits: Логиты последней позиции (копия, изменяется на месте)
+        params: Параметры генерации (temperature, top_k, top_p, repeat_penalty)
+        history: Токены промпта и ответа для repeat_penalty
+        rng: Генератор случайных чисел последовательности
+    
+    Returns:
+        int: Идентификатор токена
+    """
+    repeat_penalty = params["repeat_penalty"]
+    if repeat_penalty != 1.0 and history:
+        recent = np.unique(np.asarray(history[-_REPEAT_LAST_N:], dtype=np.int64))
+        values = logits[recent]
+        logits[recent] = np.where(values > 0, values / repeat_penalty, values * repeat_penalty)
+    
+    temperature = params["temperature"]
+    if temperature <= 0:
+        return int(np.argmax(logits))
+    
+    top_k = params["top_k"]
+    if 0 < top_k < len(logits):
+        candidates = np.argpartition(logits, -top_k)[-top_k:]
+    else:
+        candidates = np.arange(len(logits))
+    candidates = candidates[np.argsort(logits[candidates])[::-1]]
+    
+    scaled = logits[candidates] / temperature
+    probs = np.exp(scaled - scaled[0])
+    probs /= probs.sum()
+    
+    top_p = params["top_p"]
+    if top_p < 1.0:
+        keep = int(np.searchsorted(np.cumsum(probs), top_p)) + 1
+        candidates, probs = candidates[:keep], probs[:keep]
+        probs /= probs.sum()
+    
+    return int(candidates[rng.choice(len(candidates), p=probs)])
+
+
+class ContinuousBatcher:
+    """
+    Планировщик непрерывного пакетирования поверх llama.cpp.
+    
+    Работает в отдельном контексте llama.cpp, который делит веса с моделью
+    Llama. Префилл и декодирование разделены по двум потокам:
+    
+    - поток префилла принимает запросы одной корзины длины и прогоняет их
+      промпты кусками по n_batch токенов, выбирает первый токен и передает
+      последовательности в кольцо декодирования;
+    - поток декодирования на каждом шаге одним llama_decode продвигает все
+      генерирующие последовательности на токен; завершившиеся освобождают
+      слот и KV-кэш.
+    
+    Один llama_context не выполняет два llama_decode одновременно, поэтому
+    вызовы идут под общей блокировкой, а после каждого куска префилла поток
+    префилла ждет (Event) один шаг декодирования. Так длинный промпт
+    задерживает уже идущие генерации не больше чем на один кусок за токен,
+    а не на весь префилл.
+    """
+    
+    def __init__(self, llama: "llama_cpp.Llama", max_concurrent: int = 8,
+                 n_ctx: int = 4096, n_batch: int = 512):
+        """
+        Создает контекст и запускает фоновые потоки.
+        
+        Args:
+            llama: Загруженная модель llama-cpp-python
+            max_concurrent: Максимальное число одновременно генерируемых последовательностей
+            n_ctx: Размер KV-кэша, общего для всех последовательностей
+            n_batch: Максимальное число токенов в одном вызове llama_decode
+        """
+        self.llama = llama
+        self.max_concurrent = max_concurrent
+        self.n_ctx = n_ctx
+        self.n_batch = max(n_batch, max_concurrent)
+        self._n_vocab = llama.n_vocab()
+        self._eos = llama.token_eos()
+        
+        params = _context_params(llama, n_ctx, self.n_batch, max_concurrent)
+        self._ctx = _new_context(llama, params)
+        self._seq_rm = self._resolve_seq_rm()
+        self._prefill_batch = llama_cpp.llama_batch_init(self.n_batch, 0, 1)
+        self._decode_batch = llama_cpp.llama_batch_init(max_concurrent, 0, 1)
+        
+        # Вызовы llama_decode и операции с KV-кэшем контекста
+        self._ctx_lock = threading.Lock()
+        # Слоты и занятые позиции KV (меняются из обоих потоков)
+        self._state_lock = threading.Lock()
+        self._free_ids = list(range(max_concurrent))
+        self._kv_used = 0
+        self._slot_freed = threading.Event()
+        # Взводится после каждого шага декодирования
+        self._decode_done = threading.Event()
+        
+        self._pending: "queue.Queue[Optional[_Sequence]]" = queue.Queue()
+        # Ожидающие запросы по корзинам длины промпта, в порядке поступления
+        self._waiting: List[deque] = [deque() for _ in range(len(_LENGTH_BUCKETS) + 1)]
+        self._arrivals = 0
+        # Последовательности после префилла: очередь передачи и кольцо декодирования
+        self._ready: "queue.Queue[Optional[_Sequence]]" = queue.Queue()
+        self._decoding: List[_Sequence] = []
+        
+        self._closed = False
+        self._prefill_thread = threading.Thread(target=self._prefill_loop, name="llama-prefill", daemon=True)
+        self._decode_thread = threading.Thread(target=self._decode_loop, name="llama-decode", daemon=True)
+        self._prefill_thread.start()
+        self._decode_thread.start()
+        
+        logger.info(f"Непрерывное пакетирование: до {max_concurrent} последовательностей, "
+                    f"n_ctx={n_ctx}, n_batch={self.n_batch}")
+    
+    def _resolve_seq_rm(self):
+        """Находит функцию очистки KV последовательности в установленной версии llama.cpp."""
+        ctx = self._ctx
+        if hasattr(llama_cpp, "llama_memory_seq_rm"):
+            memory = llama_cpp.llama_get_memory(ctx)
+            return lambda seq_id: llama_cpp.llama_memory_seq_rm(memory, seq_id, -1, -1)
+        if hasattr(llama_cpp, "llama_kv_self_seq_rm"):
+            return lambda seq_id: llama_cpp.llama_kv_self_seq_rm(ctx, seq_id, -1, -1)
+        return lambda seq_id: llama_cpp.llama_kv_cache_seq_rm(ctx, seq_id, -1, -1)
+    
+    def submit(self, prompt: List[int], params: Dict[str, Any],
+               stream: Optional[queue.Queue] = None) -> Future:
+        """
+        Ставит запрос в очередь.
+        
+        Args:
+            prompt: Токены промпта
+            params: Параметры генерации (max_tokens, temperature, top_p, top_k,
+                repeat_penalty, stop, seed)
+            stream: Очередь для частей ответа в формате потоковых чанков create_completion
+        
+        Returns:
+            Future: Результат в формате ответа create_completion
+        """
+        future = Future()
+        if self._closed:
+            future.set_exception(RuntimeError("Планировщик остановлен"))
+            return future
+        if len(prompt) + params["max_tokens"] > self.n_ctx:
+            future.set_exception(ValueError(
+                f"Запрос требует {len(prompt) + params['max_tokens']} позиций KV при n_ctx={self.n_ctx}"))
+            return future
+        self._pending.put(_Sequence(prompt, params, future, stream))
+        return future
+    
+    def stream(self, prompt: List[int], params: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Генерирует ответ потоково.
+        
+        Args:
+            prompt: Токены промпта
+            params: Параметры генерации (см. submit)
+        
+        Yields:
+            Dict[str, Any]: Чанки в формате потоковой create_completion
+        """
+        chunks: queue.Queue = queue.Queue()
+        future = self.submit(prompt, params, chunks)
+        if future.done():
+            # Запрос отклонен при постановке в очередь
+            future.result()
+        while True:
+            chunk = chunks.get()
+            if chunk is _STREAM_END:
+                break
+            yield chunk
+        future.result()
+    
+    def _enqueue(self, sequence: _Sequence) -> None:
+        """Кладет запрос в корзину его длины."""
+        self._arrivals += 1
+        sequence.arrival = self._arrivals
+        self._waiting[sequence.bucket].append(sequence)
+    
+    def _has_waiting(self) -> bool:
+        return any(self._waiting)
+    
+    def _admit(self) -> List[_Sequence]:
+        """
+        Принимает ожидающие запросы, пока есть свободные слоты и место в KV-кэше.
+        
+        Запросы берутся из одной корзины длины - той, где дольше всех ждет
+        первый запрос, - так что промпты одного префилла близки по длине.
+        
+        Returns:
+            List[_Sequence]: Принятые последовательности
+        """
+        while True:
+            try:
+                sequence = self._pending.get_nowait()
+            except queue.Empty:
+                break
+            if sequence is not None:
+                self._enqueue(sequence)
+        
+        if not self._has_waiting():
+            return []
+        bucket = min((b for b in self._waiting if b), key=lambda b: b[0].arrival)
+        
+        admitted = []
+        with self._state_lock:
+            while bucket and self._free_ids:
+                sequence = bucket[0]
+                if self._kv_used + sequence.kv_budget > self.n_ctx:
+                    break
+                bucket.popleft()
+                sequence.seq_id = self._free_ids.pop()
+                self._kv_used += sequence.kv_budget
+                admitted.append(sequence)
+            if not admitted:
+                self._slot_freed.clear()
+        return admitted
+    
+    @staticmethod
+    def _add_token(batch, n: int, token: int, pos: int, seq_id: int, logits: bool) -> None:
+        """Записывает токен в позицию n пакета llama_batch."""
+        batch.token[n] = token
+        batch.pos[n] = pos
+        batch.n_seq_id[n] = 1
+        batch.seq_id[n][0] = seq_id
+        batch.logits[n] = logits
+    
+    def _decode(self, batch, rows: List[int]) -> List[np.ndarray]:
+        """
+        Выполняет llama_decode и копирует логиты запрошенных позиций.
+        
+        Args:
+            batch: Заполненный llama_batch
+            rows: Позиции пакета, для которых нужны логиты
+        
+        Returns:
+            List[np.ndarray]: Логиты для каждой позиции rows
+        """
+        with self._ctx_lock:
+            status = llama_cpp.llama_decode(self._ctx, batch)
+            if status != 0:
+                raise RuntimeError(f"llama_decode вернул {status}")
+            # Следующий llama_decode перезапишет логиты, поэтому копируем под блокировкой
+            return [
+                np.ctypeslib.as_array(llama_cpp.llama_get_logits_ith(self._ctx, row),
+                                      shape=(self._n_vocab,)).copy()
+                for row in rows
+            ]
+    
+    def _prefill(self, group: List[_Sequence]) -> None:
+        """
+        Прогоняет промпты принятых последовательностей и выбирает их первые токены.
+        
+        Промпты идут кусками по n_batch токенов; после каждого куска, если
+        есть идущие генерации, поток ждет их очередной шаг.
+        """
+        batch = self._prefill_batch
+        while True:
+            n = 0
+            sampled = []
+            for sequence in group:
+                if sequence.prefilled or n >= self.n_batch:
+                    continue
+                end = min(len(sequence.prompt), sequence.n_past + self.n_batch - n)
+                for pos in range(sequence.n_past, end):
+                    last = pos == len(sequence.prompt) - 1
+                    if last:
+                        sampled.append((n, sequence))
+                    self._add_token(batch, n, sequence.prompt[pos], pos, sequence.seq_id, last)
+                    n += 1
+                sequence.n_past = end
+            if n == 0:
+                return
+            batch.n_tokens = n
+            
+            self._decode_done.clear()
+            logits = self._decode(batch, [row for row, _ in sampled])
+            for row_logits, (_, sequence) in zip(logits, sampled):
+                token = _sample(row_logits, sequence.params, sequence.prompt, sequence.rng)
+                self._advance(sequence, token)
+            
+            if self._decoding:
+                # Даем кольцу декодирования сделать шаг до следующего куска
+                self._decode_done.wait(timeout=1.0)
+    
+    def _step(self) -> None:
+        """Один шаг декодирования: по токену для каждой генерирующей последовательности."""
+        batch = self._decode_batch
+        for n, sequence in enumerate(self._decoding):
+            pos = len(sequence.prompt) + len(sequence.tokens) - 1
+            self._add_token(batch, n, sequence.tokens[-1], pos, sequence.seq_id, True)
+        batch.n_tokens = len(self._decoding)
+        
+        logits = self._decode(batch, list(range(len(self._decoding))))
+        for row_logits, sequence in zip(logits, list(self._decoding)):
+            token = _sample(row_logits, sequence.params, sequence.prompt + sequence.tokens, sequence.rng)
+            self._advance(sequence, token)
+            if sequence.finish_reason is not None:
+                self._decoding.remove(sequence)
+                self._finish(sequence)
+            else:
+                self._emit(sequence, final=False)
+    
+    def _emit(self, sequence: _Sequence, final: bool) -> None:
+        """Отдает в поток текст, который уже не может оказаться началом стоп-строки."""
+        if sequence.stream is None:
+            return
+        safe = len(sequence.text)
+        if not final:
+            longest_stop = max((len(stop) for stop in sequence.params["stop"]), default=0)
+            safe -= max(0, longest_stop - 1)
+        if safe > sequence.sent:
+            sequence.stream.put({"choices": [{"text": sequence.text[sequence.sent:safe],
+                                              "index": 0, "finish_reason": None}]})
+            sequence.sent = safe
+        if final:
+            sequence.stream.put({"choices": [{"text": "", "index": 0,
+                                              "finish_reason": sequence.finish_reason}]})
+    
+    def _advance(self, sequence: _Sequence, token: int) -> None:
+        """Добавляет выбранный токен и проверяет условия остановки."""
+        params = sequence.params
+        if token == self._eos:
+            sequence.finish_reason = "stop"
+            return
+        
+        sequence.tokens.append(token)
+        piece = self.llama.detokenize([token])
+        sequence.text += sequence.decoder.decode(piece)
+        
+        for stop in params["stop"]:
+            index = sequence.text.find(stop, max(0, len(sequence.text) - len(piece) - len(stop)))
+            if index != -1:
+                sequence.text = sequence.text[:index]
+                sequence.finish_reason = "stop"
+                return
+        
+        if len(sequence.tokens) >= params["max_tokens"]:
+            sequence.finish_reason = "length"
+    
+    def _finish(self, sequence: _Sequence, error: Optional[BaseException] = None) -> None:
+        """Освобождает слот последовательности и завершает ее Future."""
+        with self._ctx_lock:
+            self._seq_rm(sequence.seq_id)
+        with self._state_lock:
+            self._free_ids.append(sequence.seq_id)
+            self._kv_used -= sequence.kv_budget
+            self._slot_freed.set()
+        
+        if error is not None:
+            if sequence.stream is not None:
+                sequence.stream.put(_STREAM_END)
+            sequence.future.set_exception(error)
+            return
+        
+        self._emit(sequence, final=True)
+        if sequence.stream is not None:
+            sequence.stream.put(_STREAM_END)
+        prompt_tokens = len(sequence.prompt)
+        completion_tokens = len(sequence.tokens)
+        sequence.future.set_result({
+            "choices": [{"text": sequence.text, "index": 0, "finish_reason": sequence.finish_reason}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        })
+    
+    def _prefill_loop(self) -> None:
+        """Цикл потока префилла."""
+        while not self._closed:
+            if not self._has_waiting():
+                # Нет ожидающих запросов: ждем новый без активного опроса
+                sequence = self._pending.get()
+                if sequence is None:
+                    break
+                self._enqueue(sequence)
+            
+            group = self._admit()
+            if not group:
+                # Все слоты или KV-кэш заняты: ждем завершения генерации
+                self._slot_freed.wait(timeout=1.0)
+                continue
+            
+            try:
+                self._prefill(group)
+            except Exception as e:
+                logger.error(f"Ошибка префилла: {e}")
+                for sequence in group:
+                    self._finish(sequence, e)
+                continue
+            
+            for sequence in group:
+                if sequence.finish_reason is not None:
+                    self._finish(sequence)
+                else:
+                    self._emit(sequence, final=False)
+                    self._ready.put(sequence)
+        
+        self._fail_pending([sequence for bucket in self._waiting for sequence in bucket])
+    
+    def _decode_loop(self) -> None:
+        """Цикл потока декодирования."""
+        while not self._closed:
+            if not self._decoding:
+                # Кольцо пусто: ждем последовательность после префилла
+                sequence = self._ready.get()
+                if sequence is None:
+                    break
+                self._decoding.append(sequence)
+            while True:
+                try:
+                    sequence = self._ready.get_nowait()
+                except queue.Empty:
+                    break
+                if sequence is not None:
+                    self._decoding.append(sequence)
+            
+            try:
+                self._step()
+            except Exception as e:
+                logger.error(f"Ошибка шага пакетной генерации: {e}")
+                for sequence in self._decoding:
+                    self._finish(sequence, e)
+                self._decoding.clear()
+            finally:
+                self._decode_done.set()
+        
+        while not self._ready.empty():
+            sequence = self._ready.get_nowait()
+            if sequence is not None:
+                self._decoding.append(sequence)
+        self._fail_pending(self._decoding)
+    
+    @staticmethod
+    def _fail_pending(sequences: List[_Sequence]) -> None:
+        """Завершает незаконченные запросы ошибкой остановки планировщика."""
+        error = RuntimeError("Планировщик остановлен")
+        for sequence in sequences:
+            if not sequence.future.done():
+                sequence.future.set_exception(error)
+                if sequence.stream is not None:
+                    sequence.stream.put(_STREAM_END)
+    
+    def close(self) -> None:
+        """Останавливает фоновые потоки и освобождает контекст."""
+        if self._closed:
+            return
+        self._closed = True
+        self._pending.put(None)
+        self._ready.put(None)
+        self._slot_freed.set()
+        self._prefill_thread.join()
+        self._decode_thread.join()
+        llama_cpp.llama_batch_free(self._prefill_batch)
+        llama_cpp.llama_batch_free(self._decode_batch)
+        llama_cpp.llama_free(self._ctx)
+
+
+class EmbeddingContextPool:
+    """
+    Пул контекстов llama.cpp для расчета эмбеддингов.
+    
+    Контексты разделяют веса модели (отображены в память один раз), у
+    каждого свой небольшой KV-кэш, поэтому вызовы из разных потоков идут
+    параллельно, а не по очереди под блокировкой модели. Внутри вызова
+    тексты упаковываются в пакеты по n_ctx токенов, каждый текст - отдельная
+    последовательность пакета.
+    """
+    
+    def __init__(self, llama: "llama_cpp.Llama", n_contexts: int = 2,
+                 n_ctx: int = 2048, n_seq_max: int = 64):
+        """
+        Создает контексты пула.
+        
+        Args:
+            llama: Загруженная модель llama-cpp-python
+            n_contexts: Число контекстов (одновременных вызовов)
+            n_ctx: Размер контекста (и пакета) в токенах; более длинные тексты обрезаются
+            n_seq_max: Максимальное число текстов в одном пакете
+        """
+        self.n_ctx = n_ctx
+        self.n_seq_max = n_seq_max
+        self.n_embd = llama.n_embd()
+        self._contexts: "queue.Queue[Tuple[Any, Any]]" = queue.Queue()
+        self._all = []
+        
+        params = _context_params(llama, n_ctx, n_ctx, n_seq_max)
+        # Для моделей без некаузального внимания весь текст должен попасть в один микропакет
+        params.n_ubatch = n_ctx
+        for name in ("embeddings", "embedding"):
+            if hasattr(params, name):
+                setattr(params, name, True)
+        
+        for _ in range(n_contexts):
+            ctx = _new_context(llama, params)
+            if llama_cpp.llama_pooling_type(ctx) == llama_cpp.LLAMA_POOLING_TYPE_NONE:
+                # Генеративные модели не задают пулинг: усредняем токены в llama.cpp
+                llama_cpp.llama_free(ctx)
+                params.pooling_type = llama_cpp.LLAMA_POOLING_TYPE_MEAN
+                ctx = _new_context(llama, params)
+            batch = llama_cpp.llama_batch_init(n_ctx, 0, 1)
+            self._all.append((ctx, batch))
+            self._contexts.put((ctx, batch))
+        
+        logger.info(f"Пул эмбеддингов: {n_contexts} контекстов по {n_ctx} токенов")
+    
+    def embed(self, token_lists: List[List[int]]) -> np.ndarray:
+        """
+        Считает эмбеддинги токенизированных текстов.
+        
+        Args:
+            token_lists: Токены каждого текста
+        
+        Returns:
+            np.ndarray: Матрица float32 формы (len(token_lists), n_embd)
+        """
+        out = np.empty((len(token_lists), self.n_embd), dtype=np.float32)
+        ctx, batch = self._contexts.get()
+        try:
+            start = 0
+            while start < len(token_lists):
+                # Набираем тексты, пока они помещаются в контекст
+                end, n_tokens = start, 0
+                while (end < len(token_lists) and end - start < self.n_seq_max
+                       and n_tokens + min(len(token_lists[end]), self.n_ctx) <= self.n_ctx):
+                    n_tokens += min(len(token_lists[end]), self.n_ctx)
+                    end += 1
+                self._embed_batch(ctx, batch, token_lists[start:end], out[start:end])
+                start = end
+        finally:
+            self._contexts.put((ctx, batch))
+        return out
+    
+    def _embed_batch(self, ctx, batch, token_lists: List[List[int]], out: np.ndarray) -> None:
+        """Прогоняет один пакет текстов и пишет их эмбеддинги в строки out."""
+        _memory_clear(ctx)
+        n = 0
+        for seq_id, tokens in enumerate(token_lists):
+            for pos, token in enumerate(tokens[:self.n_ctx]):
+                batch.token[n] = token
+                batch.pos[n] = pos
+                batch.n_seq_id[n] = 1
+                batch.seq_id[n][0] = seq_id
+                batch.logits[n] = True
+                n += 1
+        batch.n_tokens = n
+        
+        status = llama_cpp.llama_decode(ctx, batch)
+        if status != 0:
+            raise RuntimeError(f"llama_decode вернул {status}")
+        for seq_id in range(len(token_lists)):
+            pointer = llama_cpp.llama_get_embeddings_seq(ctx, seq_id)
+            if pointer:
+                out[seq_id] = np.ctypeslib.as_array(pointer, shape=(self.n_embd,))
+            else:
+                out[seq_id] = 0.0  # пустой текст
+    
+    def close(self) -> None:
+        """Освобождает контексты пула."""
+        for ctx, batch in self._all:
+            llama_cpp.llama_batch_free(batch)
+            llama_cpp.llama_free(ctx)
+        self._all = []
@@ -19,15 +19,28 @@ import json
 import logging
 import time
 import asyncio
-from typing import Dict, List, Any, Optional, Union, Callable, Generator, AsyncGenerator
+import math
+import random
+import functools
+import types
+from typing import Dict, List, Any, Mapping, Optional, Tuple, Union, Callable, Generator, AsyncGenerator, Iterator
 import threading
+import numpy as np
+
+try:
+    import tiktoken
+    HAS_TIKTOKEN = True
+except ImportError:
+    HAS_TIKTOKEN = False
 
 # Add parent directory в sys.path для импорта
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Изменяем импорт с более конкретным указанием пути
-from ..bridge.proxy import ExternalLLMProxy
+from ..bridge.proxy import ExternalLLMProxy, AsyncExternalLLMProxy
 from .llm_interface import LLMInterface, LLMResponse
+from .embedding_cache import EmbeddingCache
+from .semantic_cache import SemanticResponseCache
 
 # Configure logging
 logging.basicConfig(
@@ -37,6 +50,89 @@ logging.basicConfig(
 
 logger = logging.getLogger("ExternalLLM")
 
+# Общий пустой словарь для отсутствующих полей ответа: `.get("choices", [{}])`
+# создавал новые список и словарь на каждый потоковый фрагмент
+_EMPTY: Dict[str, Any] = {}
+
+# encode_batch создает новый пул потоков на каждый вызов, поэтому малые
+# пакеты дешевле кодировать по одному; размер пула ограничен
+_ENCODE_BATCH_MIN_TEXTS = 32
+_ENCODE_BATCH_THREADS = min(8, os.cpu_count() or 1)
+
+
+# Фоновый event loop, общий для всех адаптеров: в нем живут aiohttp-сессии
+# и общий пул соединений, а синхронные методы ждут результат его корутин
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_LOOP_LOCK = threading.Lock()
+
+
+def _get_shared_loop() -> asyncio.AbstractEventLoop:
+    """Возвращает общий фоновый event loop, запуская его при первом обращении."""
+    global _LOOP
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_LOOP.run_forever, name="ExternalLLM-loop", daemon=True).start()
+        return _LOOP
+
+
+@functools.lru_cache(maxsize=64)
+def _frozen_parameters(items: tuple) -> types.MappingProxyType:
+    """
+    Возвращает общий read-only словарь параметров сэмплирования.
+    
+    Одинаковые наборы параметров повторяются от запроса к запросу, поэтому
+    ответы с одной конфигурацией делят один словарь в метаданных.
+    
+    Args:
+        items: Кортеж пар (имя, значение)
+        
+    Returns:
+        types.MappingProxyType: Неизменяемое представление параметров
+    """
+    return types.MappingProxyType(dict(items))
+
+
+@functools.lru_cache(maxsize=None)
+def _tiktoken_encoding(model: str):
+    """
+    Возвращает BPE-кодировку tiktoken для модели (одна на модель на процесс).
+    
+    Args:
+        model: Название модели
+        
+    Returns:
+        tiktoken.Encoding: Кодировка модели; для неизвестных tiktoken моделей
+        (llama, mistral, ...) - cl100k_base
+    """
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def _make_metadata(model: str, elapsed_time: float, finish_reason: str,
+                   tokens_used: int, parameters: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    Собирает метаданные законченного ответа.
+    
+    Все места, которые отдают законченный ответ, строят метаданные здесь,
+    поэтому набор ключей у них одинаковый.
+    """
+    return {
+        "model": model,
+        "elapsed_time": elapsed_time,
+        "finish_reason": finish_reason,
+        "tokens_used": tokens_used,
+        "parameters": parameters
+    }
+
+
+def _first_choice(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Возвращает choices[0] ответа OpenAI API (пустой словарь, если choices нет)."""
+    choices = payload.get("choices")
+    return choices[0] if choices else _EMPTY
+
 
 class ExternalLLMAdapter(LLMInterface):
     """
@@ -54,13 +150,37 @@ class ExternalLLMAdapter(LLMInterface):
             config: Конфигурация адаптера с параметрами:
                 - external_api.url: URL API сервера (например, "http://localhost:8000/v1")
                 - external_api.api_key: Ключ API для авторизации (если требуется)
-                - external_api.timeout: Таймаут запросов в секундах
+                - external_api.timeout: Общий таймаут запросов в секундах
+                - external_api.connect_timeout: Таймаут установки соединения (3 с)
+                - external_api.read_timeout: Таймаут ожидания данных ответа (по умолчанию timeout)
+                - external_api.write_timeout: Таймаут отправки запроса (10 с, только HTTP/2)
                 - external_api.verify_ssl: Проверять ли SSL сертификаты
                 - external_api.retry_attempts: Количество повторных попыток при сбоях
                 - external_api.retry_delay: Задержка между повторными попытками
                 - external_api.embedding_model: Модель для генерации эмбеддингов
+                - external_api.embedding_batch_size: Текстов в одном запросе эмбеддингов
+                - external_api.embedding_batch_tokens: Предел суммы токенов в одном запросе
+                  эмбеддингов (по умолчанию None - пачки только по числу текстов)
+                - external_api.embedding_cache_path: Файл SQLite кэша эмбеддингов по содержимому
+                  текста (по умолчанию None - без кэша; ":memory:" - только в памяти)
+                - external_api.embedding_cache_ttl: Время жизни записей кэша эмбеддингов в секундах
+                - external_api.embedding_dtype: Тип элементов матрицы эмбеддингов и кэша:
+                  "float32" (по умолчанию) или "float16" - вдвое меньше памяти и трафика
+                - external_api.max_connections: Размер пулов keep-alive соединений прокси
+                - external_api.http2: Отправлять непотоковые запросы по HTTP/2 (нужны httpx и h2)
                 - external_api.max_context_length: Максимальная длина контекста
+                - external_api.health_check_ttl: Сколько секунд результат проверки соединения
+                  считается актуальным (30); сбой запроса сбрасывает его досрочно
+                - external_api.eager_health_check: Проверить соединение уже в конструкторе
+                  (по умолчанию False - при первом запросе)
+                - external_api.models_cache_ttl: Время жизни кэша списка моделей в секундах
+                  (по умолчанию None - кэш сбрасывается только по ошибке model_not_found)
                 - default_model: Модель по умолчанию для текстовой генерации
+                - semantic_cache.enabled: Возвращать сохраненный ответ на семантически
+                  близкий запрос (generate/chat без stream; по умолчанию выключено)
+                - semantic_cache.threshold: Минимальная косинусная близость запросов (0.92)
+                - semantic_cache.max_entries: Число сохраняемых ответов (1024, LRU)
+                - semantic_cache.ttl_seconds: Время жизни сохраненного ответа в секундах
         """
         super().__init__(config or {})
         
@@ -68,6 +188,11 @@ class ExternalLLMAdapter(LLMInterface):
         api_url = api_config.get("url", "http://localhost:8000/v1")
         api_key = api_config.get("api_key", None)
         timeout = api_config.get("timeout", 60)
+        # Этапы ограничены раздельно: зависшее подключение обрывается за секунды,
+        # а на чтение (декодирование на сервере) остается полный бюджет
+        connect_timeout = api_config.get("connect_timeout", 3)
+        read_timeout = api_config.get("read_timeout", timeout)
+        write_timeout = api_config.get("write_timeout", 10)
         retry_attempts = api_config.get("retry_attempts", 3)
         retry_delay = api_config.get("retry_delay", 0.5)
         verify_ssl = api_config.get("verify_ssl", True)
@@ -79,16 +204,78 @@ class ExternalLLMAdapter(LLMInterface):
             timeout=timeout,
             connection_retries=retry_attempts,
             connection_retry_delay=retry_delay,
-            verify_ssl=verify_ssl
+            verify_ssl=verify_ssl,
+            pool_size=api_config.get("max_connections", 32),
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout
         )
-        self.connected = False
+        # Асинхронный прокси; его корутины выполняются в общем фоновом event
+        # loop, а пул keep-alive соединений общий для всех адаптеров
+        self.async_proxy = AsyncExternalLLMProxy(
+            api_url=api_url,
+            api_key=api_key,
+            timeout=timeout,
+            verify_ssl=verify_ssl,
+            connection_limit=api_config.get("max_connections", 32),
+            shared_pool=True,
+            connection_retries=retry_attempts,
+            connection_retry_delay=retry_delay,
+            http2=api_config.get("http2", False),
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            write_timeout=write_timeout
+        )
+        # None - соединение еще не проверялось; проверка выполняется лениво при
+        # первом запросе, а не в конструкторе
+        self.connected = None
         self.lock = threading.RLock()
+        # Событие текущей проверки соединения: параллельные вызовы ждут его,
+        # а не отправляют собственные health-check запросы
+        self._connection_probe = None
+        # Время последней проверки соединения; ее результат (в том числе
+        # неудачный) переиспользуется health_check_ttl секунд
+        self._health_ts = 0.0
+        self._health_ttl = api_config.get("health_check_ttl", 30)
         self.embedding_model = api_config.get("embedding_model", "text-embedding-ada-002")
+        self.embedding_batch_size = max(1, api_config.get("embedding_batch_size", 64))
+        self.embedding_batch_tokens = api_config.get("embedding_batch_tokens")
+        self.max_context_length = api_config.get("max_context_length", 4096)
+        # Размерность эмбеддингов; уточняется по первому ответу API
+        self._embedding_dim = 768
+        # float16 вдвое сокращает память и кэш; для косинусной близости точности
+        # хватает (bfloat16 numpy не поддерживает)
+        self._embedding_dtype = np.dtype(api_config.get("embedding_dtype", "float32"))
+        if self._embedding_dtype not in (np.float32, np.float16):
+            logger.warning(f"Неподдерживаемый embedding_dtype {self._embedding_dtype}, используется float32")
+            self._embedding_dtype = np.dtype(np.float32)
+        # Повторные тексты берутся из кэша без запроса к API
+        cache_path = api_config.get("embedding_cache_path")
+        self._embedding_cache = EmbeddingCache(
+            cache_path, ttl_seconds=api_config.get("embedding_cache_ttl"), dtype=self._embedding_dtype
+        ) if cache_path else None
+        # Кэш ответов по близости эмбеддингов запросов (opt-in: каждый промах
+        # стоит дополнительного запроса эмбеддинга)
+        semantic_config = self.config.get("semantic_cache", {})
+        self._semantic_cache = SemanticResponseCache(
+            threshold=semantic_config.get("threshold", 0.92),
+            max_entries=semantic_config.get("max_entries", 1024),
+            ttl_seconds=semantic_config.get("ttl_seconds")
+        ) if semantic_config.get("enabled") else None
         self._cached_models = None
         self._models_last_update = 0
+        # Кэш моделей сбрасывается, когда бэкенд отвечает model_not_found.
+        # Если задан TTL, кэш обновляется вероятностно заранее (XFetch): чем ближе
+        # истечение TTL и чем дольше обновление, тем вероятнее, что один из
+        # вызывающих обновит кэш в фоне, пока остальные читают старый
+        self._models_cache_ttl = api_config.get("models_cache_ttl")
+        self._models_refresh_beta = 1.0
+        self._models_refresh_duration = 0.0
+        self._models_refreshing = False
+        # BPE-кодировщик tiktoken создается при первом подсчете токенов
+        self._encoding = None
         
-        # Check соединение
-        self._check_connection()
+        if api_config.get("eager_health_check", False):
+            self._check_connection()
         
         logger.info(f"Адаптер ExternalLLM инициализирован с API {api_url}")
     
@@ -96,34 +283,124 @@ class ExternalLLMAdapter(LLMInterface):
         """
         Проверяет соединение с внешним API.
         
+        Одновременно выполняется не более одной проверки: потоки, пришедшие во
+        время проверки, дожидаются ее результата. Результат последней проверки
+        действителен health_check_ttl секунд, так что при недоступном API
+        запросы сразу получают ошибку, не дожидаясь health-check на каждый вызов.
+        Кэш моделей здесь не заполняется - это делает первый вызов
+        get_available_models.
+        
         Returns:
             bool: True, если соединение установлено, иначе False
         """
+        if self.connected is not None and time.monotonic() - self._health_ts < self._health_ttl:
+            return bool(self.connected)
+        
+        with self.lock:
+            probe = self._connection_probe
+            if probe is None:
+                probe = self._connection_probe = threading.Event()
+                owner = True
+            else:
+                owner = False
+        
+        if not owner:
+            probe.wait()
+            return bool(self.connected)
+        
         try:
             self.connected = self.proxy.health_check()
             if self.connected:
                 logger.info("Соединение с внешним API установлено")
-                # Кэшируем список моделей
-                self._update_models_cache()
             else:
                 logger.warning("Не удалось установить соединение с внешним API")
-            return self.connected
         except Exception as e:
             logger.error(f"Ошибка при проверке соединения: {str(e)}")
             self.connected = False
-            return False
+        finally:
+            self._health_ts = time.monotonic()
+            with self.lock:
+                self._connection_probe = None
+            probe.set()
+        return self.connected
+    
+    async def _acheck_connection(self) -> bool:
+        """
+        Проверяет соединение с внешним API, не блокируя event loop вызывающего.
+        
+        Health-check через requests (или ожидание чужой проверки) выполняется в
+        пуле потоков; пока результат прошлой проверки действителен, пул не нужен.
+        
+        Returns:
+            bool: True, если соединение установлено, иначе False
+        """
+        if self.connected is not None and time.monotonic() - self._health_ts < self._health_ttl:
+            return bool(self.connected)
+        return await asyncio.get_running_loop().run_in_executor(None, self._check_connection)
+    
+    def _mark_request_failed(self) -> None:
+        """
+        Отмечает сбой запроса: следующий вызов заново проверит соединение.
+        """
+        self.connected = False
+        self._health_ts = 0.0
     
     def _update_models_cache(self) -> None:
         """
         Обновляет кэш доступных моделей.
         """
         try:
+            start_time = time.time()
             self._cached_models = self.proxy.get_models()
             self._models_last_update = time.time()
+            self._models_refresh_duration = self._models_last_update - start_time
             logger.debug(f"Кэш моделей обновлен. Доступно {len(self._cached_models)} моделей.")
         except Exception as e:
             logger.warning(f"Не удалось обновить кэш моделей: {e}")
     
+    def _refresh_models_in_background(self) -> None:
+        """
+        Обновляет кэш моделей в фоновом потоке (не более одного обновления за раз).
+        """
+        with self.lock:
+            if self._models_refreshing:
+                return
+            self._models_refreshing = True
+        
+        def refresh():
+            try:
+                self._update_models_cache()
+            finally:
+                self._models_refreshing = False
+        
+        threading.Thread(target=refresh, name="ExternalLLM-models", daemon=True).start()
+    
+    def _run_sync(self, coro) -> Any:
+        """Выполняет корутину в общем фоновом loop и блокирующе ждет результата."""
+        return asyncio.run_coroutine_threadsafe(coro, _get_shared_loop()).result()
+    
+    async def _run_async(self, coro) -> Any:
+        """Выполняет корутину в общем фоновом loop и ждет результата из loop вызывающего."""
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, _get_shared_loop()))
+    
+    def invalidate_models_cache(self) -> None:
+        """
+        Сбрасывает кэш моделей; следующий get_available_models запросит список заново.
+        """
+        with self.lock:
+            self._cached_models = None
+    
+    def _check_model_not_found(self, result: Dict[str, Any]) -> None:
+        """
+        Сбрасывает кэш моделей, если ответ с ошибкой говорит об отсутствии модели.
+        
+        Args:
+            result: Ответ API или фрагмент потока с ключом "error"
+        """
+        if result.get("status_code") == 404 or "model_not_found" in str(result.get("error", "")):
+            logger.info("Модель не найдена на сервере, кэш моделей сброшен")
+            self.invalidate_models_cache()
+    
     def get_available_models(self) -> List[Dict[str, Any]]:
         """
         Возвращает список доступных моделей.
@@ -131,12 +408,35 @@ class ExternalLLMAdapter(LLMInterface):
         Returns:
             List[Dict[str, Any]]: Список доступных моделей
         """
+        # Быстрый путь без блокировки: список и время обновления читаются в
+        # локальные переменные (присваивание атрибута в CPython атомарно)
+        models = self._cached_models
+        if models is not None:
+            if self._models_cache_ttl is None:
+                return models
+            expires_at = self._models_last_update + self._models_cache_ttl
+            now = time.time()
+            if now < expires_at:
+                # XFetch: now - delta * beta * log(rand) >= expiry; log(rand) <= 0,
+                # поэтому вероятность раннего обновления растет к концу TTL
+                early = now - (self._models_refresh_duration * self._models_refresh_beta
+                               * math.log(1.0 - random.random()))
+                if early >= expires_at:
+                    self._refresh_models_in_background()
+                return models
+        
+        # Медленный путь: кэш пуст или истек; проверяем заново под блокировкой,
+        # чтобы обновление выполнил только один из конкурирующих потоков
         with self.lock:
-            # Update кэш моделей, если он старше 5 минут или пуст
-            if self._cached_models is None or time.time() - self._models_last_update > 300:
+            models = self._cached_models
+            expired = (models is not None and self._models_cache_ttl is not None
+                       and time.time() >= self._models_last_update + self._models_cache_ttl)
+            if models is None or (expired and not self._models_refreshing):
                 self._update_models_cache()
+                models = self._cached_models
             
-            return self._cached_models or []
+            # Пока другой поток обновляет истекший кэш, отдаем старый список
+            return models or []
     
     def generate(self, prompt: str, **kwargs) -> Union[LLMResponse, Generator[LLMResponse, None, None]]:
         """
@@ -153,6 +453,7 @@ class ExternalLLMAdapter(LLMInterface):
                 - repeat_penalty: Штраф за повторение
                 - stream: Потоковая генерация (режим генератора)
                 - stop: Список строк для остановки генерации
+                - coalesce_ms: Интервал (мс) объединения фрагментов потока, 0 - без объединения
             
         Returns:
             LLMResponse: Объект с ответом и метаданными.
@@ -172,16 +473,29 @@ class ExternalLLMAdapter(LLMInterface):
         repeat_penalty = kwargs.get("repeat_penalty", 1.1)
         stream = kwargs.get("stream", False)
         stop = kwargs.get("stop", None)
+        coalesce_ms = kwargs.get("coalesce_ms", 25)
         
         start_time = time.time()
         
         try:
             # Потоковая генерация
             if stream:
-                return self._stream_generate(prompt, model, max_tokens, temperature, top_p, top_k, repeat_penalty, stop)
+                return self._stream_generate(prompt, model, max_tokens, temperature, top_p, top_k, repeat_penalty, stop,
+                                             coalesce_ms)
+            
+            parameters = _frozen_parameters((
+                ("max_tokens", max_tokens),
+                ("temperature", temperature),
+                ("top_p", top_p),
+                ("top_k", top_k),
+                ("repeat_penalty", repeat_penalty)
+            ))
+            cached, query_embedding, context = self._semantic_lookup(prompt, model, parameters, stop, start_time)
+            if cached is not None:
+                return cached
             
-            # Обычная генерация
-            result = self.proxy.generate_completion(
+            # Обычная генерация через общий пул соединений фонового loop
+            result = self._run_sync(self.async_proxy.generate_completion(
                 prompt=prompt,
                 model=model,
                 max_tokens=max_tokens,
@@ -190,59 +504,231 @@ class ExternalLLMAdapter(LLMInterface):
                 top_k=top_k,
                 repeat_penalty=repeat_penalty,
                 stop=stop
-            )
-            
-            # Проверка на ошибки
-            if "error" in result:
-                return LLMResponse(
-                    text=f"Произошла ошибка при обработке запроса: {result['error']}",
-                    metadata={
-                        "error": result["error"],
-                        "elapsed_time": time.time() - start_time
-                    }
-                )
-            
-            # Извлекаем текст из ответа
-            text = result.get("choices", [{}])[0].get("text", "")
-            
-            # Получаем информацию о причине завершения
-            finish_reason = result.get("choices", [{}])[0].get("finish_reason", "unknown")
-            
-            # Получаем информацию об использовании токенов
-            usage = result.get("usage", {})
-            prompt_tokens = usage.get("prompt_tokens", self.count_tokens(prompt))
-            completion_tokens = usage.get("completion_tokens", self.count_tokens(text))
-            total_tokens = usage.get("total_tokens", prompt_tokens + completion_tokens)
-            
-            # Create ответ
-            response = LLMResponse(
-                text=text,
-                metadata={
-                    "model": model,
-                    "elapsed_time": time.time() - start_time,
-                    "finish_reason": finish_reason,
-                    "tokens_used": total_tokens,
-                    "parameters": {
-                        "max_tokens": max_tokens,
-                        "temperature": temperature,
-                        "top_p": top_p,
-                        "top_k": top_k,
-                        "repeat_penalty": repeat_penalty
-                    }
-                }
-            )
+            ))
             
+            response = self._completion_response(result, prompt, model, parameters, start_time)
+            self._semantic_store(query_embedding, response, context)
             return response
             
         except Exception as e:
             logger.error(f"Ошибка при генерации: {str(e)}")
+            self._mark_request_failed()
             return LLMResponse(
                 text=f"Произошла ошибка при обработке запроса: {str(e)}",
                 metadata={"error": str(e), "elapsed_time": time.time() - start_time}
             )
     
+    async def agenerate(self, prompt: str, **kwargs) -> LLMResponse:
+        """
+        Асинхронно генерирует ответ на основе промпта.
+        
+        Запросы идут через общий пул соединений, поэтому несколько вызовов,
+        объединенных через asyncio.gather, выполняются параллельно.
+        Потоковая генерация не поддерживается (используйте generate(stream=True)).
+        
+        Args:
+            prompt: Текстовый промпт для генерации.
+            **kwargs: Параметры генерации, как в generate
+            
+        Returns:
+            LLMResponse: Объект с ответом и метаданными.
+        """
+        if not self.connected and not await self._acheck_connection():
+            return LLMResponse(
+                text="Ошибка: нет соединения с API",
+                metadata={"error": "connection_error"}
+            )
+        
+        model = kwargs.get("model", self.default_model)
+        parameters = _frozen_parameters((
+            ("max_tokens", kwargs.get("max_tokens", 256)),
+            ("temperature", kwargs.get("temperature", 0.7)),
+            ("top_p", kwargs.get("top_p", 0.95)),
+            ("top_k", kwargs.get("top_k", 40)),
+            ("repeat_penalty", kwargs.get("repeat_penalty", 1.1))
+        ))
+        
+        start_time = time.time()
+        
+        try:
+            result = await self._run_async(self.async_proxy.generate_completion(
+                prompt=prompt,
+                model=model,
+                stop=kwargs.get("stop", None),
+                **parameters
+            ))
+            return self._completion_response(result, prompt, model, parameters, start_time)
+            
+        except Exception as e:
+            logger.error(f"Ошибка при асинхронной генерации: {str(e)}")
+            self._mark_request_failed()
+            return LLMResponse(
+                text=f"Произошла ошибка при обработке запроса: {str(e)}",
+                metadata={"error": str(e), "elapsed_time": time.time() - start_time}
+            )
+    
+    def _semantic_lookup(self, query: str, model: str, parameters: Mapping[str, Any],
+                         stop: Optional[List[str]],
+                         start_time: float) -> Tuple[Optional[LLMResponse], Optional[np.ndarray], str]:
+        """
+        Ищет в семантическом кэше ответ на близкий запрос.
+        
+        Args:
+            query: Текст запроса (промпт или диалог)
+            model: Название модели
+            parameters: Параметры сэмплирования; ответ переиспользуется только при тех же
+            stop: Стоп-строки запроса; ответ переиспользуется только при том же списке
+            start_time: Время начала запроса
+            
+        Returns:
+            Tuple: Ответ из кэша (или None), эмбеддинг запроса для _semantic_store
+            (None, если кэш выключен) и контекст записи
+        """
+        if self._semantic_cache is None:
+            return None, None, ""
+        
+        if isinstance(stop, str):
+            stop = [stop]
+        context = f"{model}|{sorted(parameters.items())}|{tuple(stop or ())}"
+        query_embedding = self.get_embeddings([query])[0]
+        hit = self._semantic_cache.get(query_embedding, context)
+        if hit is None:
+            return None, query_embedding, context
+        
+        cached, similarity = hit
+        logger.debug(f"Ответ из семантического кэша (близость {similarity:.3f})")
+        return LLMResponse(
+            text=cached.text,
+            metadata=dict(cached.metadata, cache="semantic_hit", similarity=similarity,
+                          elapsed_time=time.time() - start_time)
+        ), query_embedding, context
+    
+    def _semantic_store(self, query_embedding: Optional[np.ndarray], response: LLMResponse,
+                        context: str) -> None:
+        """Сохраняет успешный ответ в семантический кэш (если он включен)."""
+        if query_embedding is not None and "error" not in response.metadata:
+            self._semantic_cache.put(query_embedding, response, context)
+    
+    def generate_stream(self, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        Генерирует ответ потоком и отдает текст по мере декодирования.
+        
+        Первые токены доступны через время одного прохода модели, а не после
+        всего ответа, поэтому обработку можно начинать сразу.
+        
+        Args:
+            prompt: Текстовый промпт для генерации.
+            **kwargs: Параметры генерации, как в generate (stream игнорируется)
+            
+        Yields:
+            str: Фрагменты текста ответа
+        """
+        response = self.generate(prompt, **dict(kwargs, stream=True))
+        if isinstance(response, LLMResponse):
+            # Нет соединения - единственный ответ с ошибкой
+            yield response.text
+            return
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+    
+    def generate_batch(self, prompts: List[str], **kwargs) -> List[LLMResponse]:
+        """
+        Генерирует ответы на несколько промптов параллельно.
+        
+        Запросы отправляются одновременно через asyncio.gather, поэтому время
+        ограничено самым долгим запросом, а не суммой всех. Параллелизм
+        упирается в сервер: для Ollama его задают переменные окружения
+        OLLAMA_NUM_PARALLEL (одновременных запросов на модель) и
+        OLLAMA_MAX_LOADED_MODELS, для llama.cpp server - флаг --parallel.
+        
+        Args:
+            prompts: Список промптов
+            **kwargs: Параметры генерации, как в agenerate
+            
+        Returns:
+            List[LLMResponse]: Ответы в порядке промптов
+        """
+        return self._run_batch(lambda prompt: self.agenerate(prompt, **kwargs), prompts)
+    
+    def _run_batch(self, make_request: Callable[[Any], Any], items: List[Any]) -> List[LLMResponse]:
+        """
+        Выполняет асинхронные запросы для items одновременно в общем фоновом loop.
+        
+        Args:
+            make_request: Функция, возвращающая корутину запроса для элемента
+            items: Элементы пакета (промпты или диалоги)
+            
+        Returns:
+            List[LLMResponse]: Ответы в порядке элементов
+        """
+        # Проверка соединения блокирующая, поэтому выполняется до входа в loop
+        if not self.connected and not self._check_connection():
+            return [
+                LLMResponse(text="Ошибка: нет соединения с API", metadata={"error": "connection_error"})
+                for _ in items
+            ]
+        
+        async def gather():
+            return list(await asyncio.gather(*(make_request(item) for item in items)))
+        
+        return self._run_sync(gather())
+    
+    def _completion_response(self, result: Dict[str, Any], prompt: str, model: str,
+                             parameters: Mapping[str, Any], start_time: float) -> LLMResponse:
+        """
+        Преобразует ответ /completions в LLMResponse.
+        
+        Args:
+            result: Ответ API
+            prompt: Исходный промпт (для оценки токенов без usage)
+            model: Название модели
+            parameters: Параметры сэмплирования для метаданных
+            start_time: Время начала запроса
+            
+        Returns:
+            LLMResponse: Объект с ответом и метаданными
+        """
+        # Проверка на ошибки
+        if "error" in result:
+            self._check_model_not_found(result)
+            return LLMResponse(
+                text=f"Произошла ошибка при обработке запроса: {result['error']}",
+                metadata={
+                    "error": result["error"],
+                    "elapsed_time": time.time() - start_time
+                }
+            )
+        
+        # Извлекаем текст из ответа
+        choice = _first_choice(result)
+        text = choice.get("text") or ""
+        
+        # Получаем информацию о причине завершения
+        finish_reason = choice.get("finish_reason", "unknown")
+        
+        # Получаем информацию об использовании токенов
+        usage = result.get("usage") or _EMPTY
+        total_tokens = usage.get("total_tokens")
+        if total_tokens is None:
+            prompt_tokens = usage.get("prompt_tokens")
+            completion_tokens = usage.get("completion_tokens")
+            if prompt_tokens is None or completion_tokens is None:
+                # Промпт и ответ считаются одним пакетным вызовом токенизатора
+                prompt_count, completion_count = self.count_tokens_many([prompt, text])
+                prompt_tokens = prompt_count if prompt_tokens is None else prompt_tokens
+                completion_tokens = completion_count if completion_tokens is None else completion_tokens
+            total_tokens = prompt_tokens + completion_tokens
+        
+        # Create ответ
+        return LLMResponse(
+            text=text,
+            metadata=_make_metadata(model, time.time() - start_time, finish_reason, total_tokens, parameters)
+        )
+    
     def _stream_generate(self, prompt: str, model: str, max_tokens: int, temperature: float, 
-                        top_p: float, top_k: int, repeat_penalty: float, stop: List[str]) -> Generator[LLMResponse, None, None]:
+                        top_p: float, top_k: int, repeat_penalty: float, stop: List[str],
+                        coalesce_ms: int = 25) -> Generator[LLMResponse, None, None]:
         """
         Генератор для потоковой генерации ответов.
         
@@ -255,6 +741,8 @@ class ExternalLLMAdapter(LLMInterface):
             top_k: Параметр top-k sampling
             repeat_penalty: Штраф за повторение
             stop: Список стоп-строк
+            coalesce_ms: Фрагменты, пришедшие за этот интервал (мс), отдаются
+                одним LLMResponse; последний фрагмент отдается сразу
             
         Yields:
             LLMResponse: Последовательные фрагменты ответа
@@ -274,8 +762,18 @@ class ExternalLLMAdapter(LLMInterface):
                 stop=stop
             )
             
+            # Промежуточные фрагменты делят один словарь метаданных (только для
+            # чтения); время и причина завершения - только у последнего фрагмента
+            chunk_metadata = {"model": model, "chunk": True, "finish_reason": None}
+            
+            # Односимвольные дельты копятся в буфере и отдаются пачкой раз в coalesce_ms
+            buffer = []
+            coalesce_s = coalesce_ms / 1000.0
+            last_emit = time.monotonic()
+            
             for chunk in stream_generator:
                 if "error" in chunk:
+                    self._check_model_not_found(chunk)
                     yield LLMResponse(
                         text=f"Ошибка в потоковой генерации: {chunk['error']}",
                         metadata={
@@ -286,21 +784,33 @@ class ExternalLLMAdapter(LLMInterface):
                     return
                 
                 # Извлекаем текст и метаданные из чанка
-                chunk_text = chunk.get("choices", [{}])[0].get("text", "")
-                finish_reason = chunk.get("choices", [{}])[0].get("finish_reason", None)
-                
-                elapsed = time.time() - start_time
+                choice = _first_choice(chunk)
+                chunk_text = choice.get("text") or ""
+                finish_reason = choice.get("finish_reason")
+                if chunk_text:
+                    buffer.append(chunk_text)
                 
-                # Create и возвращаем ответ для каждого фрагмента
-                yield LLMResponse(
-                    text=chunk_text,
-                    metadata={
-                        "model": model,
-                        "elapsed_time": elapsed,
-                        "chunk": True,
-                        "finish_reason": finish_reason
-                    }
-                )
+                if finish_reason is None:
+                    now = time.monotonic()
+                    if buffer and now - last_emit >= coalesce_s:
+                        yield LLMResponse(text="".join(buffer), metadata=chunk_metadata)
+                        buffer.clear()
+                        last_emit = now
+                else:
+                    yield LLMResponse(
+                        text="".join(buffer),
+                        metadata={
+                            "model": model,
+                            "elapsed_time": time.time() - start_time,
+                            "chunk": True,
+                            "finish_reason": finish_reason
+                        }
+                    )
+                    buffer.clear()
+            
+            # Поток закрылся без finish_reason - отдаем остаток буфера
+            if buffer:
+                yield LLMResponse(text="".join(buffer), metadata=chunk_metadata)
                 
         except Exception as e:
             logger.error(f"Ошибка в потоковой генерации: {e}")
@@ -322,6 +832,7 @@ class ExternalLLMAdapter(LLMInterface):
                 - top_p: Параметр nucleus sampling (0.0-1.0)
                 - stream: Потоковая генерация (режим генератора)
                 - stop: Список строк для остановки генерации
+                - coalesce_ms: Интервал (мс) объединения фрагментов потока, 0 - без объединения
             
         Returns:
             LLMResponse: Объект с ответом и метаданными.
@@ -339,72 +850,169 @@ class ExternalLLMAdapter(LLMInterface):
         top_p = kwargs.get("top_p", 0.95)
         stream = kwargs.get("stream", False)
         stop = kwargs.get("stop", None)
+        coalesce_ms = kwargs.get("coalesce_ms", 25)
         
         start_time = time.time()
         
         try:
             # Потоковая генерация
             if stream:
-                return self._stream_chat(messages, model, max_tokens, temperature, top_p, stop)
+                return self._stream_chat(messages, model, max_tokens, temperature, top_p, stop, coalesce_ms)
+            
+            parameters = _frozen_parameters((
+                ("max_tokens", max_tokens),
+                ("temperature", temperature),
+                ("top_p", top_p)
+            ))
+            query = "\n".join(f"{message.get('role', '')}: {message.get('content', '')}" for message in messages)
+            cached, query_embedding, context = self._semantic_lookup(query, model, parameters, stop, start_time)
+            if cached is not None:
+                return cached
             
-            # Обычная генерация
-            result = self.proxy.generate_chat_completion(
+            # Обычная генерация через общий пул соединений фонового loop
+            result = self._run_sync(self.async_proxy.generate_chat_completion(
                 messages=messages,
                 model=model,
                 temperature=temperature,
                 max_tokens=max_tokens,
                 top_p=top_p,
-                stream=False,
                 stop=stop
-            )
-            
-            # Проверка на ошибки
-            if "error" in result:
-                return LLMResponse(
-                    text=f"Произошла ошибка при обработке запроса: {result['error']}",
-                    metadata={
-                        "error": result["error"],
-                        "elapsed_time": time.time() - start_time
-                    }
-                )
-            
-            # Извлекаем текст из ответа
-            text = result.get("choices", [{}])[0].get("message", {}).get("content", "")
-            
-            # Получаем информацию о причине завершения
-            finish_reason = result.get("choices", [{}])[0].get("finish_reason", "unknown")
-            
-            # Получаем информацию об использовании токенов
-            usage = result.get("usage", {})
-            total_tokens = usage.get("total_tokens", 0)
-            
-            # Create ответ
-            response = LLMResponse(
-                text=text,
-                metadata={
-                    "model": model,
-                    "elapsed_time": time.time() - start_time,
-                    "finish_reason": finish_reason,
-                    "tokens_used": total_tokens,
-                    "parameters": {
-                        "max_tokens": max_tokens,
-                        "temperature": temperature,
-                        "top_p": top_p
-                    }
-                }
-            )
+            ))
             
+            response = self._chat_response(result, model, parameters, start_time)
+            self._semantic_store(query_embedding, response, context)
             return response
             
         except Exception as e:
             logger.error(f"Ошибка в методе chat: {str(e)}")
+            self._mark_request_failed()
+            return LLMResponse(
+                text=f"Произошла ошибка при обработке запроса: {str(e)}",
+                metadata={"error": str(e), "elapsed_time": time.time() - start_time}
+            )
+    
+    async def achat(self, messages: List[Dict[str, str]], **kwargs) -> LLMResponse:
+        """
+        Асинхронно генерирует ответ на основе истории сообщений.
+        
+        Потоковая генерация не поддерживается (используйте chat(stream=True)).
+        
+        Args:
+            messages: Список сообщений в формате [{role: "user", content: "текст"}].
+            **kwargs: Параметры генерации, как в chat
+            
+        Returns:
+            LLMResponse: Объект с ответом и метаданными.
+        """
+        if not self.connected and not await self._acheck_connection():
+            return LLMResponse(
+                text="Ошибка: нет соединения с API",
+                metadata={"error": "connection_error"}
+            )
+        
+        model = kwargs.get("model", self.default_model)
+        parameters = _frozen_parameters((
+            ("max_tokens", kwargs.get("max_tokens", 256)),
+            ("temperature", kwargs.get("temperature", 0.7)),
+            ("top_p", kwargs.get("top_p", 0.95))
+        ))
+        
+        start_time = time.time()
+        
+        try:
+            result = await self._run_async(self.async_proxy.generate_chat_completion(
+                messages=messages,
+                model=model,
+                stop=kwargs.get("stop", None),
+                **parameters
+            ))
+            return self._chat_response(result, model, parameters, start_time)
+            
+        except Exception as e:
+            logger.error(f"Ошибка в методе achat: {str(e)}")
+            self._mark_request_failed()
             return LLMResponse(
                 text=f"Произошла ошибка при обработке запроса: {str(e)}",
                 metadata={"error": str(e), "elapsed_time": time.time() - start_time}
             )
     
+    def chat_stream(self, messages: List[Dict[str, str]], **kwargs) -> Iterator[str]:
+        """
+        Генерирует ответ чата потоком и отдает текст по мере декодирования (см. generate_stream).
+        
+        Args:
+            messages: Список сообщений в формате [{role: "user", content: "текст"}].
+            **kwargs: Параметры генерации, как в chat (stream игнорируется)
+            
+        Yields:
+            str: Фрагменты текста ответа
+        """
+        response = self.chat(messages, **dict(kwargs, stream=True))
+        if isinstance(response, LLMResponse):
+            yield response.text
+            return
+        for chunk in response:
+            if chunk.text:
+                yield chunk.text
+    
+    def chat_batch(self, conversations: List[List[Dict[str, str]]], **kwargs) -> List[LLMResponse]:
+        """
+        Генерирует ответы для нескольких диалогов параллельно (см. generate_batch).
+        
+        Args:
+            conversations: Список диалогов, каждый - список сообщений
+            **kwargs: Параметры генерации, как в achat
+            
+        Returns:
+            List[LLMResponse]: Ответы в порядке диалогов
+        """
+        return self._run_batch(lambda messages: self.achat(messages, **kwargs), conversations)
+    
+    def _chat_response(self, result: Dict[str, Any], model: str,
+                       parameters: Mapping[str, Any], start_time: float) -> LLMResponse:
+        """
+        Преобразует ответ /chat/completions в LLMResponse.
+        
+        Args:
+            result: Ответ API
+            model: Название модели
+            parameters: Параметры сэмплирования для метаданных
+            start_time: Время начала запроса
+            
+        Returns:
+            LLMResponse: Объект с ответом и метаданными
+        """
+        # Проверка на ошибки
+        if "error" in result:
+            self._check_model_not_found(result)
+            return LLMResponse(
+                text=f"Произошла ошибка при обработке запроса: {result['error']}",
+                metadata={
+                    "error": result["error"],
+                    "elapsed_time": time.time() - start_time
+                }
+            )
+        
+        # Извлекаем текст из ответа
+        choice = _first_choice(result)
+        text = choice.get("message", _EMPTY).get("content") or ""
+        
+        # Получаем информацию о причине завершения
+        finish_reason = choice.get("finish_reason", "unknown")
+        
+        # Получаем информацию об использовании токенов
+        usage = result.get("usage") or _EMPTY
+        total_tokens = usage.get("total_tokens", 0)
+        
+        # Create ответ
+        return LLMResponse(
+            text=text,
+            metadata=_make_metadata(model, time.time() - start_time, finish_reason, total_tokens, parameters)
+        )
+    
     def _stream_chat(self, messages: List[Dict[str, str]], model: str, max_tokens: int,
-                    temperature: float, top_p: float, stop: List[str]) -> Generator[LLMResponse, None, None]:
+                    temperature: float, top_p: float, stop: List[str],
+                    coalesce_ms: int = 25) -> Generator[LLMResponse, None, None]:
         """
         Генератор для потоковой генерации ответов чата.
         
@@ -415,6 +1023,8 @@ class ExternalLLMAdapter(LLMInterface):
             temperature: Температура сэмплирования
             top_p: Параметр nucleus sampling
             stop: Список стоп-строк
+            coalesce_ms: Фрагменты, пришедшие за этот интервал (мс), отдаются
+                одним LLMResponse; последний фрагмент отдается сразу
             
         Yields:
             LLMResponse: Последовательные фрагменты ответа
@@ -432,8 +1042,18 @@ class ExternalLLMAdapter(LLMInterface):
                 stop=stop
             )
             
+            # Промежуточные фрагменты делят один словарь метаданных (только для
+            # чтения); время и причина завершения - только у последнего фрагмента
+            chunk_metadata = {"model": model, "chunk": True, "finish_reason": None}
+            
+            # Односимвольные дельты копятся в буфере и отдаются пачкой раз в coalesce_ms
+            buffer = []
+            coalesce_s = coalesce_ms / 1000.0
+            last_emit = time.monotonic()
+            
             for chunk in stream_generator:
                 if "error" in chunk:
+                    self._check_model_not_found(chunk)
                     yield LLMResponse(
                         text=f"Ошибка в потоковой генерации чата: {chunk['error']}",
                         metadata={
@@ -444,21 +1064,33 @@ class ExternalLLMAdapter(LLMInterface):
                     return
                 
                 # Извлекаем текст и метаданные из чанка
-                chunk_text = chunk.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                finish_reason = chunk.get("choices", [{}])[0].get("finish_reason", None)
+                choice = _first_choice(chunk)
+                chunk_text = choice.get("delta", _EMPTY).get("content") or ""
+                finish_reason = choice.get("finish_reason")
+                if chunk_text:
+                    buffer.append(chunk_text)
                 
-                elapsed = time.time() - start_time
-                
-                # Create и возвращаем ответ для каждого фрагмента
-                yield LLMResponse(
-                    text=chunk_text,
-                    metadata={
-                        "model": model,
-                        "elapsed_time": elapsed,
-                        "chunk": True,
-                        "finish_reason": finish_reason
-                    }
-                )
+                if finish_reason is None:
+                    now = time.monotonic()
+                    if buffer and now - last_emit >= coalesce_s:
+                        yield LLMResponse(text="".join(buffer), metadata=chunk_metadata)
+                        buffer.clear()
+                        last_emit = now
+                else:
+                    yield LLMResponse(
+                        text="".join(buffer),
+                        metadata={
+                            "model": model,
+                            "elapsed_time": time.time() - start_time,
+                            "chunk": True,
+                            "finish_reason": finish_reason
+                        }
+                    )
+                    buffer.clear()
+            
+            # Поток закрылся без finish_reason - отдаем остаток буфера
+            if buffer:
+                yield LLMResponse(text="".join(buffer), metadata=chunk_metadata)
                 
         except Exception as e:
             logger.error(f"Ошибка в потоковой генерации чата: {e}")
@@ -467,7 +1099,7 @@ class ExternalLLMAdapter(LLMInterface):
                 metadata={"error": str(e), "elapsed_time": time.time() - start_time}
             )
     
-    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+    def get_embeddings(self, texts: List[str]) -> np.ndarray:
         """
         Получает эмбеддинги для списка текстов.
         
@@ -475,55 +1107,229 @@ class ExternalLLMAdapter(LLMInterface):
             texts: Список текстов для эмбеддинга.
             
         Returns:
-            List[List[float]]: Список векторов эмбеддингов.
+            np.ndarray: Матрица embedding_dtype (float32 по умолчанию) формы (len(texts), dim), строка на текст;
+            косинусная близость считается одним матричным умножением.
         """
         if not self.connected and not self._check_connection():
             logger.error("Нет соединения с API для получения эмбеддингов")
-            return [[0.0] * 768] * len(texts)  # Возвращаем нулевые векторы
+            return self._zero_embeddings(len(texts))  # Возвращаем нулевые векторы
             
         try:
-            result = self.proxy.generate_embeddings(texts=texts, model=self.embedding_model)
-            
-            if "error" in result:
-                logger.error(f"Ошибка при получении эмбеддингов: {result['error']}")
-                return [[0.0] * 768] * len(texts)
-            
-            # Извлекаем векторы из ответа
-            embeddings = []
-            for item in result.get("data", []):
-                embeddings.append(item.get("embedding", [0.0] * 768))
+            # Токены для деления на пачки считаются в потоке вызывающего, а не в
+            # общем фоновом loop: загрузка BPE и encode_batch блокируют поток
+            token_counts = self.count_tokens_many(texts) if self.embedding_batch_tokens else None
+            # Пачки текстов отправляются параллельно через фоновый loop
+            return self._run_sync(self._cached_embeddings(texts, token_counts))
             
-            return embeddings
+        except Exception as e:
+            logger.error(f"Ошибка при получении эмбеддингов: {str(e)}")
+            self._mark_request_failed()
+            return self._zero_embeddings(len(texts))  # Возвращаем нулевые векторы
+    
+    def _zero_embeddings(self, count: int) -> np.ndarray:
+        """Возвращает матрицу из count нулевых векторов для ответа при ошибке."""
+        return np.zeros((count, self._embedding_dim), dtype=self._embedding_dtype)
+    
+    async def aget_embeddings(self, texts: List[str]) -> np.ndarray:
+        """
+        Асинхронно получает эмбеддинги для списка текстов.
+        
+        Args:
+            texts: Список текстов для эмбеддинга.
             
+        Returns:
+            np.ndarray: Матрица embedding_dtype формы (len(texts), dim).
+        """
+        if not self.connected and not await self._acheck_connection():
+            logger.error("Нет соединения с API для получения эмбеддингов")
+            return self._zero_embeddings(len(texts))  # Возвращаем нулевые векторы
+        
+        try:
+            token_counts = None
+            if self.embedding_batch_tokens:
+                # Подсчет токенов блокирует поток - не в event loop вызывающего
+                token_counts = await asyncio.get_running_loop().run_in_executor(
+                    None, self.count_tokens_many, texts)
+            return await self._run_async(self._cached_embeddings(texts, token_counts))
         except Exception as e:
             logger.error(f"Ошибка при получении эмбеддингов: {str(e)}")
-            return [[0.0] * 768] * len(texts)  # Возвращаем нулевые векторы
+            self._mark_request_failed()
+            return self._zero_embeddings(len(texts))  # Возвращаем нулевые векторы
+    
+    async def _cached_embeddings(self, texts: List[str],
+                                 token_counts: Optional[List[int]] = None) -> np.ndarray:
+        """
+        Возвращает эмбеддинги, запрашивая у API только тексты, которых нет в кэше.
+        
+        Args:
+            texts: Список текстов для эмбеддинга.
+            token_counts: Число токенов каждого текста (нужно при embedding_batch_tokens)
+            
+        Returns:
+            np.ndarray: Матрица embedding_dtype в порядке texts.
+        """
+        cache = self._embedding_cache
+        if cache is None or not texts:
+            return await self._gather_embeddings(texts, token_counts)
+        
+        # Запросы к SQLite блокируют поток, а корутина выполняется в общем
+        # фоновом loop со всеми запросами адаптеров: чтение и запись кэша
+        # уходят в пул потоков
+        loop = asyncio.get_running_loop()
+        keys = [cache.key(text) for text in texts]
+        hits = await loop.run_in_executor(None, cache.get_many, keys, self.embedding_model)
+        missing = [i for i, vector in enumerate(hits) if vector is None]
+        if not missing:
+            return np.stack(hits)
+        
+        fetched = await self._gather_embeddings(
+            [texts[i] for i in missing],
+            [token_counts[i] for i in missing] if token_counts is not None else None)
+        
+        # В кэш попадают только полученные векторы, нулевые строки ошибок - нет
+        valid = fetched.any(axis=1)
+        await loop.run_in_executor(None, cache.put_many,
+                                   [keys[i] for i, ok in zip(missing, valid) if ok],
+                                   self.embedding_model, fetched[valid])
+        
+        dim = fetched.shape[1]
+        if len(missing) < len(texts):
+            # Размерность известна по кэшу, даже если все запросы к API упали
+            dim = next(len(vector) for vector in hits if vector is not None)
+            if fetched.shape[1] != dim:
+                fetched = np.zeros((len(missing), dim), dtype=self._embedding_dtype)
+        
+        embeddings = np.empty((len(texts), dim), dtype=self._embedding_dtype)
+        for i, vector in enumerate(hits):
+            if vector is not None:
+                embeddings[i] = vector
+        embeddings[missing] = fetched
+        return embeddings
+    
+    async def _gather_embeddings(self, texts: List[str],
+                                 token_counts: Optional[List[int]] = None) -> np.ndarray:
+        """
+        Делит тексты на пачки по embedding_batch_size и запрашивает их параллельно.
+        
+        Args:
+            texts: Список текстов для эмбеддинга.
+            token_counts: Число токенов каждого текста (нужно при embedding_batch_tokens)
+            
+        Returns:
+            np.ndarray: Матрица embedding_dtype в порядке texts; для пачек с ошибкой - нулевые строки.
+        """
+        batches = self._embedding_batches(texts, token_counts)
+        results = await asyncio.gather(*(
+            self.async_proxy.generate_embeddings(texts=batch, model=self.embedding_model)
+            for batch in batches
+        ))
+        
+        # Размерность берем из первого полученного вектора
+        for result in results:
+            vectors = [item.get("embedding") for item in result.get("data", ())]
+            dim = next((len(vector) for vector in vectors if vector), 0)
+            if dim:
+                self._embedding_dim = dim
+                break
+        
+        # Векторы пишутся прямо в непрерывную матрицу, без списка списков
+        embeddings = self._zero_embeddings(len(texts))
+        offset = 0
+        for batch, result in zip(batches, results):
+            if "error" in result:
+                logger.error(f"Ошибка при получении эмбеддингов: {result['error']}")
+            else:
+                # Извлекаем векторы из ответа (отсутствующие остаются нулевыми)
+                for row, item in enumerate(result.get("data", ())[:len(batch)]):
+                    embedding = item.get("embedding")
+                    if embedding:
+                        embeddings[offset + row] = embedding
+            offset += len(batch)
+        
+        return embeddings
+    
+    def _embedding_batches(self, texts: List[str],
+                           token_counts: Optional[List[int]] = None) -> List[List[str]]:
+        """
+        Делит тексты на пачки не больше embedding_batch_size текстов и, если задан
+        embedding_batch_tokens, не больше этой суммы токенов (текст, который один
+        превышает предел, идет отдельной пачкой - его обрежет или отклонит сервер).
+        
+        Токены не считаются здесь: метод выполняется в общем фоновом loop, поэтому
+        число токенов заранее считают get_embeddings и aget_embeddings.
+        
+        Args:
+            texts: Список текстов для эмбеддинга.
+            token_counts: Число токенов каждого текста; без него пачки делятся
+                только по embedding_batch_size
+            
+        Returns:
+            List[List[str]]: Пачки в исходном порядке текстов
+        """
+        batch_size = self.embedding_batch_size
+        max_tokens = self.embedding_batch_tokens
+        if not max_tokens or token_counts is None:
+            return [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        
+        batches = []
+        batch = []
+        batch_tokens = 0
+        for text, tokens in zip(texts, token_counts):
+            if batch and (len(batch) >= batch_size or batch_tokens + tokens > max_tokens):
+                batches.append(batch)
+                batch = []
+                batch_tokens = 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        return batches
+    
+    def _get_encoding(self):
+        """
+        Возвращает BPE-кодировку tiktoken для модели по умолчанию.
+        
+        Returns:
+            tiktoken.Encoding или None, если tiktoken не установлен
+        """
+        if self._encoding is None and HAS_TIKTOKEN:
+            # Кодировка общая для всех адаптеров с той же моделью
+            self._encoding = _tiktoken_encoding(self.default_model)
+        return self._encoding
     
     def tokenize(self, text: str) -> List[int]:
         """
-        Токенизирует текст. При внешнем API точная токенизация недоступна.
+        Токенизирует текст BPE-кодировкой tiktoken.
+        
+        Для моделей не из семейства OpenAI токены приблизительные: у внешнего
+        API свой токенизатор.
         
         Args:
             text: Текст для токенизации.
             
         Returns:
-            List[int]: Приблизительный список токенов (заглушка).
+            List[int]: Список токенов (без tiktoken - заглушка по длине текста).
         """
-        # Для внешнего API точная токенизация обычно недоступна
+        encoding = self._get_encoding()
+        if encoding is not None:
+            return encoding.encode(text, disallowed_special=())
         # Возвращаем приблизительную оценку токенов (1 токен ≈ 4 символа)
         return list(range(len(text) // 4 + 1))
     
     def detokenize(self, tokens: List[int]) -> str:
         """
-        Детокенизирует список токенов. Для внешнего API не реализовано.
+        Детокенизирует список токенов BPE-кодировкой tiktoken.
         
         Args:
             tokens: Список токенов.
             
         Returns:
-            str: Пустая строка (заглушка).
+            str: Декодированный текст (без tiktoken - пустая строка).
         """
-        logger.warning("Детокенизация не поддерживается для внешнего API")
+        encoding = self._get_encoding()
+        if encoding is not None:
+            return encoding.decode(tokens)
+        logger.warning("Детокенизация без tiktoken не поддерживается для внешнего API")
         return ""
     
     def count_tokens(self, text: str) -> int:
@@ -534,11 +1340,38 @@ class ExternalLLMAdapter(LLMInterface):
             text: Текст для подсчета токенов.
             
         Returns:
-            int: Приблизительное количество токенов.
+            int: Количество токенов (без tiktoken - оценка 1 токен ≈ 4 символа).
         """
+        encoding = self._get_encoding()
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
         # Приблизительная оценка (1 токен ≈ 4 символа)
         return len(text) // 4 + 1
     
+    def count_tokens_many(self, texts: List[str]) -> List[int]:
+        """
+        Подсчитывает количество токенов сразу для нескольких текстов.
+        
+        Начиная с _ENCODE_BATCH_MIN_TEXTS текстов tiktoken кодирует пакет в пуле
+        из не более чем _ENCODE_BATCH_THREADS потоков без GIL; меньшие пакеты
+        кодируются по одному, так как создание пула дороже самого кодирования.
+        
+        Args:
+            texts: Список текстов для подсчета токенов.
+            
+        Returns:
+            List[int]: Количество токенов для каждого текста.
+        """
+        encoding = self._get_encoding()
+        if encoding is not None:
+            if len(texts) < _ENCODE_BATCH_MIN_TEXTS:
+                return [len(encoding.encode(text, disallowed_special=())) for text in texts]
+            encoded = encoding.encode_batch(texts, num_threads=_ENCODE_BATCH_THREADS,
+                                            disallowed_special=())
+            return [len(tokens) for tokens in encoded]
+        # Приблизительная оценка (1 токен ≈ 4 символа)
+        return [len(text) // 4 + 1 for text in texts]
+    
     def get_max_context_length(self) -> int:
         """
         Возвращает максимальную длину контекста для модели.
@@ -547,13 +1380,19 @@ class ExternalLLMAdapter(LLMInterface):
             int: Максимальная длина контекста.
         """
         # Возвращаем стандартное значение для большинства моделей
-        return self.config.get("external_api", {}).get("max_context_length", 4096)
+        return self.max_context_length
     
     def shutdown(self) -> None:
         """Очищает ресурсы."""
         try:
             if hasattr(self, "proxy") and self.proxy:
                 self.proxy.close()
+            if _LOOP is not None:
+                # Общий loop и пул соединений продолжают обслуживать другие адаптеры
+                self._run_sync(self.async_proxy.close())
+            if self._embedding_cache is not None:
+                self._embedding_cache.close()
+                self._embedding_cache = None
             self.connected = False
             logger.info("Адаптер ExternalLLM выключен")
         except Exception as e:
@@ -566,11 +1405,17 @@ EXAMPLE_CONFIG = {
         "url": "http://localhost:8000/v1",
         "api_key": "",  # Если требуется
         "timeout": 60,
+        "connect_timeout": 3,  # Зависшее подключение обрывается быстро
+        "read_timeout": 60,  # Ожидание очередных данных ответа
+        "write_timeout": 10,  # Отправка тела запроса (HTTP/2)
         "retry_attempts": 3,
         "retry_delay": 0.5,
         "verify_ssl": True,
         "embedding_model": "text-embedding-ada-002",
-        "max_context_length": 4096
+        "max_context_length": 4096,
+        # Предел параллельных запросов (generate_batch, asyncio.gather);
+        # для Ollama задайте также OLLAMA_NUM_PARALLEL на стороне сервера
+        "max_connections": 32
     },
     "default_model": "gpt-3.5-turbo"
 }
@@ -580,7 +1425,7 @@ if __name__ == "__main__":
     # Пример use
     llm = ExternalLLMAdapter(EXAMPLE_CONFIG)
     
-    if llm.connected:
+    if llm._check_connection():
         # Проверка обычной генерации
         print("Тест генерации:")
         response = llm.generate("Расскажи короткую историю о программисте.")
@@ -607,6 +1452,6 @@ if __name__ == "__main__":
         # Получение эмбеддингов
         print("\nТест эмбеддингов:")
         embeddings = llm.get_embeddings(["Тестовый текст для эмбеддинга"])
-        print(f"Длина вектора эмбеддинга: {len(embeddings[0])}")
+        print(f"Размер матрицы эмбеддингов: {embeddings.shape}")
     else:
         print("Не удалось подключиться к API.")
\ No newline at end of file
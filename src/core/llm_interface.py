@@ -14,16 +14,32 @@ License: MIT
 
 import logging
 from typing import Dict, List, Any, Optional, Union
-from dataclasses import dataclass
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
 
-@dataclass
 class LLMResponse:
-    """Результат execution запроса к языковой модели."""
-    text: str
-    metadata: Dict[str, Any] = None
+    """
+    Результат execution запроса к языковой модели.
+    
+    Класс со __slots__ вместо dataclass (dataclass(slots=True) требует
+    Python 3.10): без __dict__ каждый ответ и фрагмент потока заметно легче.
+    """
+    __slots__ = ("text", "metadata")
+    
+    def __init__(self, text: str, metadata: Dict[str, Any] = None):
+        self.text = text
+        self.metadata = metadata
+    
+    def __repr__(self) -> str:
+        return f"LLMResponse(text={self.text!r}, metadata={self.metadata!r})"
+    
+    def __eq__(self, other: Any) -> bool:
+        if other.__class__ is not self.__class__:
+            return NotImplemented
+        return (self.text, self.metadata) == (other.text, other.metadata)
 
 
 class LLMInterface:
@@ -69,7 +85,7 @@ class LLMInterface:
         """
         raise NotImplementedError("Метод должен быть реализован в дочернем классе")
     
-    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+    def get_embeddings(self, texts: List[str]) -> np.ndarray:
         """
         Получает эмбеддинги для списка текстов.
         
@@ -77,10 +93,23 @@ class LLMInterface:
             texts: Список текстов для эмбеддинга
             
         Returns:
-            List[List[float]]: Список векторов эмбеддингов
+            np.ndarray: Непрерывная матрица float32 формы (len(texts), dim)
         """
         raise NotImplementedError("Метод должен быть реализован в дочернем классе")
     
+    def get_embeddings_list(self, texts: List[str]) -> List[List[float]]:
+        """
+        Получает эмбеддинги в виде списка списков (для кода, ожидающего прежний формат).
+        
+        Args:
+            texts: Список текстов для эмбеддинга
+            
+        Returns:
+            List[List[float]]: Список векторов эмбеддингов
+        """
+        embeddings = self.get_embeddings(texts)
+        return embeddings.tolist() if isinstance(embeddings, np.ndarray) else embeddings
+    
     def tokenize(self, text: str) -> List[int]:
         """
         Токенизирует текст.
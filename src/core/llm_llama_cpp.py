@@ -13,22 +13,214 @@ License: MIT
 """
 
 import os
+import mmap
 import time
+import struct
+import ctypes
+import inspect
 import logging
+import importlib
 import threading
-from typing import Dict, List, Any, Optional, Union, Generator
-import psutil
+import functools
+from dataclasses import dataclass, asdict, fields
+from typing import TYPE_CHECKING, Callable, Dict, List, Any, Optional, Tuple, Union, Generator
+
+import numpy as np
 
 try:
-    import llama_cpp
-    LLAMA_CPP_AVAILABLE = True
+    import pynvml
+    HAS_PYNVML = True
 except ImportError:
-    LLAMA_CPP_AVAILABLE = False
+    HAS_PYNVML = False
 
 from .llm_interface import LLMInterface, LLMResponse
 
+if TYPE_CHECKING:
+    from .llama_batch import ContinuousBatcher, EmbeddingContextPool
+
 logger = logging.getLogger(__name__)
 
+# llama_cpp загружает разделяемую библиотеку на сотни МБ, а hardware_optimizer
+# тянет psutil; оба импортируются при первой надобности, а не при импорте модуля
+llama_cpp = None
+_llama_cpp_available: Optional[bool] = None
+
+# Доля свободной VRAM под веса и KV-кэш при авто-подборе n_gpu_layers
+# и резерв на контекст CUDA и рабочие буферы
+_GPU_FREE_VRAM_FRACTION = 0.95
+_GPU_CONTEXT_RESERVE_BYTES = 512 * 1024 * 1024
+
+# Типы элементов KV-кэша: значение kv_cache_type -> константа ggml
+_KV_CACHE_GGML_TYPES = {"f16": "GGML_TYPE_F16", "q8_0": "GGML_TYPE_Q8_0", "q4_0": "GGML_TYPE_Q4_0"}
+
+# Пулинг эмбеддингов: значение embedding_pooling -> константа llama_cpp
+_POOLING_TYPES = {"none": "LLAMA_POOLING_TYPE_NONE", "mean": "LLAMA_POOLING_TYPE_MEAN",
+                  "cls": "LLAMA_POOLING_TYPE_CLS", "last": "LLAMA_POOLING_TYPE_LAST"}
+
+# Размерность нулевых эмбеддингов-заглушек, когда n_embd модели неизвестна
+_DEFAULT_EMBEDDING_DIM = 768
+
+# Методы, которые без загруженной модели подменяются заглушками _<имя>_stub
+_MODEL_METHODS = ("generate", "chat", "get_embeddings", "tokenize", "detokenize",
+                  "count_tokens", "get_max_context_length")
+
+# Значения advice для madvise(2) в Linux (в модуле mmap есть не во всех версиях Python)
+_MADV_WILLNEED = getattr(mmap, "MADV_WILLNEED", 3)
+_MADV_HUGEPAGE = getattr(mmap, "MADV_HUGEPAGE", 14)
+
+# Размер блока чтения при предзагрузке файла модели в page cache
+_PREFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Начальная емкость буфера токенов нативного токенизатора (растет по мере надобности)
+_TOKEN_BUFFER_SIZE = 4096
+
+
+@dataclass(frozen=True)
+class GenerationParams:
+    """
+    Параметры генерации с именами аргументов create_completion.
+    
+    Без slots=True: он требует Python 3.10 (см. LLMResponse).
+    """
+    max_tokens: int = 256
+    temperature: float = 0.7
+    top_p: float = 0.95
+    top_k: int = 40
+    repeat_penalty: float = 1.1
+    echo: bool = False
+    stream: bool = False
+    stop: Tuple[str, ...] = ()
+
+
+# Допустимые ключи kwargs для generate и готовый словарь параметров по
+# умолчанию (вызов без kwargs не строит параметры заново)
+_GENERATION_PARAM_NAMES = frozenset(field.name for field in fields(GenerationParams))
+_DEFAULT_PARAMS = GenerationParams()
+_DEFAULT_PARAMS_DICT = asdict(_DEFAULT_PARAMS)
+
+
+def _check_llama_cpp() -> bool:
+    """Импортирует llama_cpp при первом вызове; результат запоминается."""
+    global llama_cpp, _llama_cpp_available
+    if _llama_cpp_available is None:
+        try:
+            llama_cpp = importlib.import_module("llama_cpp")
+            _llama_cpp_available = True
+        except ImportError:
+            _llama_cpp_available = False
+    return _llama_cpp_available
+
+
+def __getattr__(name: str) -> Any:
+    # LLAMA_CPP_AVAILABLE вычисляется при первом обращении (импорт из server.py)
+    if name == "LLAMA_CPP_AVAILABLE":
+        return _check_llama_cpp()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@functools.lru_cache(maxsize=None)
+def _llama_accepts(kwarg: str) -> bool:
+    """Проверяет, принимает ли Llama() аргумент kwarg в установленной версии llama-cpp-python."""
+    return kwarg in inspect.signature(llama_cpp.Llama.__init__).parameters
+
+
+@functools.lru_cache(maxsize=1)
+def _physical_core_count() -> int:
+    """Число физических ядер; на Windows psutil опрашивает WMI, поэтому считается один раз."""
+    import psutil
+    return psutil.cpu_count(logical=False) or 4
+
+
+def _numa_node_cpus(node: int) -> List[int]:
+    """
+    Возвращает по одному логическому CPU на каждое физическое ядро узла NUMA (Linux).
+    
+    Args:
+        node: Номер узла NUMA
+        
+    Returns:
+        List[int]: Номера CPU (первый SMT-сосед каждого ядра)
+    """
+    from .hardware_optimizer import _parse_cpulist
+    
+    with open(f"/sys/devices/system/node/node{node}/cpulist", "r") as f:
+        node_cpus = set(_parse_cpulist(f.read()))
+    cores = set()
+    for cpu in node_cpus:
+        with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list", "r") as f:
+            siblings = [sibling for sibling in _parse_cpulist(f.read()) if sibling in node_cpus]
+        cores.add(min(siblings or [cpu]))
+    return sorted(cores)
+
+
+def _prefault_file(path: str) -> None:
+    """
+    Читает файл модели в page cache, чтобы первый запрос не ждал диск.
+    
+    llama.cpp отображает файл через mmap и подгружает страницы лениво, при
+    первом обращении во время инференса. Здесь файл читается блоками в один
+    переиспользуемый буфер (страницы page cache общие с отображением llama.cpp).
+    Чтение идет через readinto, который отпускает GIL на время системного
+    вызова: обращение к страницам mmap из Python держало бы GIL на каждом
+    промахе и останавливало бы все потоки, включая обработчики запросов.
+    
+    Args:
+        path: Путь к файлу модели
+    """
+    start_time = time.time()
+    try:
+        with open(path, "rb", buffering=0) as f:
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            buffer = memoryview(bytearray(_PREFAULT_CHUNK_SIZE))
+            while f.readinto(buffer):
+                pass
+        logger.info(f"Файл модели {os.path.basename(path)} загружен в page cache "
+                    f"за {time.time() - start_time:.1f} с")
+    except (OSError, ValueError) as e:
+        logger.warning("Не удалось предзагрузить файл модели: %s", e)
+
+
+def _advise_hugepages(path: str) -> int:
+    """
+    Помечает отображения файла модели в памяти процесса MADV_HUGEPAGE и MADV_WILLNEED (Linux).
+    
+    Веса отображены страницами по 4 КБ, и каждый проход по ним при
+    декодировании дает много промахов TLB. С MADV_HUGEPAGE ядро может
+    подменить отображение прозрачными страницами по 2 МБ (при режиме THP
+    "madvise" без этого не обойтись, при "always" вызов ничего не меняет).
+    Страницы по 1 ГБ требуют hugetlbfs и здесь не используются.
+    
+    Args:
+        path: Путь к файлу модели, отображенному llama.cpp
+        
+    Returns:
+        int: Число помеченных областей (0, если отображений нет или madvise недоступен)
+    """
+    real_path = os.path.realpath(path)
+    try:
+        libc = ctypes.CDLL("libc.so.6", use_errno=True)
+        libc.madvise.argtypes = (ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int)
+        with open("/proc/self/maps", "r") as f:
+            regions = []
+            for line in f:
+                columns = line.split(maxsplit=5)
+                if len(columns) == 6 and columns[5].rstrip("\n") == real_path:
+                    start, end = (int(address, 16) for address in columns[0].split("-"))
+                    regions.append((start, end - start))
+    except OSError as e:
+        logger.debug("madvise недоступен: %s", e)
+        return 0
+    
+    advised = 0
+    for start, length in regions:
+        if libc.madvise(start, length, _MADV_HUGEPAGE) != 0:
+            logger.debug("MADV_HUGEPAGE отклонен: %s", os.strerror(ctypes.get_errno()))
+            continue
+        libc.madvise(start, length, _MADV_WILLNEED)
+        advised += 1
+    return advised
+
 
 class LLamaLLM(LLMInterface):
     """
@@ -47,29 +239,82 @@ class LLamaLLM(LLMInterface):
                 - model_path: Путь к файлу модели (GGUF)
                 - n_ctx: Размер контекста (по умолчанию 4096)
                 - n_threads: Количество потоков (авто-определение, если не указано)
-                - n_gpu_layers: Количество слоев для GPU (-1 для всех)
+                - numa_node: Узел NUMA, к ядрам которого привязывается процесс (Linux;
+                  по умолчанию без привязки)
+                - n_gpu_layers: Количество слоев для GPU (-1 для всех, "auto" - подбор
+                  по свободной VRAM с уменьшением при нехватке памяти)
+                - flash_attn: Flash attention (по умолчанию включается на GPU NVIDIA
+                  с compute capability 7.0+)
+                - override_tensor_regex: Регулярное выражение имен тензоров, которые
+                  остаются в RAM при офлоаде слоев (например, r"\.ffn_(gate|up|down)_exps\.")
+                - kv_cache_type: Тип элементов KV-кэша: "f16", "q8_0" или "q4_0" (по умолчанию "f16";
+                  квантованный кэш требует flash attention и включает его)
                 - use_gpu: Использовать ли GPU (по умолчанию True)
                 - gpu_device: Устройство GPU (по умолчанию 0)
                 - seed: Seed для генерации (по умолчанию 42)
                 - verbose: Подробный вывод отладки (по умолчанию False)
                 - use_mlock: Использовать mlock для предотвращения свопирования (по умолчанию True)
                 - use_mmap: Использовать mmap для загрузки модели (по умолчанию True)
+                - prefault_mmap: Подгрузить файл модели в page cache фоновым потоком сразу
+                  после загрузки (по умолчанию True при use_mmap без use_mlock)
+                - huge_pages: Пометить отображение файла модели MADV_HUGEPAGE для прозрачных
+                  страниц по 2 МБ (Linux, по умолчанию True)
                 - rope_scaling_type: Тип масштабирования RoPE (по умолчанию None)
+                - n_batch: Размер пакета токенов на один вызов llama_decode (по умолчанию 512)
+                - embedding: Считать эмбеддинги в основном контексте генерации (по умолчанию
+                  True только при embedding_contexts=0; расчет эмбеддинга сбрасывает KV-кэш
+                  контекста, и общий префикс диалога перестает переиспользоваться)
+                - embedding_pooling: Пулинг токенов в вектор текста внутри llama.cpp для
+                  основного контекста: none, mean, cls или last (по умолчанию mean)
+                - embedding_max_tokens: Длина самого длинного текста для эмбеддинга в токенах;
+                  n_batch основного контекста не меньше нее (по умолчанию 512)
+                - prompt_cache_bytes: Объем RAM-кэша состояний KV для разных диалогов
+                  (по умолчанию 0 - отключен)
+                - max_concurrent: Число запросов, генерируемых одним пакетом
+                  (по умолчанию 1 - без непрерывного пакетирования)
+                - batch_n_ctx: Размер KV-кэша, общего для пакетируемых запросов (по умолчанию n_ctx)
+                - embedding_contexts: Число отдельных контекстов для параллельного расчета
+                  эмбеддингов (по умолчанию 1; 0 - эмбеддинги через основной контекст под блокировкой).
+                  Контексты создаются при первом вызове get_embeddings, поэтому без
+                  эмбеддингов память (в том числе VRAM) на них не расходуется
+                - embedding_n_ctx: Размер контекста для эмбеддингов (по умолчанию 2048)
         """
         super().__init__(config or {})
         self.model = None
         self.model_path = self.config.get("model_path", "")
+        # Имя модели для метаданных ответов (путь после создания не меняется)
+        self._model_basename = os.path.basename(self.model_path)
+        # Размер контекста загруженной модели (после загрузки не меняется)
+        self._n_ctx = 4096
         self.lock = threading.RLock()
+        # Дескриптор словаря для прямых вызовов llama_tokenize (None - через Llama.tokenize)
+        self._vocab = None
+        # Буфер токенов у каждого потока свой: токенизация идет без self.lock
+        self._token_buffers = threading.local()
+        # Токены уже виденных сообщений чата: [((роль, текст), токены), ...]
+        self._chat_prefix: List[Tuple[Tuple[str, str], List[int]]] = []
+        # Токены шаблона чата: BOS и маркеры ролей "<|role|>\n"
+        self._bos_tokens: List[int] = []
+        self._role_tokens: Dict[str, List[int]] = {}
+        # Планировщик непрерывного пакетирования (None - запросы идут через create_completion)
+        self._batcher: Optional["ContinuousBatcher"] = None
+        # Пул контекстов для эмбеддингов без блокировки модели (None - через основной
+        # контекст или еще не создан) и число его контекстов (0 - пул не используется)
+        self._embed_pool: Optional["EmbeddingContextPool"] = None
+        self._embed_contexts = 0
+        self._bind_stubs()
         
-        if not LLAMA_CPP_AVAILABLE:
+        # Путь проверяется до импорта llama_cpp: без файла модели разделяемая
+        # библиотека не нужна и не загружается
+        if not (self.model_path and os.path.exists(self.model_path)):
+            logger.warning("Путь к модели не найден: %s", self.model_path)
+            return
+        
+        if not _check_llama_cpp():
             logger.warning("LLamaLLM - llama-cpp-python не установлен. Работаем в режиме заглушек.")
             return
         
-        # Load модель если путь указан
-        if self.model_path and os.path.exists(self.model_path):
-            self._initialize_model()
-        else:
-            logger.warning(f"Путь к модели не найден: {self.model_path}")
+        self._initialize_model()
     
     def _initialize_model(self) -> bool:
         """
@@ -78,19 +323,47 @@ class LLamaLLM(LLMInterface):
         Returns:
             bool: Успешно ли загрузилась модель
         """
-        if not LLAMA_CPP_AVAILABLE:
+        if not _check_llama_cpp():
             return False
+        from .hardware_optimizer import _KV_CACHE_TYPE_BYTES
+        from .llama_batch import ContinuousBatcher
             
         try:
             # Определяем оптимальное количество потоков, если не указано
             n_threads = self.config.get("n_threads")
+            numa_node = self.config.get("numa_node")
+            if numa_node is not None:
+                # На многосокетных системах веса и KV-кэш читаются из памяти
+                # своего узла, без трафика между сокетами
+                try:
+                    node_cpus = _numa_node_cpus(numa_node)
+                    os.sched_setaffinity(0, node_cpus)
+                    n_threads = n_threads or len(node_cpus)
+                    logger.info(f"Процесс привязан к узлу NUMA {numa_node}: CPU {node_cpus}")
+                except (OSError, AttributeError) as e:
+                    logger.warning("Не удалось привязать процесс к узлу NUMA %s: %s", numa_node, e)
+                    numa_node = None
             if not n_threads:
-                n_threads = psutil.cpu_count(logical=False) or 4
+                n_threads = _physical_core_count()
                 
+            kv_cache_type = self.config.get("kv_cache_type", "f16")
+            kv_cache_type = "f16" if kv_cache_type == "fp16" else kv_cache_type
+            if kv_cache_type not in _KV_CACHE_GGML_TYPES:
+                logger.warning("Неизвестный kv_cache_type %r, используем f16", kv_cache_type)
+                kv_cache_type = "f16"
+            if kv_cache_type != "f16" and not _llama_accepts("type_k"):
+                logger.warning("Установленная версия llama-cpp-python не поддерживает type_k/type_v, "
+                               "KV-кэш остается f16")
+                kv_cache_type = "f16"
+            
             # Конфигурация для GPU
             n_gpu_layers = 0
+            autotune_gpu = False
             if self.config.get("use_gpu", True):
                 n_gpu_layers = self.config.get("n_gpu_layers", -1)
+                if n_gpu_layers == "auto":
+                    autotune_gpu = True
+                    n_gpu_layers = self._autotune_gpu_layers(kv_cache_type)
                 # Устанавливаем переменные среды для GPU
                 if self.config.get("gpu_backend") == "rocm":
                     os.environ["GGML_OPENCL_PLATFORM"] = "AMD"
@@ -106,33 +379,390 @@ class LLamaLLM(LLMInterface):
                 rope_scaling = {"type": self.config.get("rope_scaling_type"),
                                "factor": self.config.get("rope_scaling_factor", 1.0)}
             
+            # Эмбеддинги считаются в контекстах пула с пулингом MEAN; основной
+            # контекст генерации переводится в режим эмбеддингов, только если пул
+            # отключен: create_embedding сбрасывает его KV-кэш и префикс диалога
+            embedding_contexts = self.config.get("embedding_contexts", 1)
+            embedding = self.config.get("embedding", embedding_contexts <= 0)
+            # Эмбеддинг текста считается одним пакетом: текст длиннее n_batch
+            # llama.cpp отвергает, поэтому n_batch не меньше самого длинного текста
+            n_batch = self.config.get("n_batch", 512)
+            if embedding:
+                n_batch = max(n_batch, self.config.get("embedding_max_tokens", 512))
+            
             # Загрузка модели
-            self.model = llama_cpp.Llama(
+            llama_kwargs = dict(
                 model_path=self.model_path,
                 n_ctx=self.config.get("n_ctx", 4096),
+                n_batch=n_batch,
                 n_threads=n_threads,
-                n_gpu_layers=n_gpu_layers,
                 seed=self.config.get("seed", 42),
                 verbose=self.config.get("verbose", False),
                 use_mlock=use_mlock,
                 use_mmap=use_mmap,
-                rope_scaling=rope_scaling
+                rope_scaling=rope_scaling,
+                embedding=embedding
             )
+            pooling = self.config.get("embedding_pooling", "mean")
+            if embedding and pooling in _POOLING_TYPES and _llama_accepts("pooling_type"):
+                # Усреднение по токенам внутри llama_decode: create_embedding
+                # возвращает готовый вектор на текст, а не векторы токенов
+                llama_kwargs["pooling_type"] = getattr(llama_cpp, _POOLING_TYPES[pooling])
+            if n_gpu_layers != 0 and _llama_accepts("flash_attn"):
+                flash_attn = self.config.get("flash_attn")
+                if flash_attn is None:
+                    flash_attn = self._use_flash_attention()
+                    self.config["flash_attn"] = flash_attn
+                llama_kwargs["flash_attn"] = flash_attn
+            
+            if kv_cache_type != "f16":
+                # Декодирование упирается в чтение KV-кэша: q8_0 вдвое меньше f16.
+                # Квантованный V llama.cpp поддерживает только с flash attention
+                ggml_type = getattr(llama_cpp, _KV_CACHE_GGML_TYPES[kv_cache_type])
+                llama_kwargs["type_k"] = ggml_type
+                llama_kwargs["type_v"] = ggml_type
+                if not llama_kwargs.get("flash_attn"):
+                    if self.config.get("flash_attn") is False:
+                        logger.warning("kv_cache_type=%s требует flash attention, включаем его", kv_cache_type)
+                    llama_kwargs["flash_attn"] = True
+            
+            if numa_node is not None and _llama_accepts("numa"):
+                # numactl: llama.cpp использует CPU из маски привязки процесса
+                llama_kwargs["numa"] = getattr(llama_cpp, "GGML_NUMA_STRATEGY_NUMACTL", True)
+            
+            override_tensor_regex = self.config.get("override_tensor_regex")
+            if override_tensor_regex and n_gpu_layers != 0:
+                # Крупные тензоры FFN (эксперты MoE) с низкой арифметической
+                # интенсивностью остаются на CPU, освобождая VRAM под больше слоев
+                if _llama_accepts("override_tensor"):
+                    llama_kwargs["override_tensor"] = f"{override_tensor_regex}=CPU"
+                else:
+                    logger.warning("Установленная версия llama-cpp-python не поддерживает override_tensor, "
+                                   "override_tensor_regex игнорируется")
+            while True:
+                try:
+                    self.model = llama_cpp.Llama(n_gpu_layers=n_gpu_layers, **llama_kwargs)
+                    break
+                except (ValueError, RuntimeError) as e:
+                    # Оценка по VRAM не учитывает всех буферов: при нехватке
+                    # памяти уменьшаем число слоев вдвое, пока модель не загрузится
+                    if not autotune_gpu or n_gpu_layers <= 0:
+                        raise
+                    logger.warning("Модель не загрузилась с gpu_layers=%s (%s), пробуем %s",
+                                   n_gpu_layers, e, n_gpu_layers // 2)
+                    n_gpu_layers //= 2
+            
+            if autotune_gpu:
+                # Подобранное значение используется при следующих загрузках
+                self.config["n_gpu_layers"] = n_gpu_layers
+                logger.info(f"Авто-подбор: gpu_layers={n_gpu_layers}")
             
-            logger.info(f"Модель {os.path.basename(self.model_path)} успешно загружена")
+            layout = self._model_layout()
+            if layout is not None:
+                # Объем KV на токен ограничивает число одновременных последовательностей
+                n_layers, n_embd_kv = layout
+                kv_bytes_per_token = 2 * n_layers * n_embd_kv * _KV_CACHE_TYPE_BYTES[kv_cache_type]
+                logger.info(f"KV-кэш {kv_cache_type}: {kv_bytes_per_token / 1024:.1f} КБ на токен, "
+                            f"{kv_bytes_per_token * llama_kwargs['n_ctx'] / 2**20:.0f} МБ на n_ctx")
+            
+            if use_mmap and self.config.get("huge_pages", True) and os.path.exists("/proc/self/maps"):
+                advised = _advise_hugepages(self.model_path)
+                if advised:
+                    logger.info(f"Отображение файла модели помечено MADV_HUGEPAGE: {advised} обл.")
+            
+            # Без mlock страницы весов подгружаются с диска лениво, во время
+            # первых запросов; подгружаем их заранее, не блокируя загрузку
+            if self.config.get("prefault_mmap", use_mmap and not use_mlock):
+                threading.Thread(target=_prefault_file, args=(self.model_path,),
+                                 name="llama-prefault", daemon=True).start()
+            
+            self._init_tokenizer()
+            self._init_chat_template()
+            
+            # Llama.generate сам переиспользует KV общего префикса с предыдущим
+            # запросом; кэш состояний сохраняет KV и для чередующихся диалогов
+            prompt_cache_bytes = self.config.get("prompt_cache_bytes", 0)
+            if prompt_cache_bytes:
+                self.model.set_cache(llama_cpp.LlamaRAMCache(capacity_bytes=prompt_cache_bytes))
+            
+            max_concurrent = self.config.get("max_concurrent", 1)
+            if max_concurrent > 1:
+                self._batcher = ContinuousBatcher(
+                    self.model,
+                    max_concurrent=max_concurrent,
+                    n_ctx=self.config.get("batch_n_ctx", self.config.get("n_ctx", 4096)),
+                    n_batch=self.config.get("n_batch", 512)
+                )
+            
+            # Пул создается при первом get_embeddings: контекст на embedding_n_ctx
+            # токенов и пакет под него не нужны тем, кто эмбеддинги не считает
+            self._embed_contexts = max(0, embedding_contexts)
+            
+            self._n_ctx = self.model.n_ctx()
+            
+            logger.info(f"Модель {self._model_basename} успешно загружена")
             logger.info(f"Конфигурация: потоки={n_threads}, gpu_layers={n_gpu_layers}")
+            self._bind_model()
             return True
             
         except Exception as e:
-            logger.error(f"Ошибка инициализации модели llama.cpp: {e}")
+            logger.error("Ошибка инициализации модели llama.cpp: %s", e)
             return False
     
-    def generate(self, prompt: str, **kwargs) -> LLMResponse:
+    def _nvml_query(self, query: Callable[[Any], Any]) -> Any:
+        """
+        Выполняет запрос NVML к устройству gpu_device.
+        
+        Args:
+            query: Функция от дескриптора устройства NVML
+            
+        Returns:
+            Any: Результат query или None, если NVML недоступен
+        """
+        if not HAS_PYNVML:
+            return None
+        try:
+            pynvml.nvmlInit()
+            try:
+                return query(pynvml.nvmlDeviceGetHandleByIndex(self.config.get("gpu_device", 0)))
+            finally:
+                pynvml.nvmlShutdown()
+        except pynvml.NVMLError as e:
+            logger.warning("Запрос NVML не удался: %s", e)
+            return None
+    
+    def _free_vram_bytes(self) -> Optional[int]:
+        """Возвращает свободную VRAM устройства gpu_device по NVML или None, если узнать нельзя."""
+        free = self._nvml_query(lambda handle: pynvml.nvmlDeviceGetMemoryInfo(handle).free)
+        return int(free) if free is not None else None
+    
+    def _use_flash_attention(self) -> bool:
+        """
+        Решает, включать ли flash attention, если это не задано в конфигурации.
+        
+        На GPU NVIDIA с compute capability 7.0+ (Volta и новее) ядра flash
+        attention llama.cpp работают на тензорных ядрах и уменьшают обмен с
+        VRAM при чтении KV-кэша.
+        
+        Returns:
+            bool: Включать ли flash_attn
+        """
+        capability = self._nvml_query(pynvml.nvmlDeviceGetCudaComputeCapability) if HAS_PYNVML else None
+        if capability is None:
+            return False
+        major, minor = capability
+        logger.info(f"Compute capability GPU: {major}.{minor}")
+        return major >= 7
+    
+    def _model_layout(self) -> Optional[Tuple[int, int]]:
+        """
+        Читает из заголовка GGUF размеры, от которых зависит KV-кэш.
+        
+        Returns:
+            Optional[Tuple[int, int]]: Число слоев и размерность K (или V) на токен
+            в слое или None, если метаданные прочитать нельзя
+        """
+        from .hardware_optimizer import _read_gguf_metadata
+        
+        try:
+            meta = _read_gguf_metadata(self.model_path, (
+                'block_count', 'embedding_length', 'attention.head_count', 'attention.head_count_kv'))
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            logger.warning("Не удалось прочитать метаданные GGUF (%s): %s", self.model_path, e)
+            return None
+        
+        n_layers = meta.get('block_count')
+        if not n_layers:
+            return None
+        n_embd = meta.get('embedding_length') or 0
+        n_head = meta.get('attention.head_count') or 1
+        return n_layers, n_embd * (meta.get('attention.head_count_kv') or n_head) // n_head
+    
+    def _autotune_gpu_layers(self, kv_cache_type: str = "f16") -> int:
+        """
+        Оценивает, сколько слоев модели помещается в свободную VRAM.
+        
+        Из свободной VRAM вычитаются KV-кэш (K и V на n_ctx токенов по всем
+        слоям) и резерв на контекст CUDA; остаток делится на размер одного
+        слоя (размер файла / число слоев).
+        
+        Args:
+            kv_cache_type: Тип элементов KV-кэша (ключ _KV_CACHE_GGML_TYPES)
+        
+        Returns:
+            int: Число слоев для n_gpu_layers (все слои, если VRAM узнать нельзя
+            или часть тензоров слоя остается на CPU - тогда число уточняется
+            пробной загрузкой)
+        """
+        from .hardware_optimizer import _KV_CACHE_TYPE_BYTES
+        
+        layout = self._model_layout()
+        if layout is None:
+            return -1
+        n_layers, n_embd_kv = layout
+        
+        free_vram = self._free_vram_bytes()
+        if free_vram is None:
+            return n_layers + 1  # llama.cpp считает выходной слой отдельно
+        if self.config.get("override_tensor_regex") and _llama_accepts("override_tensor"):
+            # Оценка считает слои целиком, а без тензоров FFN, оставленных на CPU,
+            # слой намного меньше: начинаем со всех слоев и уменьшаем при нехватке VRAM
+            return n_layers + 1
+        
+        kv_bytes = (2 * self.config.get("n_ctx", 4096) * n_layers * n_embd_kv
+                    * _KV_CACHE_TYPE_BYTES[kv_cache_type])
+        
+        usable = free_vram * _GPU_FREE_VRAM_FRACTION - kv_bytes - _GPU_CONTEXT_RESERVE_BYTES
+        layer_bytes = os.path.getsize(self.model_path) / n_layers
+        n_gpu_layers = max(0, min(n_layers + 1, int(usable / layer_bytes)))
+        logger.info(f"Свободно VRAM: {free_vram / 2**20:.0f} МБ, KV-кэш: {kv_bytes / 2**20:.0f} МБ, "
+                    f"оценка gpu_layers={n_gpu_layers}/{n_layers + 1}")
+        return n_gpu_layers
+    
+    def _init_tokenizer(self) -> None:
+        """Находит дескриптор словаря для llama_tokenize в установленной версии биндингов."""
+        try:
+            vocab = self.model.model
+            # С llama.cpp b4400 токенизатор принимает словарь, а не модель
+            if hasattr(llama_cpp, "llama_model_get_vocab"):
+                vocab = llama_cpp.llama_model_get_vocab(vocab)
+            self._vocab = vocab
+        except Exception as e:
+            logger.warning("Нативный токенизатор недоступен, используем Llama.tokenize: %s", e)
+            self._vocab = None
+    
+    def _init_chat_template(self) -> None:
+        """Токенизирует BOS и маркеры стандартных ролей один раз после загрузки модели."""
+        self._bos_tokens = self._tokenize_bytes(b"", add_bos=True)
+        self._role_tokens = {}
+        for role in ("system", "user", "assistant"):
+            self._role_marker(role)
+    
+    def _role_marker(self, role: str) -> List[int]:
+        """Возвращает токены маркера роли "<|role|>\\n" (для нестандартных ролей - с кэшированием)."""
+        tokens = self._role_tokens.get(role)
+        if tokens is None:
+            tokens = self._tokenize_bytes(f"<|{role}|>\n".encode('utf-8'), add_bos=False, special=True)
+            self._role_tokens[role] = tokens
+        return tokens
+    
+    def _native_tokenize(self, data: bytes, capacity: int, add_bos: bool = True,
+                         special: bool = False) -> int:
+        """
+        Токенизирует data в буфер текущего потока.
+        
+        Args:
+            data: Текст в UTF-8
+            capacity: Число токенов, которые можно записать (0 - только подсчет)
+            add_bos: Добавлять ли токен начала последовательности
+            special: Разбирать ли в тексте специальные токены (<|user|> и т.п.)
+            
+        Returns:
+            int: Число токенов; отрицательное, если буфер мал (-требуемый размер)
+        """
+        buffer = self._token_buffer(capacity)
+        return llama_cpp.llama_tokenize(self._vocab, data, len(data), buffer, capacity, add_bos, special)
+    
+    def _tokenize_bytes(self, data: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        """Токенизирует текст в UTF-8 без self.lock: токенизатор не трогает KV-кэш."""
+        if self._vocab is None:
+            return self.model.tokenize(data, add_bos=add_bos, special=special)
+        
+        n_tokens = self._native_tokenize(data, len(self._token_buffer(0)), add_bos, special)
+        if n_tokens < 0:
+            n_tokens = self._native_tokenize(data, -n_tokens, add_bos, special)
+        return self._token_buffers.buffer[:n_tokens]
+    
+    def _token_buffer(self, n_tokens: int):
+        """Возвращает буфер текущего потока емкостью не меньше n_tokens (с геометрическим ростом)."""
+        buffer = getattr(self._token_buffers, "buffer", None)
+        if buffer is None or len(buffer) < n_tokens:
+            size = max(_TOKEN_BUFFER_SIZE, len(buffer) if buffer is not None else 0)
+            while size < n_tokens:
+                size *= 2
+            buffer = (llama_cpp.llama_token * size)()
+            self._token_buffers.buffer = buffer
+        return buffer
+    
+    def _bind_stubs(self) -> None:
+        """Подменяет на экземпляре методы модели заглушками (модель не загружена)."""
+        for name in _MODEL_METHODS:
+            setattr(self, name, getattr(self, f"_{name}_stub"))
+    
+    def _bind_model(self) -> None:
+        """
+        Снимает заглушки после загрузки модели.
+        
+        Проверка "загружена ли модель" выполняется один раз здесь, а не при
+        каждом вызове: методы класса работают с моделью без проверок.
+        """
+        for name in _MODEL_METHODS:
+            self.__dict__.pop(name, None)
+    
+    def _generate_stub(self, prompt: Union[str, List[int]], **kwargs) -> LLMResponse:
+        logger.warning("LLamaLLM.generate вызван, но модель не загружена. Возвращаем заглушку.")
+        return LLMResponse(
+            text="[Эта функция недоступна, так как llama.cpp не установлен или модель не загружена]",
+            metadata={"dummy": True, "elapsed_time": 0.0}
+        )
+    
+    def _chat_stub(self, messages: List[Dict[str, str]], **kwargs) -> LLMResponse:
+        logger.warning("LLamaLLM.chat вызван, но модель не загружена. Возвращаем заглушку.")
+        return LLMResponse(
+            text="[Эта функция недоступна, так как llama.cpp не установлен или модель не загружена]",
+            metadata={"dummy": True, "elapsed_time": 0.0}
+        )
+    
+    def _get_embeddings_stub(self, texts: List[str],
+                             return_numpy: bool = False) -> Union[List[List[float]], np.ndarray]:
+        logger.warning("LLamaLLM.get_embeddings вызван, но модель не загружена. Возвращаем заглушку.")
+        return self._zero_embeddings(len(texts), return_numpy)
+    
+    def _zero_embeddings(self, count: int,
+                         return_numpy: bool = False) -> Union[List[List[float]], np.ndarray]:
+        """
+        Возвращает count нулевых векторов размерности n_embd модели.
+        
+        Args:
+            count: Число векторов
+            return_numpy: Вернуть матрицу float32 вместо списков
+            
+        Returns:
+            Union[List[List[float]], np.ndarray]: Нулевые векторы; каждый список -
+            отдельный объект, а не ссылки на один и тот же
+        """
+        dim = _DEFAULT_EMBEDDING_DIM
+        if self.model is not None:
+            try:
+                dim = self.model.n_embd()
+            except Exception as e:
+                logger.debug("Не удалось получить n_embd модели: %s", e)
+        if return_numpy:
+            return np.zeros((count, dim), dtype=np.float32)
+        return [[0.0] * dim for _ in range(count)]
+    
+    def _tokenize_stub(self, text: str) -> List[int]:
+        logger.warning("LLamaLLM.tokenize вызван, но модель не загружена. Возвращаем заглушку.")
+        return list(range(len(text) // 4 + 1))
+    
+    def _detokenize_stub(self, tokens: List[int]) -> str:
+        logger.warning("LLamaLLM.detokenize вызван, но модель не загружена. Возвращаем заглушку.")
+        return ""
+    
+    def _count_tokens_stub(self, text: str) -> int:
+        logger.warning("LLamaLLM.count_tokens вызван, но модель не загружена. Возвращаем заглушку.")
+        return len(text) // 4 + 1
+    
+    def _get_max_context_length_stub(self) -> int:
+        logger.warning("LLamaLLM.get_max_context_length вызван, но модель не загружена. Возвращаем заглушку.")
+        return 4096
+    
+    def generate(self, prompt: Union[str, List[int]], **kwargs) -> LLMResponse:
         """
         Генерирует ответ на основе промпта.
         
         Args:
-            prompt: Текстовый промпт для генерации
+            prompt: Текстовый промпт для генерации или уже токенизированный промпт
             **kwargs: Дополнительные параметры генерации:
                 - max_tokens: Максимальное количество токенов (по умолчанию 256)
                 - temperature: Температура сэмплирования (по умолчанию 0.7)
@@ -145,38 +775,37 @@ class LLamaLLM(LLMInterface):
         Returns:
             LLMResponse: Объект с ответом и метаданными
         """
-        if not LLAMA_CPP_AVAILABLE or not self.model:
-            logger.warning("LLamaLLM.generate вызван, но модель не загружена. Возвращаем заглушку.")
-            return LLMResponse(
-                text="[Эта функция недоступна, так как llama.cpp не установлен или модель не загружена]",
-                metadata={"dummy": True, "elapsed_time": 0.0}
-            )
-            
-        # Параметры генерации
-        params = {
-            "max_tokens": kwargs.get("max_tokens", 256),
-            "temperature": kwargs.get("temperature", 0.7),
-            "top_p": kwargs.get("top_p", 0.95),
-            "top_k": kwargs.get("top_k", 40),
-            "repeat_penalty": kwargs.get("repeat_penalty", 1.1),
-            "echo": kwargs.get("echo", False),
-            "stream": kwargs.get("stream", False),
-            "stop": kwargs.get("stop", [])
-        }
+        # Параметры генерации (словарь не изменяется: он может быть общим _DEFAULT_PARAMS_DICT)
+        if kwargs:
+            params = asdict(GenerationParams(
+                **{name: value for name, value in kwargs.items() if name in _GENERATION_PARAM_NAMES}))
+        else:
+            params = _DEFAULT_PARAMS_DICT
             
         try:
             start_time = time.time()
             
-            with self.lock:  # Блокируем доступ к модели для потоков
-                # Потоковая генерация
+            # Промпт токенизируется один раз: create_completion принимает токены,
+            # а их число нужно для оценки tokens_used без повторной токенизации
+            if isinstance(prompt, str):
+                prompt = self._tokenize_bytes(prompt.encode('utf-8'), special=True)
+            
+            if self._batcher is not None and not params["echo"]:
+                # Запрос декодируется вместе с другими в фоновом потоке планировщика
                 if params["stream"]:
                     return self._generate_stream(prompt, params)
-                
-                # Синхронная генерация
-                completion = self.model.create_completion(
-                    prompt=prompt,
-                    **params
-                )
+                completion = self._batcher.submit(prompt, params).result()
+            else:
+                with self.lock:  # Блокируем доступ к модели для потоков
+                    # Потоковая генерация
+                    if params["stream"]:
+                        return self._generate_stream(prompt, params)
+                    
+                    # Синхронная генерация
+                    completion = self.model.create_completion(
+                        prompt=prompt,
+                        **params
+                    )
                 
             generated_text = completion["choices"][0]["text"]
             elapsed_time = time.time() - start_time
@@ -187,12 +816,12 @@ class LLamaLLM(LLMInterface):
                 tokens_used = completion["usage"].get("total_tokens", 0)
             else:
                 # Примерная оценка использованных токенов
-                tokens_used = self.count_tokens(prompt) + self.count_tokens(generated_text)
+                tokens_used = len(prompt) + self.count_tokens(generated_text)
             
             return LLMResponse(
                 text=generated_text,
                 metadata={
-                    "model": os.path.basename(self.model_path),
+                    "model": self._model_basename,
                     "elapsed_time": elapsed_time,
                     "tokens_used": tokens_used,
                     "finish_reason": completion["choices"][0].get("finish_reason", None)
@@ -200,13 +829,13 @@ class LLamaLLM(LLMInterface):
             )
             
         except Exception as e:
-            logger.error(f"Ошибка при генерации текста: {e}")
+            logger.error("Ошибка при генерации текста: %s", e)
             return LLMResponse(
                 text=f"[Ошибка генерации: {str(e)}]",
                 metadata={"error": str(e), "elapsed_time": time.time() - start_time}
             )
     
-    def _generate_stream(self, prompt: str, params: Dict[str, Any]) -> Generator[LLMResponse, None, None]:
+    def _generate_stream(self, prompt: Union[str, List[int]], params: Dict[str, Any]) -> Generator[LLMResponse, None, None]:
         """
         Реализация потоковой генерации текста.
         
@@ -215,29 +844,28 @@ class LLamaLLM(LLMInterface):
             params: Параметры генерации
             
         Yields:
-            LLMResponse: Последовательные объекты с частями ответа
+            LLMResponse: Части ответа; каждая часть - отдельный объект
         """
-        # Включаем потоковую генерацию
-        params["stream"] = True
         start_time = time.time()
+        model_name = self._model_basename
         
         try:
-            for chunk in self.model.create_completion(prompt=prompt, **params):
-                chunk_text = chunk["choices"][0]["text"]
-                elapsed_time = time.time() - start_time
-                
+            if self._batcher is not None and not params["echo"]:
+                chunks = self._batcher.stream(prompt, params)
+            else:
+                chunks = self.model.create_completion(prompt=prompt, **params)
+            
+            for chunk in chunks:
+                choice = chunk["choices"][0]
+                # LLMResponse со __slots__ и литерал словаря - дешевые аллокации
                 yield LLMResponse(
-                    text=chunk_text,
-                    metadata={
-                        "model": os.path.basename(self.model_path),
-                        "elapsed_time": elapsed_time,
-                        "chunk": True,
-                        "finish_reason": chunk["choices"][0].get("finish_reason", None)
-                    }
+                    text=choice["text"],
+                    metadata={"model": model_name, "elapsed_time": time.time() - start_time,
+                              "chunk": True, "finish_reason": choice.get("finish_reason")}
                 )
                 
         except Exception as e:
-            logger.error(f"Ошибка при потоковой генерации текста: {e}")
+            logger.error("Ошибка при потоковой генерации текста: %s", e)
             yield LLMResponse(
                 text=f"[Ошибка генерации: {str(e)}]",
                 metadata={"error": str(e), "elapsed_time": time.time() - start_time}
@@ -254,83 +882,129 @@ class LLamaLLM(LLMInterface):
         Returns:
             LLMResponse: Объект с ответом и метаданными
         """
-        if not LLAMA_CPP_AVAILABLE or not self.model:
-            logger.warning("LLamaLLM.chat вызван, но модель не загружена. Возвращаем заглушку.")
-            return LLMResponse(
-                text="[Эта функция недоступна, так как llama.cpp не установлен или модель не загружена]",
-                metadata={"dummy": True, "elapsed_time": 0.0}
-            )
-            
         try:
-            # Преобразуем сообщения в формат, понятный llama.cpp
-            prompt = self._messages_to_prompt(messages)
+            # Токенизируем только новые сообщения: при совпадающих токенах
+            # префикса llama.cpp не пересчитывает его KV
+            prompt_tokens = self._messages_to_tokens(messages)
             
-            return self.generate(prompt, **kwargs)
+            return self.generate(prompt_tokens, **kwargs)
             
         except Exception as e:
-            logger.error(f"Ошибка в методе chat: {e}")
+            logger.error("Ошибка в методе chat: %s", e)
             return LLMResponse(
                 text=f"[Ошибка в методе chat: {str(e)}]",
                 metadata={"error": str(e)}
             )
     
-    def _messages_to_prompt(self, messages: List[Dict[str, str]]) -> str:
+    def _messages_to_tokens(self, messages: List[Dict[str, str]]) -> List[int]:
         """
-        Преобразует список сообщений в формат промпта.
+        Преобразует список сообщений в токены промпта.
+        
+        Промпт собирается сразу из токенов: BOS, затем для каждого сообщения
+        заранее токенизированный маркер роли и токены текста, в конце маркер
+        ответа ассистента. Текст сообщений токенизируется без разбора
+        специальных токенов. Сообщения токенизируются по отдельности, и токены начала истории,
+        совпадающего с предыдущим вызовом, берутся из _chat_prefix. Поэтому
+        каждый ход диалога токенизирует только добавленные сообщения, а токены
+        истории совпадают с уже лежащими в KV-кэше.
         
         Args:
             messages: Список сообщений
             
         Returns:
-            str: Промпт для модели
+            List[int]: Токены промпта для модели
         """
-        result = []
+        keys = [(msg.get("role", "").lower(), msg.get("content", "")) for msg in messages]
         
-        for msg in messages:
-            role = msg.get("role", "").lower()
-            content = msg.get("content", "")
-            
-            if role == "system":
-                result.append(f"<|system|>\n{content}\n")
-            elif role == "user":
-                result.append(f"<|user|>\n{content}\n")
-            elif role == "assistant":
-                result.append(f"<|assistant|>\n{content}\n")
-            else:
-                result.append(f"<|{role}|>\n{content}\n")
+        with self.lock:
+            cached = self._chat_prefix
+        
+        segments = []
+        for i, key in enumerate(keys):
+            if i < len(cached) and cached[i][0] == key:
+                segments.append(cached[i])
+                continue
+            role, content = key
+            segment = self._role_marker(role) + self._tokenize_bytes(f"{content}\n".encode('utf-8'), add_bos=False)
+            segments.append((key, segment))
         
-        # Add маркер для ответа ассистента
-        result.append("<|assistant|>\n")
+        with self.lock:
+            self._chat_prefix = segments
         
-        return "".join(result)
+        tokens = list(self._bos_tokens)
+        for _, segment in segments:
+            tokens.extend(segment)
+        tokens.extend(self._role_marker("assistant"))
+        return tokens
     
-    def get_embeddings(self, texts: List[str]) -> List[List[float]]:
+    def get_embeddings(self, texts: List[str],
+                       return_numpy: bool = False) -> Union[List[List[float]], np.ndarray]:
         """
         Получает эмбеддинги для списка текстов.
         
         Args:
             texts: Список текстов для эмбеддинга
+            return_numpy: Вернуть матрицу float32 вместо списков (без упаковки
+                каждого числа в объект float)
             
         Returns:
-            List[List[float]]: Список векторов эмбеддингов
+            Union[List[List[float]], np.ndarray]: Список векторов эмбеддингов или
+            матрица формы (len(texts), n_embd) при return_numpy
         """
-        if not LLAMA_CPP_AVAILABLE or not self.model:
-            logger.warning("LLamaLLM.get_embeddings вызван, но модель не загружена. Возвращаем заглушку.")
-            return [[0.0] * 768] * len(texts)
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32) if return_numpy else []
             
         try:
-            embeddings = []
+            pool = self._embed_pool if self._embed_pool is not None else self._ensure_embed_pool()
+            if pool is not None:
+                # Свой контекст из пула: параллельно с генерацией и другими вызовами.
+                # Векторы копируются из буфера llama.cpp прямо в матрицу numpy
+                tokens = [self._tokenize_bytes(text.encode('utf-8')) for text in texts]
+                embeddings = pool.embed(tokens)
+                return embeddings if return_numpy else embeddings.tolist()
             
+            # Один вызов на весь список: llama.cpp упаковывает тексты в пакеты
+            # по n_batch токенов, и веса читаются один раз на пакет, а не на текст
             with self.lock:  # Защищаем доступ к модели
-                for text in texts:
-                    embedding = self.model.embed(text)
-                    embeddings.append(embedding)
-                    
-            return embeddings
+                try:
+                    result = self.model.create_embedding(input=texts)
+                    data = sorted(result["data"], key=lambda item: item["index"])
+                    embeddings = [item["embedding"] for item in data]
+                except Exception as e:
+                    logger.warning("Пакетный расчет эмбеддингов не удался (%s), считаем по одному тексту", e)
+                    embeddings = [self.model.embed(text) for text in texts]
+            return np.asarray(embeddings, dtype=np.float32) if return_numpy else embeddings
             
         except Exception as e:
-            logger.error(f"Ошибка при получении эмбеддингов: {e}")
-            return [[0.0] * 768] * len(texts)
+            logger.error("Ошибка при получении эмбеддингов: %s", e)
+            return self._zero_embeddings(len(texts), return_numpy)
+    
+    def _ensure_embed_pool(self) -> Optional["EmbeddingContextPool"]:
+        """
+        Создает пул контекстов эмбеддингов при первом обращении.
+        
+        Returns:
+            Optional[EmbeddingContextPool]: Пул или None, если он отключен или не создался
+            (тогда эмбеддинги считаются в основном контексте)
+        """
+        if self._embed_contexts <= 0:
+            return None
+        
+        from .llama_batch import EmbeddingContextPool
+        
+        with self.lock:
+            if self._embed_pool is None and self._embed_contexts > 0:
+                try:
+                    self._embed_pool = EmbeddingContextPool(
+                        self.model,
+                        n_contexts=self._embed_contexts,
+                        n_ctx=self.config.get("embedding_n_ctx", 2048)
+                    )
+                except Exception as e:
+                    # Генерация работает и без пула; эмбеддинги - только при embedding=True
+                    logger.warning("Пул контекстов эмбеддингов не создан: %s", e)
+                    self._embed_contexts = 0
+            return self._embed_pool
     
     def tokenize(self, text: str) -> List[int]:
         """
@@ -342,16 +1016,11 @@ class LLamaLLM(LLMInterface):
         Returns:
             List[int]: Список идентификаторов токенов
         """
-        if not LLAMA_CPP_AVAILABLE or not self.model:
-            logger.warning("LLamaLLM.tokenize вызван, но модель не загружена. Возвращаем заглушку.")
-            return list(range(len(text) // 4 + 1))
-            
         try:
-            tokens = self.model.tokenize(text.encode('utf-8'))
-            return tokens
+            return self._tokenize_bytes(text.encode('utf-8'))
             
         except Exception as e:
-            logger.error(f"Ошибка при токенизации: {e}")
+            logger.error("Ошибка при токенизации: %s", e)
             return []
     
     def detokenize(self, tokens: List[int]) -> str:
@@ -364,16 +1033,12 @@ class LLamaLLM(LLMInterface):
         Returns:
             str: Декодированный текст
         """
-        if not LLAMA_CPP_AVAILABLE or not self.model:
-            logger.warning("LLamaLLM.detokenize вызван, но модель не загружена. Возвращаем заглушку.")
-            return ""
-            
         try:
             text = self.model.detokenize(tokens).decode('utf-8')
             return text
             
         except Exception as e:
-            logger.error(f"Ошибка при детокенизации: {e}")
+            logger.error("Ошибка при детокенизации: %s", e)
             return ""
     
     def count_tokens(self, text: str) -> int:
@@ -386,18 +1051,30 @@ class LLamaLLM(LLMInterface):
         Returns:
             int: Количество токенов
         """
-        if not LLAMA_CPP_AVAILABLE or not self.model:
-            logger.warning("LLamaLLM.count_tokens вызван, но модель не загружена. Возвращаем заглушку.")
-            return len(text) // 4 + 1
-            
         try:
-            tokens = self.tokenize(text)
-            return len(tokens)
+            if self._vocab is None:
+                return len(self.tokenize(text))
+            
+            # С нулевой емкостью llama_tokenize ничего не пишет и возвращает
+            # -число токенов: список идентификаторов не создается
+            return abs(self._native_tokenize(text.encode('utf-8'), 0))
             
         except Exception as e:
-            logger.error(f"Ошибка при подсчете токенов: {e}")
+            logger.error("Ошибка при подсчете токенов: %s", e)
             return 0
     
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """
+        Подсчитывает количество токенов для списка текстов.
+        
+        Args:
+            texts: Тексты для подсчета токенов
+            
+        Returns:
+            List[int]: Количество токенов для каждого текста
+        """
+        return [self.count_tokens(text) for text in texts]
+    
     def get_max_context_length(self) -> int:
         """
         Возвращает максимальную длину контекста для модели.
@@ -405,18 +1082,17 @@ class LLamaLLM(LLMInterface):
         Returns:
             int: Максимальная длина контекста в токенах
         """
-        if not LLAMA_CPP_AVAILABLE or not self.model:
-            logger.warning("LLamaLLM.get_max_context_length вызван, но модель не загружена. Возвращаем заглушку.")
-            return 4096
-            
-        try:
-            return self.model.n_ctx()
-            
-        except Exception as e:
-            logger.error(f"Ошибка при получении максимальной длины контекста: {e}")
-            return 4096
+        return self._n_ctx
     
     def shutdown(self) -> None:
         """Освобождает ресурсы модели."""
         logger.info("LLamaLLM.shutdown вызван")
-        self.model = None
\ No newline at end of file
+        if self._batcher is not None:
+            self._batcher.close()
+            self._batcher = None
+        self._embed_contexts = 0
+        if self._embed_pool is not None:
+            self._embed_pool.close()
+            self._embed_pool = None
+        self.model = None
+        self._bind_stubs()
\ No newline at end of file
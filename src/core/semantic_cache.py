@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+GC-Forged Pylot - Semantic Response Cache
+=========================================
+
+Query-level cache of LLM responses: a request whose prompt embedding is
+close enough to a recent one returns the stored response without decoding.
+
+Author: GC-Forged Pylot Team
+Date: 2025
+License: MIT
+"""
+
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import hnswlib
+    HAS_HNSWLIB = True
+except ImportError:
+    HAS_HNSWLIB = False
+
+try:
+    from numba import njit
+    HAS_NUMBA = True
+except ImportError:
+    HAS_NUMBA = False
+
+logger = logging.getLogger(__name__)
+
+# Оценка для свободных слотов: ниже любой косинусной близости. Конечное
+# значение, а не -inf: ядро numba собирается с fastmath (без inf/nan)
+_EMPTY_SCORE = -2.0
+
+# Число кандидатов на запрос: ближайшая запись может относиться к другому
+# контексту, а за ней - подходящая
+_SEARCH_K = 8
+
+
+if HAS_NUMBA:
+    @njit(cache=True, fastmath=True)
+    def _cosine_scores(query: np.ndarray, bank: np.ndarray, valid: np.ndarray) -> np.ndarray:
+        """
+        Скалярные произведения query со строками bank (строки единичной длины).
+        
+        Ядро однопоточное: пул потоков numba (TBB/OpenMP) не переживает fork(),
+        а перебор max_entries строк на нем не выигрывает.
+        """
+        scores = np.empty(bank.shape[0], dtype=np.float32)
+        for i in range(bank.shape[0]):
+            if valid[i]:
+                total = np.float32(0.0)
+                for j in range(bank.shape[1]):
+                    total += bank[i, j] * query[j]
+                scores[i] = total
+            else:
+                scores[i] = _EMPTY_SCORE
+        return scores
+else:
+    def _cosine_scores(query: np.ndarray, bank: np.ndarray, valid: np.ndarray) -> np.ndarray:
+        """Скалярные произведения query со строками bank (строки единичной длины)."""
+        scores = bank @ query
+        scores[~valid] = _EMPTY_SCORE
+        return scores
+
+
+def _cosine_topk(query: np.ndarray, bank: np.ndarray, valid: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Находит k строк bank, ближайших к query по косинусу.
+    
+    Args:
+        query: Нормированный вектор запроса float32
+        bank: Матрица нормированных векторов float32
+        valid: Маска занятых строк bank
+        k: Число ближайших строк
+        
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: Индексы строк и их близость, по убыванию близости
+    """
+    scores = _cosine_scores(query, bank, valid)
+    k = min(k, len(scores))
+    top = np.argpartition(scores, -k)[-k:]
+    top = top[np.argsort(scores[top])[::-1]]
+    return top, scores[top]
+
+
+class SemanticResponseCache:
+    """
+    Кэш ответов по семантической близости запросов.
+    
+    Эмбеддинги запросов хранятся в ANN-индексе hnswlib (space="cosine"),
+    без hnswlib - в матрице numpy с полным перебором (для нескольких тысяч
+    записей это одно матричное умножение; с numba - скомпилированное ядро). Каждая запись занимает слот
+    индекса под собственной меткой; метки только растут и не переиспользуются,
+    а освободившееся место в индексе занимает следующая запись. При
+    заполнении вытесняется запись, к которой дольше всего не обращались (LRU).
+    """
+    
+    def __init__(self, threshold: float = 0.92, max_entries: int = 1024,
+                 ttl_seconds: Optional[float] = None):
+        """
+        Инициализирует кэш.
+        
+        Args:
+            threshold: Минимальная косинусная близость для попадания в кэш
+            max_entries: Максимальное число записей
+            ttl_seconds: Время жизни записи в секундах (None - без ограничения)
+        """
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        # метка -> (контекст, ответ, время добавления); порядок - от давних обращений к недавним
+        self._entries: "OrderedDict[int, Tuple[str, Any, float]]" = OrderedDict()
+        self._next_label = 0
+        self._dim = None
+        self._index = None
+        self._vectors = None
+        self._valid = None
+        # Без hnswlib: строка матрицы для метки, метка для строки и свободные строки
+        self._rows: Dict[int, int] = {}
+        self._row_labels = None
+        self._free_rows: List[int] = []
+        
+        logger.info(f"Семантический кэш ответов: порог {threshold}, до {self.max_entries} записей, "
+                    f"{'hnswlib' if HAS_HNSWLIB else 'numpy'}")
+    
+    def _init_storage(self, dim: int) -> None:
+        """Создает индекс под размерность первого эмбеддинга."""
+        self._dim = dim
+        if HAS_HNSWLIB:
+            self._index = hnswlib.Index(space="cosine", dim=dim)
+            self._index.init_index(max_elements=self.max_entries, ef_construction=100, M=16,
+                                   allow_replace_deleted=True)
+            self._index.set_ef(32)
+        else:
+            self._vectors = np.zeros((self.max_entries, dim), dtype=np.float32)
+            self._valid = np.zeros(self.max_entries, dtype=bool)
+            self._row_labels = np.full(self.max_entries, -1, dtype=np.int64)
+            self._rows = {}
+            self._free_rows = list(range(self.max_entries - 1, -1, -1))
+    
+    def _candidates(self, vector: np.ndarray) -> List[Tuple[int, float]]:
+        """Возвращает метки ближайших записей и близость к ним, по убыванию близости."""
+        k = min(_SEARCH_K, len(self._entries))
+        if self._index is not None:
+            labels, distances = self._index.knn_query(vector, k=k)
+            return [(int(label), 1.0 - float(distance)) for label, distance in zip(labels[0], distances[0])]
+        rows, similarities = _cosine_topk(vector, self._vectors, self._valid, k=k)
+        return [(int(self._row_labels[row]), float(similarity))
+                for row, similarity in zip(rows, similarities) if self._valid[row]]
+    
+    def _remove(self, label: int) -> None:
+        """Удаляет запись из индекса; ее место занимает следующая запись."""
+        del self._entries[label]
+        if self._index is not None:
+            self._index.mark_deleted(label)
+        else:
+            row = self._rows.pop(label)
+            self._valid[row] = False
+            self._row_labels[row] = -1
+            self._free_rows.append(row)
+    
+    @staticmethod
+    def _normalize(embedding: np.ndarray) -> Optional[np.ndarray]:
+        """Приводит вектор к единичной длине; None для нулевого вектора (ошибка эмбеддинга)."""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0.0 else None
+    
+    def get(self, embedding: np.ndarray, context: str = "") -> Optional[Tuple[Any, float]]:
+        """
+        Ищет ответ на семантически близкий запрос.
+        
+        Args:
+            embedding: Эмбеддинг запроса
+            context: Условия, при которых ответ переиспользуем (модель, параметры)
+        
+        Returns:
+            Optional[Tuple[Any, float]]: Сохраненный ответ и близость или None
+        """
+        vector = self._normalize(embedding)
+        with self._lock:
+            if vector is None or not self._entries or len(vector) != self._dim:
+                return None
+            
+            for label, similarity in self._candidates(vector):
+                if similarity < self.threshold:
+                    break
+                entry = self._entries.get(label)
+                if entry is None or entry[0] != context:
+                    continue
+                if self.ttl_seconds is not None and time.time() - entry[2] > self.ttl_seconds:
+                    self._remove(label)
+                    continue
+                
+                self._entries.move_to_end(label)
+                return entry[1], similarity
+            return None
+    
+    def put(self, embedding: np.ndarray, response: Any, context: str = "") -> None:
+        """
+        Сохраняет ответ на запрос.
+        
+        Args:
+            embedding: Эмбеддинг запроса
+            response: Ответ для переиспользования
+            context: Условия, при которых ответ переиспользуем (модель, параметры)
+        """
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        
+        with self._lock:
+            if self._dim is None:
+                self._init_storage(len(vector))
+            elif len(vector) != self._dim:
+                return
+            
+            if len(self._entries) >= self.max_entries:
+                # Вытесняем запись, к которой дольше всего не обращались
+                self._remove(next(iter(self._entries)))
+            
+            label = self._next_label
+            self._next_label += 1
+            if self._index is not None:
+                self._index.add_items(vector[np.newaxis, :], np.array([label]), replace_deleted=True)
+            else:
+                row = self._free_rows.pop()
+                self._vectors[row] = vector
+                self._valid[row] = True
+                self._row_labels[row] = label
+                self._rows[label] = row
+            self._entries[label] = (context, response, time.time())
+    
+    def clear(self) -> None:
+        """Удаляет все записи."""
+        with self._lock:
+            self._entries.clear()
+            if self._dim is not None:
+                self._init_storage(self._dim)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
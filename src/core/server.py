@@ -22,7 +22,7 @@ try:
 except ImportError:
     FASTAPI_AVAILABLE = False
 
-from .llm_llama_cpp import LLamaLLM, LLAMA_CPP_AVAILABLE
+from .llm_llama_cpp import LLamaLLM, _check_llama_cpp
 from .llm_interface import LLMResponse
 
 # Correct import of class from llm_external.py
@@ -216,6 +216,11 @@ class LlamaServer:
             avail_memory = psutil.virtual_memory().available / (1024 * 1024 * 1024)
             logger.info(f"Available system memory: {avail_memory:.2f} GB")
 
+            # llama_cpp is imported lazily: the shared library is loaded only when
+            # the local backend is actually used, not when this module is imported
+            if not _check_llama_cpp():
+                logger.warning("llama-cpp-python is not installed; the local model will run as a stub")
+
             model_config = self.config.copy()
 
             # Auto 4-bit quantization suggestion (informational; actual selection occurs in llama.cpp conversion stage)
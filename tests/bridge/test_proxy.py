@@ -0,0 +1,273 @@
+import os
+import asyncio
+import sys
+import threading
+
+import pytest
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.bridge import proxy
+
+
+# --- Sync retry policy ---
+
+def make_retry():
+    return proxy._SafeRetry(
+        total=3, connect=2, read=0, other=0, status=3,
+        status_forcelist=proxy._RETRY_STATUSES,
+        allowed_methods=frozenset(("GET", "POST")),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+
+
+@pytest.mark.parametrize("status", [500, 502, 504])
+def test_post_not_retried_on_server_errors(status):
+    assert not make_retry().is_retry("POST", status)
+    assert make_retry().is_retry("GET", status)
+
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_post_retried_when_server_rejected_request(status):
+    assert make_retry().is_retry("POST", status)
+
+
+def test_retry_policy_survives_increment():
+    assert isinstance(make_retry().new(), proxy._SafeRetry)
+
+
+# --- Async retry layer ---
+
+def scripted_proxy(outcomes):
+    client = proxy.AsyncExternalLLMProxy("http://127.0.0.1:9", connection_retries=3,
+                                         connection_retry_delay=0.0)
+    calls = []
+
+    async def fake_request(endpoint, method="POST", data=None):
+        calls.append(endpoint)
+        outcome = outcomes[min(len(calls), len(outcomes)) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    client._make_request = fake_request
+    return client, calls
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_async_retries_connect_failures():
+    client, calls = scripted_proxy([proxy._ConnectFailed("refused"), proxy._ConnectFailed("refused"), {"ok": 1}])
+    assert run(client._guarded_request("/completions", data={})) == {"ok": 1}
+    assert len(calls) == 3
+
+
+@pytest.mark.parametrize("error", [TimeoutError("read timeout"), ConnectionError("reset")])
+def test_async_does_not_retry_after_request_may_have_been_sent(error):
+    client, calls = scripted_proxy([error, {"ok": 1}])
+    with pytest.raises(type(error)):
+        run(client._guarded_request("/completions", data={}))
+    assert len(calls) == 1
+
+
+def test_async_retries_rejected_status_only():
+    client, calls = scripted_proxy([{"error": "busy", "status_code": 503, "retry_after": 0}, {"ok": 1}])
+    assert run(client._guarded_request("/completions", data={})) == {"ok": 1}
+    assert len(calls) == 2
+
+    client, calls = scripted_proxy([{"error": "boom", "status_code": 500}, {"ok": 1}])
+    assert run(client._guarded_request("/completions", data={}))["status_code"] == 500
+    assert len(calls) == 1
+
+
+def test_async_retries_stop_when_circuit_opens():
+    client, calls = scripted_proxy([proxy._ConnectFailed("refused")])
+    client.connection_retries = 10
+    assert run(client._guarded_request("/completions", data={})) == proxy._CIRCUIT_OPEN_ERROR
+    assert len(calls) == proxy._BREAKER_FAILURES
+
+
+# --- Stream chunk decoding ---
+
+decode = proxy.ExternalLLMProxy._decode_sse_payload
+
+
+def first_choice(chunk):
+    choices = chunk.get("choices")
+    return choices[0] if choices else {}
+
+
+@pytest.mark.parametrize("payload", [
+    b'{"id": "x", "choices": null, "usage": {"total_tokens": 5}}',
+    b'{"id": "x"}',
+    b'{"choices": []}',
+])
+def test_chunk_without_choices_decodes(payload):
+    chunk = decode(bytearray(payload), "test")
+    assert "error" not in chunk
+    assert first_choice(chunk) == {}
+
+
+def test_chunk_fields_read_like_dict():
+    chunk = decode(bytearray(b'{"choices": [{"delta": {"content": "Hi"}, "finish_reason": null}],'
+                             b' "created": 1}'), "test")
+    choice = first_choice(chunk)
+    assert choice["delta"]["content"] == "Hi"
+    assert choice.get("finish_reason") is None
+    assert choice.get("text", "") == ""
+
+
+def test_invalid_chunk_reports_decode_error():
+    chunk = decode(bytearray(b'{"choices": [tru'), "test")
+    assert chunk["error"] == "JSON decode error"
+
+
+# --- SSE framing ---
+
+STREAM = (b'data: {"n": 1}\n\n'
+          b': keep-alive comment\n\n'
+          b'event: message\nid: 7\ndata: {"n":\ndata: 2}\n\n'
+          b'data: {"n": 3}\n\n'
+          b'data: [DONE]\n\n')
+
+
+def parse_in_pieces(stream, size):
+    parser = proxy._SSEParser()
+    payloads = []
+    for start in range(0, len(stream), size):
+        payloads.extend(parser.feed(stream[start:start + size]))
+    payloads.extend(parser.flush())
+    return [bytes(payload) for payload in payloads]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 16, len(STREAM)])
+def test_sse_frames_split_across_chunks(size):
+    assert parse_in_pieces(STREAM, size) == [b'{"n": 1}', b'{"n":\n2}', b'{"n": 3}']
+
+
+@pytest.mark.parametrize("size", [1, 5, 1000])
+def test_sse_crlf_delimiters(size):
+    stream = STREAM.replace(b"\n", b"\r\n")
+    assert parse_in_pieces(stream, size) == [b'{"n": 1}', b'{"n":\n2}', b'{"n": 3}']
+
+
+def test_sse_last_frame_without_blank_line_is_flushed():
+    parser = proxy._SSEParser()
+    assert parser.feed(b'data: {"n": 1}\n\ndata: {"n": 2}\n') == [bytearray(b'{"n": 1}')]
+    assert parser.flush() == [bytearray(b'{"n": 2}')]
+    assert parser.flush() == []
+
+
+def test_sse_data_without_space():
+    assert parse_in_pieces(b'data:{"n": 1}\n\n', 4) == [b'{"n": 1}']
+
+
+# --- Circuit breaker ---
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(proxy.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = proxy._CircuitBreaker()
+    for _ in range(proxy._BREAKER_FAILURES - 1):
+        breaker.record_failure()
+        assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+
+def test_breaker_ignores_failures_outside_window(clock):
+    breaker = proxy._CircuitBreaker()
+    for _ in range(proxy._BREAKER_FAILURES - 1):
+        breaker.record_failure()
+    clock[0] += proxy._BREAKER_WINDOW + 1
+    breaker.record_failure()
+    assert breaker.allow()
+
+
+def test_breaker_success_resets_failure_count(clock):
+    breaker = proxy._CircuitBreaker()
+    for _ in range(proxy._BREAKER_FAILURES - 1):
+        breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.allow()
+
+
+def test_breaker_half_open_probe(clock):
+    breaker = proxy._CircuitBreaker()
+    for _ in range(proxy._BREAKER_FAILURES):
+        breaker.record_failure()
+    assert not breaker.allow()
+
+    # After the cooldown one probe is let through; a failed probe reopens
+    clock[0] += proxy._BREAKER_COOLDOWN
+    assert breaker.allow()
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    # A successful probe closes the circuit
+    clock[0] += proxy._BREAKER_COOLDOWN
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.allow()
+
+
+@pytest.mark.parametrize("result, opens", [
+    ({"error": "busy", "status_code": 503}, True),
+    ({"error": "bad request", "status_code": 400}, False),
+    ({"choices": []}, False),
+])
+def test_breaker_record_result(clock, result, opens):
+    breaker = proxy._CircuitBreaker()
+    for _ in range(proxy._BREAKER_FAILURES):
+        breaker.record_result(result)
+    assert breaker.allow() is not opens
+
+
+def test_breaker_admits_a_single_concurrent_probe(clock):
+    breaker = proxy._CircuitBreaker()
+    for _ in range(proxy._BREAKER_FAILURES):
+        breaker.record_failure()
+    clock[0] += proxy._BREAKER_COOLDOWN
+
+    barrier = threading.Barrier(2)
+    admitted = []
+
+    def request():
+        barrier.wait()
+        admitted.append(breaker.allow())
+
+    threads = [threading.Thread(target=request) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(admitted) == [False, True]
+    # Others keep getting circuit_open until the probe's result is recorded
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.allow() and breaker.allow()
+
+
+def test_breaker_retries_a_probe_whose_result_was_never_recorded(clock):
+    breaker = proxy._CircuitBreaker()
+    for _ in range(proxy._BREAKER_FAILURES):
+        breaker.record_failure()
+    clock[0] += proxy._BREAKER_COOLDOWN
+    assert breaker.allow()
+    assert not breaker.allow()
+    clock[0] += proxy._BREAKER_COOLDOWN
+    assert breaker.allow()
+    assert not breaker.allow()
@@ -0,0 +1,160 @@
+import os
+import sys
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.core import embedding_cache
+from src.core.embedding_cache import EmbeddingCache
+from src.core.llm_external import ExternalLLMAdapter
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "embeddings.db"))
+    yield cache
+    cache.close()
+
+
+def test_put_and_get_many(cache):
+    keys = [cache.key("alpha"), cache.key("beta")]
+    vectors = np.array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]], dtype=np.float32)
+    cache.put_many(keys, "model-a", vectors)
+
+    hits = cache.get_many(keys + [cache.key("gamma")], "model-a")
+    np.testing.assert_array_equal(hits[0], vectors[0])
+    np.testing.assert_array_equal(hits[1], vectors[1])
+    assert hits[2] is None
+    # Entries are scoped to the embedding model
+    assert cache.get_many(keys, "model-b") == [None, None]
+
+
+def test_duplicate_keys_and_replace(cache):
+    key = cache.key("same text")
+    cache.put_many([key], "m", np.array([[1.0, 1.0]], dtype=np.float32))
+    cache.put_many([key], "m", np.array([[2.0, 2.0]], dtype=np.float32))
+    hits = cache.get_many([key, key], "m")
+    np.testing.assert_array_equal(hits[0], [2.0, 2.0])
+    np.testing.assert_array_equal(hits[1], [2.0, 2.0])
+
+
+def test_expiry(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(embedding_cache.time, "time", lambda: now[0])
+    cache = EmbeddingCache(str(tmp_path / "ttl.db"), ttl_seconds=60)
+    key = cache.key("text")
+    cache.put_many([key], "m", np.ones((1, 4), dtype=np.float32))
+
+    now[0] += 30
+    assert cache.get_many([key], "m")[0] is not None
+    now[0] += 60
+    assert cache.get_many([key], "m")[0] is None
+    cache.close()
+
+
+def test_clear_and_persistence(tmp_path):
+    path = str(tmp_path / "persist.db")
+    cache = EmbeddingCache(path)
+    key = cache.key("text")
+    cache.put_many([key], "m", np.ones((1, 4), dtype=np.float32))
+    cache.close()
+
+    reopened = EmbeddingCache(path)
+    assert reopened.get_many([key], "m")[0] is not None
+    reopened.clear()
+    assert reopened.get_many([key], "m")[0] is None
+    reopened.close()
+
+
+def test_float16_storage_reads_back_in_requested_dtype(tmp_path):
+    path = str(tmp_path / "fp16.db")
+    half = EmbeddingCache(path, dtype=np.float16)
+    key = half.key("text")
+    half.put_many([key], "m", np.array([[0.5, -0.25]], dtype=np.float32))
+    half.close()
+
+    full = EmbeddingCache(path, dtype=np.float32)
+    vector = full.get_many([key], "m")[0]
+    assert vector.dtype == np.float32
+    np.testing.assert_array_equal(vector, [0.5, -0.25])
+    full.close()
+
+
+def test_adapter_serves_hits_from_cache_off_the_event_loop(monkeypatch):
+    adapter = ExternalLLMAdapter({"external_api": {"url": "http://127.0.0.1:9/v1",
+                                                   "embedding_cache_path": ":memory:"}})
+    cache = adapter._embedding_cache
+    loop_threads = []
+    cache_threads = []
+
+    async def fake_gather(texts, token_counts=None):
+        loop_threads.append(threading.current_thread())
+        return np.array([[float(len(text)), 1.0] for text in texts], dtype=np.float32)
+
+    for name in ("get_many", "put_many"):
+        original = getattr(cache, name)
+
+        def recorded(*args, _original=original):
+            cache_threads.append(threading.current_thread())
+            return _original(*args)
+
+        monkeypatch.setattr(cache, name, recorded)
+    monkeypatch.setattr(adapter, "_gather_embeddings", fake_gather)
+
+    try:
+        first = adapter._run_sync(adapter._cached_embeddings(["a", "bb"]))
+        requested = []
+
+        async def counting_gather(texts, token_counts=None):
+            requested.extend(texts)
+            return await fake_gather(texts)
+
+        monkeypatch.setattr(adapter, "_gather_embeddings", counting_gather)
+        second = adapter._run_sync(adapter._cached_embeddings(["bb", "ccc", "a"]))
+    finally:
+        adapter.shutdown()
+
+    np.testing.assert_array_equal(first, [[1.0, 1.0], [2.0, 1.0]])
+    np.testing.assert_array_equal(second, [[2.0, 1.0], [3.0, 1.0], [1.0, 1.0]])
+    assert requested == ["ccc"]
+    # SQLite work never runs on the shared event loop thread
+    assert cache_threads and loop_threads
+    assert all(thread is not loop_threads[0] for thread in cache_threads)
+
+
+def test_token_batches_are_counted_off_the_event_loop(monkeypatch):
+    adapter = ExternalLLMAdapter({"external_api": {"url": "http://127.0.0.1:9/v1",
+                                                   "embedding_batch_tokens": 5}})
+    adapter.connected = True
+    count_threads = []
+    batches = []
+
+    def count_tokens_many(texts):
+        count_threads.append(threading.current_thread())
+        return [len(text) for text in texts]
+
+    async def fake_embeddings(texts, model):
+        batches.append((list(texts), threading.current_thread()))
+        return {"data": [{"embedding": [float(len(text)), 1.0]} for text in texts]}
+
+    monkeypatch.setattr(adapter, "count_tokens_many", count_tokens_many)
+    monkeypatch.setattr(adapter.async_proxy, "generate_embeddings", fake_embeddings)
+
+    try:
+        embeddings = adapter.get_embeddings(["aa", "bbb", "cccc", "d"])
+        asynchronous = asyncio.run(adapter.aget_embeddings(["aa", "bbb"]))
+    finally:
+        adapter.shutdown()
+
+    np.testing.assert_array_equal(embeddings, [[2.0, 1.0], [3.0, 1.0], [4.0, 1.0], [1.0, 1.0]])
+    np.testing.assert_array_equal(asynchronous, [[2.0, 1.0], [3.0, 1.0]])
+    assert [texts for texts, _ in batches] == [["aa", "bbb"], ["cccc", "d"], ["aa", "bbb"]]
+    loop_thread = batches[0][1]
+    assert len(count_threads) == 2
+    assert all(thread is not loop_thread for thread in count_threads)
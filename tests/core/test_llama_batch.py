@@ -0,0 +1,188 @@
+import os
+import sys
+import ctypes
+import random
+import types
+
+import numpy as np
+import pytest
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.core import llama_batch
+
+# A tiny deterministic "model": after token t the most likely next token is
+# (t + 1) % N_VOCAB; token EOS ends generation.
+N_VOCAB = 10
+EOS = 9
+N_EMBD = 2
+
+
+class FakeBatch:
+    def __init__(self, n_tokens):
+        self.token = [0] * n_tokens
+        self.pos = [0] * n_tokens
+        self.n_seq_id = [0] * n_tokens
+        self.seq_id = [[0] for _ in range(n_tokens)]
+        self.logits = [False] * n_tokens
+        self.n_tokens = 0
+
+
+class FakeContext:
+    def __init__(self, params):
+        self.params = params
+        self.rows = {}
+        self.embeddings = {}
+
+
+def make_binding(pooling=0):
+    binding = types.SimpleNamespace()
+    binding.LLAMA_POOLING_TYPE_NONE = 0
+    binding.LLAMA_POOLING_TYPE_MEAN = 1
+    binding.contexts = []
+
+    def new_context(model, params):
+        ctx = FakeContext(params)
+        binding.contexts.append(ctx)
+        return ctx
+
+    def decode(ctx, batch):
+        ctx.rows = {}
+        tokens_by_seq = {}
+        for i in range(batch.n_tokens):
+            tokens_by_seq.setdefault(batch.seq_id[i][0], []).append(batch.token[i])
+            if batch.logits[i]:
+                row = (ctypes.c_float * N_VOCAB)()
+                row[(batch.token[i] + 1) % N_VOCAB] = 10.0
+                ctx.rows[i] = row
+        ctx.embeddings = {}
+        for seq_id, tokens in tokens_by_seq.items():
+            vector = (ctypes.c_float * N_EMBD)()
+            vector[0] = float(np.mean(tokens))
+            vector[1] = float(len(tokens))
+            ctx.embeddings[seq_id] = vector
+        return 0
+
+    binding.llama_context_default_params = lambda: types.SimpleNamespace(pooling_type=pooling)
+    binding.llama_init_from_model = new_context
+    binding.llama_batch_init = lambda n_tokens, embd, n_seq: FakeBatch(n_tokens)
+    binding.llama_batch_free = lambda batch: None
+    binding.llama_free = lambda ctx: None
+    binding.llama_decode = decode
+    binding.llama_get_logits_ith = lambda ctx, i: ctypes.cast(ctx.rows[i], ctypes.POINTER(ctypes.c_float))
+    binding.llama_get_embeddings_seq = lambda ctx, seq_id: (
+        ctypes.cast(ctx.embeddings[seq_id], ctypes.POINTER(ctypes.c_float))
+        if seq_id in ctx.embeddings else None)
+    binding.llama_pooling_type = lambda ctx: ctx.params.pooling_type
+    binding.llama_kv_cache_seq_rm = lambda *args: None
+    binding.llama_kv_cache_clear = lambda ctx: None
+    return binding
+
+
+class FakeLlama:
+    model = object()
+    context_params = types.SimpleNamespace(n_threads=1, n_threads_batch=1)
+
+    def n_vocab(self):
+        return N_VOCAB
+
+    def n_embd(self):
+        return N_EMBD
+
+    def token_eos(self):
+        return EOS
+
+    def detokenize(self, tokens):
+        return "".join(chr(ord("a") + token) for token in tokens).encode()
+
+
+GREEDY = dict(max_tokens=4, temperature=0.0, top_k=40, top_p=0.95, repeat_penalty=1.0, stop=[])
+
+
+@pytest.fixture
+def binding(monkeypatch):
+    binding = make_binding()
+    monkeypatch.setattr(llama_batch, "llama_cpp", binding, raising=False)
+    return binding
+
+
+@pytest.fixture
+def batcher(binding):
+    batcher = llama_batch.ContinuousBatcher(FakeLlama(), max_concurrent=2, n_ctx=128, n_batch=4)
+    yield batcher
+    batcher.close()
+
+
+def test_submit_stops_on_eos(batcher):
+    result = batcher.submit([1, 2, 3, 4, 5, 6], GREEDY).result(timeout=5)
+    assert result["choices"][0] == {"text": "hi", "index": 0, "finish_reason": "stop"}
+    assert result["usage"] == {"prompt_tokens": 6, "completion_tokens": 2, "total_tokens": 8}
+
+
+def test_submit_stops_on_max_tokens_and_stop_string(batcher):
+    result = batcher.submit([1], GREEDY).result(timeout=5)
+    assert result["choices"][0]["text"] == "cdef"
+    assert result["choices"][0]["finish_reason"] == "length"
+
+    result = batcher.submit([1], dict(GREEDY, stop=["d"])).result(timeout=5)
+    assert result["choices"][0]["text"] == "c"
+    assert result["choices"][0]["finish_reason"] == "stop"
+
+
+def test_stream_yields_completion_chunks(batcher):
+    chunks = list(batcher.stream([1], GREEDY))
+    assert "".join(chunk["choices"][0]["text"] for chunk in chunks) == "cdef"
+    assert chunks[-1]["choices"][0]["finish_reason"] == "length"
+
+
+def test_rejects_requests_larger_than_kv_cache(batcher):
+    with pytest.raises(ValueError):
+        batcher.submit([1] * 130, GREEDY).result(timeout=5)
+
+
+def test_many_concurrent_requests_release_all_slots(binding):
+    batcher = llama_batch.ContinuousBatcher(FakeLlama(), max_concurrent=3, n_ctx=200, n_batch=8)
+    rng = random.Random(0)
+    requests = []
+    for _ in range(40):
+        prompt = [rng.randrange(EOS) for _ in range(rng.randrange(1, 40))]
+        max_tokens = rng.randrange(1, 8)
+        requests.append((prompt, max_tokens, batcher.submit(prompt, dict(GREEDY, max_tokens=max_tokens))))
+    try:
+        for prompt, max_tokens, future in requests:
+            result = future.result(timeout=10)
+            # Greedy continuation of the last prompt token, cut at EOS or max_tokens
+            expected = []
+            token = prompt[-1]
+            while len(expected) < max_tokens:
+                token = (token + 1) % N_VOCAB
+                if token == EOS:
+                    break
+                expected.append(token)
+            assert result["choices"][0]["text"] == FakeLlama().detokenize(expected).decode()
+        assert batcher._kv_used == 0
+        assert sorted(batcher._free_ids) == [0, 1, 2]
+    finally:
+        batcher.close()
+
+
+def test_submit_after_close_fails(binding):
+    batcher = llama_batch.ContinuousBatcher(FakeLlama(), max_concurrent=2, n_ctx=64, n_batch=4)
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit([1], GREEDY).result(timeout=5)
+
+
+def test_embedding_pool_packs_texts_and_uses_mean_pooling(binding):
+    pool = llama_batch.EmbeddingContextPool(FakeLlama(), n_contexts=2, n_ctx=8, n_seq_max=2)
+    try:
+        # The last long text is truncated to n_ctx tokens; the empty text gets zeros
+        embeddings = pool.embed([[1, 3], [2], [4] * 10, []])
+    finally:
+        pool.close()
+    assert embeddings.dtype == np.float32
+    np.testing.assert_array_equal(embeddings, [[2.0, 2.0], [2.0, 1.0], [4.0, 8.0], [0.0, 0.0]])
+    # A generative model reports no pooling, so the pool switches its contexts to MEAN
+    assert binding.contexts[-1].params.pooling_type == binding.LLAMA_POOLING_TYPE_MEAN
@@ -0,0 +1,51 @@
+import os
+import sys
+import asyncio
+import threading
+
+import pytest
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.core.llm_external import ExternalLLMAdapter
+
+
+@pytest.fixture
+def adapter():
+    adapter = ExternalLLMAdapter({"external_api": {"url": "http://127.0.0.1:9/v1"}})
+    yield adapter
+    adapter.shutdown()
+
+
+def test_async_methods_run_the_health_check_off_the_callers_loop(adapter, monkeypatch):
+    probe_threads = []
+
+    def health_check():
+        probe_threads.append(threading.current_thread())
+        return True
+
+    async def fake_completion(**kwargs):
+        return {"choices": [{"text": "ok", "message": {"content": "ok"}, "finish_reason": "stop"}]}
+
+    monkeypatch.setattr(adapter.proxy, "health_check", health_check)
+    monkeypatch.setattr(adapter.async_proxy, "generate_completion", fake_completion)
+    monkeypatch.setattr(adapter.async_proxy, "generate_chat_completion", fake_completion)
+
+    async def run():
+        caller = threading.current_thread()
+        assert (await adapter.agenerate("hi")).text == "ok"
+        adapter._mark_request_failed()
+        assert (await adapter.achat([{"role": "user", "content": "hi"}])).text == "ok"
+        return caller
+
+    caller = asyncio.run(run())
+    assert len(probe_threads) == 2
+    assert all(thread is not caller for thread in probe_threads)
+
+
+def test_async_call_reports_connection_error(adapter, monkeypatch):
+    monkeypatch.setattr(adapter.proxy, "health_check", lambda: False)
+    response = asyncio.run(adapter.agenerate("hi"))
+    assert response.metadata == {"error": "connection_error"}
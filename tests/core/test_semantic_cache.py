@@ -0,0 +1,154 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from src.core import semantic_cache
+from src.core.semantic_cache import SemanticResponseCache
+from src.core.llm_external import ExternalLLMAdapter
+
+
+def unit(*values):
+    vector = np.zeros(8, dtype=np.float32)
+    vector[:len(values)] = values
+    return vector
+
+
+BACKENDS = ["numpy"] + (["hnswlib"] if semantic_cache.HAS_HNSWLIB else [])
+
+
+@pytest.fixture(params=BACKENDS)
+def make_cache(request, monkeypatch):
+    monkeypatch.setattr(semantic_cache, "HAS_HNSWLIB", request.param == "hnswlib")
+    return SemanticResponseCache
+
+
+def test_put_get_hit_and_miss(make_cache):
+    cache = make_cache(threshold=0.9, max_entries=4)
+    cache.put(unit(1.0), "answer-a")
+    cache.put(unit(0.0, 1.0), "answer-b")
+
+    response, similarity = cache.get(unit(1.0, 0.05))
+    assert response == "answer-a"
+    assert similarity > 0.9
+    assert cache.get(unit(0.0, 0.0, 1.0)) is None
+    assert cache.get(np.zeros(8, dtype=np.float32)) is None
+
+
+def test_context_mismatch_does_not_hide_other_hits(make_cache):
+    cache = make_cache(threshold=0.9, max_entries=8)
+    cache.put(unit(1.0, 0.1), "other-model", context="model-b")
+    cache.put(unit(1.0), "this-model", context="model-a")
+
+    # The nearest entry (model-b) has the wrong context; the next one matches
+    response, _ = cache.get(unit(1.0, 0.1), context="model-a")
+    assert response == "this-model"
+    assert cache.get(unit(1.0), context="model-c") is None
+
+
+def test_lru_eviction(make_cache):
+    cache = make_cache(threshold=0.99, max_entries=2)
+    cache.put(unit(1.0), "a")
+    cache.put(unit(0.0, 1.0), "b")
+    assert cache.get(unit(1.0))[0] == "a"  # "b" is now least recently used
+
+    cache.put(unit(0.0, 0.0, 1.0), "c")
+    assert len(cache) == 2
+    assert cache.get(unit(0.0, 1.0)) is None
+    assert cache.get(unit(1.0))[0] == "a"
+    assert cache.get(unit(0.0, 0.0, 1.0))[0] == "c"
+
+
+def test_expired_entry_is_replaced(make_cache, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(semantic_cache.time, "time", lambda: now[0])
+    cache = make_cache(threshold=0.9, max_entries=2, ttl_seconds=10)
+    cache.put(unit(1.0), "old")
+    now[0] += 60
+    assert cache.get(unit(1.0)) is None
+    assert len(cache) == 0
+
+    # A put after expiry takes over the freed index slot
+    cache.put(unit(0.0, 1.0), "b")
+    cache.put(unit(1.0), "new")
+    assert cache.get(unit(1.0))[0] == "new"
+    assert cache.get(unit(0.0, 1.0))[0] == "b"
+
+
+def test_many_evictions_keep_labels_consistent(make_cache):
+    cache = make_cache(threshold=0.999, max_entries=3)
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((20, 8)).astype(np.float32)
+    for i, vector in enumerate(vectors):
+        cache.put(vector, i)
+    assert len(cache) == 3
+    for i in (17, 18, 19):
+        assert cache.get(vectors[i])[0] == i
+    assert cache.get(vectors[0]) is None
+
+
+def test_clear(make_cache):
+    cache = make_cache(threshold=0.9)
+    cache.put(unit(1.0), "a")
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.get(unit(1.0)) is None
+    cache.put(unit(1.0), "b")
+    assert cache.get(unit(1.0))[0] == "b"
+
+
+def test_interleaved_expiry_and_eviction(make_cache, monkeypatch):
+    # Regression: after expiry and a re-put, hnswlib labels drifted from the
+    # entries and get() raised "Label not found"
+    now = [0.0]
+    monkeypatch.setattr(semantic_cache.time, "time", lambda: now[0])
+    rng = np.random.default_rng(1)
+    for _ in range(50):
+        cache = make_cache(threshold=0.999, max_entries=4, ttl_seconds=5)
+        vectors = rng.standard_normal((6, 8)).astype(np.float32)
+        for _ in range(30):
+            i = int(rng.integers(6))
+            op = rng.integers(3)
+            if op == 0:
+                cache.put(vectors[i], i)
+            elif op == 1:
+                hit = cache.get(vectors[i])
+                assert hit is None or hit[0] == i
+            else:
+                now[0] += 3
+
+
+@pytest.mark.parametrize("method", ["generate", "chat"])
+def test_adapter_reuses_responses_only_for_the_same_stop_list(monkeypatch, method):
+    adapter = ExternalLLMAdapter({"external_api": {"url": "http://127.0.0.1:9/v1"},
+                                  "semantic_cache": {"enabled": True}})
+    adapter.connected = True
+    calls = []
+
+    async def fake_request(**kwargs):
+        calls.append(kwargs["stop"])
+        return {"choices": [{"text": f"answer-{len(calls)}", "message": {"content": f"answer-{len(calls)}"},
+                             "finish_reason": "stop"}],
+                "usage": {"total_tokens": 3}}
+
+    monkeypatch.setattr(adapter, "get_embeddings", lambda texts: [unit(1.0)])
+    monkeypatch.setattr(adapter.async_proxy, "generate_completion", fake_request)
+    monkeypatch.setattr(adapter.async_proxy, "generate_chat_completion", fake_request)
+    query = "Hello" if method == "generate" else [{"role": "user", "content": "Hello"}]
+    call = getattr(adapter, method)
+
+    try:
+        first = call(query)
+        assert call(query).text == first.text  # semantic hit
+        with_stop = call(query, stop=["\n"])
+        assert with_stop.text != first.text
+        assert call(query, stop="\n").text == with_stop.text
+        assert call(query, stop=["\n", "###"]).text not in (first.text, with_stop.text)
+    finally:
+        adapter.shutdown()
+    assert calls == [None, ["\n"], ["\n", "###"]]